@@ -1,969 +1,965 @@
-from flask import Flask, render_template, jsonify, request
-import json
+# Cooperative sockets, locks and worker pipes when served by eventlet
+try:
+    import eventlet
+
+    eventlet.monkey_patch()
+except ImportError:
+    pass
+
+from flask import Flask, render_template, jsonify, request, Response, session, g
+from flask_socketio import SocketIO
+from socketio.packet import EVENT, Packet
+from src.room import (
+    MAX_QUEUED_COMMANDS,
+    RoomRegistry,
+    RoomLimitError,
+    RoomUnavailableError,
+    VALID_ROOM_ID,
+    new_room_id,
+)
+from src.shard import ShardPool, WorkerError
+from src.game import reset_game_state, step_world
+from src.inputs import input_frame
+from src.level import load_level
+from src.metrics import BYTE_BUCKETS, CONTENT_TYPE, TIME_BUCKETS, Registry
+from src.profiling import MAX_PROFILE_SECONDS, PROFILE_KINDS, RoomProfiler
+from src.replay import MatchRecorder
+from src.snapshot import ENTITY_TYPES, parse_viewport
+from src.timers import CLOCK_OFFSET, game_clock
+import hashlib
+import hmac
 import os
-import math
 import time
-import random
+import threading
 
 app = Flask(__name__)
+app.secret_key = os.environ.get("SECRET_KEY") or os.urandom(16).hex()
+socketio = SocketIO(app)
+
+# Simulation tick rate (ticks per second). Size this to the hardware.
+TICK_RATE = int(os.environ.get("TICK_RATE", 30))
+TICK_INTERVAL = 1.0 / TICK_RATE
+# Number of missed ticks the loop may replay before it drops time
+MAX_CATCHUP_TICKS = 5
+# Milliseconds of AI work per room and tick; AI tanks that do not fit are
+# deferred to the next tick. 0 disables the budget.
+AI_TICK_BUDGET = float(os.environ.get("AI_TICK_BUDGET", 5)) / 1000 or None
+# Seconds a request waits for the tick loop to run its command in a room
+ROOM_COMMAND_TIMEOUT = 5
+# Frames per second pushed to spectators, at most one per tick
+SPECTATOR_RATE = min(float(os.environ.get("SPECTATOR_RATE", 10)), TICK_RATE)
+if not SPECTATOR_RATE > 0:
+    raise ValueError("SPECTATOR_RATE must be a positive number of frames per second")
+# Packets that may wait on a spectator's connection; frames for a spectator
+# further behind are dropped until it catches up
+SPECTATOR_BACKLOG = int(os.environ.get("SPECTATOR_BACKLOG", 4))
+
+simulation_task = None
+startup_lock = threading.Lock()
+# Rooms owned by this process; the tick loop only steps running ones
+rooms = RoomRegistry(
+    idle_timeout=int(os.environ.get("ROOM_IDLE_TIMEOUT", 300)),
+    max_rooms=int(os.environ.get("MAX_ROOMS", 10000)),
+)
+# How often idle rooms are swept, in seconds
+ROOM_SWEEP_INTERVAL = 30
+
+# With SIM_WORKERS > 0 rooms are simulated by that many worker processes
+# and this process only routes HTTP and socket traffic to their owners.
+SIM_WORKERS = int(os.environ.get("SIM_WORKERS", 0))
+# How often room placement across workers is re-evaluated, in seconds
+REBALANCE_INTERVAL = int(os.environ.get("REBALANCE_INTERVAL", 10))
+shards = None
+
+# With RECORD_DIR set, every match is recorded there for src/replay.py
+RECORD_DIR = os.environ.get("RECORD_DIR")
+
+# With ADMIN_TOKEN set, the admin endpoints accept it as a bearer token;
+# unset, they do not exist
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Where room profiles are written, by whichever process owns the room
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# Seconds spent ticking since the last load report, and when that began
+tick_busy = 0.0
+load_window_start = time.monotonic()
+
+# Socket client -> room, last applied (acked) and last sent sequence,
+# format and viewport
+socket_clients = {}
+# Read-only socket clients -> room, last sent sequence, format, viewport and
+# Engine.IO id
+spectators = {}
+# Watch token -> room id, for the rooms whose page was served lately. The
+# token only lets a spectator read the room; the room id lets anyone play.
+watched_rooms = {}
+watch_lock = threading.Lock()
+
+# Served at /api/metrics. With SIM_WORKERS set the simulation metrics live
+# in the workers and are summed with this process's at every scrape.
+metrics = Registry()
+tick_seconds = metrics.histogram(
+    "tank_tick_seconds",
+    "Seconds a process spends stepping all its running rooms once",
+    TIME_BUCKETS,
+)
+room_tick_seconds = metrics.histogram(
+    "tank_room_tick_seconds",
+    "Seconds spent stepping one room once, snapshot included",
+    TIME_BUCKETS,
+)
+phase_seconds = metrics.counter(
+    "tank_phase_seconds_total",
+    "Seconds spent in each simulation phase, capturing and serializing snapshots",
+    "phase",
+)
+request_seconds = metrics.histogram(
+    "tank_request_seconds", "HTTP request latency by route", TIME_BUCKETS, "route"
+)
+snapshot_bytes = metrics.histogram(
+    "tank_snapshot_bytes",
+    "Size of the snapshots sent to clients, by encoding",
+    BYTE_BUCKETS,
+    "format",
+)
+snapshot_not_modified = metrics.counter(
+    "tank_snapshot_not_modified_total",
+    "State polls answered with 304 because the client had the latest tick",
+)
+room_count = metrics.gauge(
+    "tank_rooms", "Rooms held, by whether they run a match", "state"
+)
+entity_count = metrics.gauge(
+    "tank_entities", "Entities in the running matches, by type", "type"
+)
+socket_client_count = metrics.gauge(
+    "tank_socket_clients", "Connected Socket.IO clients"
+)
+spectator_count = metrics.gauge("tank_spectators", "Connected spectators")
+spectator_frames = metrics.counter(
+    "tank_spectator_frames_total",
+    "Frames for spectators, sent or dropped for a backed-up connection",
+    "result",
+)
+ai_decisions = metrics.counter(
+    "tank_ai_decisions_total",
+    "AI decisions skipped by level of detail or deferred by the tick budget",
+    "result",
+)
+
+
+def requested_room_id():
+    # Explicit ?room= (or "room" in a JSON body) wins over the session
+    room_id = request.args.get("room")
+    if room_id is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            room_id = data.get("room")
+    if room_id is None:
+        room_id = session.get("room")
+    if isinstance(room_id, str) and VALID_ROOM_ID.match(room_id):
+        return room_id
+    return None
+
+
+def current_room_id():
+    # Route the caller to their room, picking a new id on first contact; the
+    # room itself is only opened when a match is started in it
+    room_id = requested_room_id() or new_room_id()
+    if session.get("room") != room_id:
+        session["room"] = room_id
+    return room_id
+
+
+def watch_token(room_id):
+    # The token spectators of a room use instead of its id, registered so
+    # that it can be resolved back
+    token = hmac.new(
+        app.secret_key.encode(), f"watch:{room_id}".encode(), hashlib.sha256
+    ).hexdigest()[:24]
+    with watch_lock:
+        watched_rooms.pop(token, None)
+        watched_rooms[token] = room_id
+        while len(watched_rooms) > rooms.max_rooms:
+            del watched_rooms[next(iter(watched_rooms))]
+    return token
+
+
+def watched_room_id():
+    # The room a ?watch=<token> request watches; None if unknown
+    return watched_rooms.get(request.args.get("watch"))
+
+
+def room_call(room_id, op, *args):
+    # Run a room operation wherever the room lives
+    if shards is None:
+        return ROOM_OPS[op](room_id, *args)
+    return shards.call(room_id, op, *args)
+
+
+def room_cast(room_id, op, *args):
+    # Like room_call, without waiting for the result
+    if shards is None:
+        ROOM_OPS[op](room_id, *args)
+    else:
+        shards.cast(room_id, op, *args)
 
-# Game state
-game_state = {
-    "tanks": [
-        {
-            "id": 1,
-            "x": 100,
-            "y": 100,
-            "angle": 0,
-            "health": 200,
-            "color": "green",
-            "barrels": 1,
-        },
-        {
-            "id": 2,
-            "x": 700,
-            "y": 500,
-            "angle": 180,
-            "health": 100,
-            "color": "blue",
-            "barrels": 1,
-        },
-    ],
-    "projectiles": [],
-    "rewards": [],
-    "gameActive": False,
-    "mapWidth": 800,
-    "mapHeight": 600,
-    "lastUpdate": time.time(),
-    "lastRewardSpawn": time.time(),
-    "lastAIUpdate": time.time(),
-    "lastAIShot": time.time(),
-    "aiState": "patrol",  # patrol, pursue, attack
-    "currentLevel": 1,
-    "enemiesDefeated": 0,
-    "enemiesRequired": 1,  # Number of enemies to defeat for level 1
-    "maxEnemies": 1,  # Maximum enemies on screen at once for level 1
-    "nextEnemySpawn": 0,  # Time when next enemy should spawn
-}
 
-# Reward types - Increased base barrel duration from 30 to 45 seconds
-REWARD_TYPES = [
-    {
-        "type": "barrel",
-        "color": "purple",
-        "duration": 45,
-        "radius": 15,
-        "stackable": True,
-    },
-    {
-        "type": "health",
-        "color": "red",
-        "duration": 0,
-        "radius": 15,
-        "stackable": False,
-    },  # Health pack is instant
-    # New reward type: Double damage
-    {
-        "type": "damage",
-        "color": "orange",
-        "duration": 30,
-        "radius": 15,
-        "stackable": True,
-    },
-]
-
-# Enemy colors for different levels
-ENEMY_COLORS = ["blue", "red", "darkviolet", "darkgoldenrod", "darkcyan"]
-
-# Level configuration
-LEVEL_CONFIG = {
-    1: {"enemies_required": 1, "max_enemies": 1, "spawn_delay": 0, "ai_skill": 0.5},
-    2: {"enemies_required": 3, "max_enemies": 1, "spawn_delay": 5, "ai_skill": 0.6},
-    3: {"enemies_required": 5, "max_enemies": 2, "spawn_delay": 4, "ai_skill": 0.7},
-    4: {"enemies_required": 8, "max_enemies": 2, "spawn_delay": 3, "ai_skill": 0.8},
-    5: {"enemies_required": 12, "max_enemies": 3, "spawn_delay": 2, "ai_skill": 0.9},
-}
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    # Latency per route pattern; unknown paths share one series
+    started = g.get("request_started")
+    if started is not None:
+        rule = request.url_rule
+        request_seconds.observe(
+            time.perf_counter() - started, rule.rule if rule else "unmatched"
+        )
+    return response
+
+
+@app.errorhandler(RoomLimitError)
+def room_limit_reached(error):
+    return jsonify({"status": "error", "message": str(error)}), 503
+
+
+@app.errorhandler(RoomUnavailableError)
+def room_unavailable(error):
+    return jsonify({"status": "error", "message": str(error)}), 503
+
+
+@app.errorhandler(WorkerError)
+def worker_unavailable(error):
+    app.logger.error("%s", error)
+    return jsonify({"status": "error", "message": "Simulation unavailable"}), 503
 
 
 @app.route("/")
 def index():
-    return render_template("index.html")
+    if "watch" in request.args:
+        # Spectators get the watch token only, never the room id
+        return render_template(
+            "index.html", room_id="", watch_token=request.args["watch"], spectating=True
+        )
+    room_id = current_room_id()
+    return render_template(
+        "index.html", room_id=room_id, watch_token=watch_token(room_id)
+    )
 
 
-@app.route("/api/game-state")
-def get_game_state():
-    # Update projectiles and check for reward spawning on each state request
-    current_time = time.time()
-    elapsed = current_time - game_state["lastUpdate"]
+@app.route("/api/rooms", methods=["POST"])
+def create_room():
+    room_id = new_room_id()
+    room_call(room_id, "open")
+    return jsonify({"room": room_id})
 
-    if game_state["gameActive"]:
-        update_projectiles(elapsed)
-        check_reward_spawn(current_time)
-        update_ai(current_time)
-        check_enemy_spawn(current_time)
-        game_state["lastUpdate"] = current_time
 
-    return jsonify(game_state)
+@app.route("/api/game-state")
+def get_game_state():
+    # Read-only: the world is advanced by the simulation loop, not by polling.
+    # Pass ?since=<seq> to receive only what changed after that snapshot,
+    # and ?format=binary for the packed encoding from src/wire.py. With
+    # ?view=<width>x<height> only what is around the player's camera is
+    # sent. The ETag names the room's tick, so polling faster than the tick
+    # rate is answered with 304 and no body.
+    since = request.args.get("since", type=int)
+    binary = request.args.get("format") == "binary"
+    # Spectators read with ?watch=<token>, players with their room
+    room_id = watched_room_id() if "watch" in request.args else current_room_id()
+    if room_id is None:
+        return jsonify({"status": "error", "message": "Unknown room"}), 404
+    state = room_call(
+        room_id,
+        "state",
+        since,
+        binary,
+        parse_viewport(request.args.get("view")),
+        tuple(request.if_none_match.as_set()),
+    )
+    if state is None:
+        return jsonify({"status": "error", "message": "Unknown room"}), 404
+    etag, payload = state
+    if payload is None:
+        response = Response(status=304)
+        snapshot_not_modified.inc()
+    elif binary:
+        response = Response(payload, mimetype="application/octet-stream")
+        snapshot_bytes.observe(len(payload), "binary")
+    else:
+        response = Response(payload, mimetype="application/json")
+        snapshot_bytes.observe(len(payload), "json")
+    response.set_etag(etag)
+    # Cacheable, as long as it is checked against the ETag every time
+    response.cache_control.no_cache = True
+    return response
+
+
+def tick_rooms(current_time):
+    # The tick loop is the only writer of room state: requests reach a room
+    # as commands, run here before its step, so no room needs a lock
+    stepped = False
+    tick_started = time.perf_counter()
+    for room in rooms.busy_rooms():
+        try:
+            run_commands(room, current_time)
+            # Only rooms with a running match cost anything per tick
+            if room.active and rooms.get(room.room_id) is room:
+                step_room(room, current_time)
+                stepped = True
+        except Exception:
+            # One broken room must not stop the others
+            app.logger.exception("Room %s failed and was dropped", room.room_id)
+            drop_room(room)
+    if stepped:
+        tick_seconds.observe(time.perf_counter() - tick_started)
+
+
+def step_room(room, current_time):
+    global tick_busy
+    started = time.perf_counter()
+    profiler = room.profiler
+    if profiler is not None:
+        profiler.resume()
+    if room.recorder is not None:
+        room.recorder.tick(current_time, room.state["inputQueue"])
+    room.clock.now = current_time
+    scheduler = room.state["aiScheduler"]
+    skipped, deferred = scheduler.skipped, scheduler.deferred
+    step_world(room, current_time, TICK_INTERVAL, phase_seconds.values)
+    # The scheduler's counts start over with every match; the counters do not
+    ai_decisions.inc(scheduler.skipped - skipped, "skipped")
+    ai_decisions.inc(scheduler.deferred - deferred, "deferred")
+    cut = scheduler.cut
+    if cut is not None and room.recorder is not None:
+        room.recorder.ai_limit(cut)
+    # Number every active tick, including the one that ended the game
+    captured = time.perf_counter()
+    room.snapshots.capture(room.state)
+    phase_seconds.inc(time.perf_counter() - captured, "snapshot")
+    if not room.active:
+        finish_recording(room)
+    if profiler is not None:
+        profiler.pause()
+        if profiler.done() or not room.active:
+            finish_profile(room)
+    spent = time.perf_counter() - started
+    room.cost += (spent - room.cost) * 0.1
+    tick_busy += spent
+    room_tick_seconds.observe(spent)
+
+
+def drop_room(room):
+    # Remove a room whose step failed, failing whatever still waits on it
+    rooms.remove(room.room_id)
+    while room.commands:
+        _, _, waiter = room.commands.popleft()
+        if waiter is not None:
+            waiter.append((False, RoomUnavailableError("Room failed")))
+            waiter[0].set()
+    for finish in (finish_recording, finish_profile):
+        try:
+            finish(room)
+        except Exception:
+            app.logger.exception("Room %s could not be closed", room.room_id)
+
+
+def run_commands(room, current_time):
+    # Apply what was posted to the room since the last tick, in order
+    commands = room.commands
+    while commands:
+        name, args, waiter = commands.popleft()
+        try:
+            result = (True, ROOM_COMMANDS[name](room, current_time, *args))
+        except Exception as error:
+            if waiter is None:
+                app.logger.exception("Room %s command %s failed", room.room_id, name)
+                continue
+            result = (False, error)
+        if waiter is not None:
+            waiter.append(result)
+            waiter[0].set()
+
+
+def room_command(room, name, *args):
+    # Post a command to the room and wait for the tick loop to run it; at
+    # most one tick, unless the loop is stuck
+    done = threading.Event()
+    waiter = [done]
+    rooms.post(room, (name, args, waiter))
+    if not done.wait(ROOM_COMMAND_TIMEOUT):
+        raise RoomUnavailableError("Room did not respond")
+    ok, result = waiter[1]
+    if not ok:
+        raise result
+    return result
+
+
+def push_frames():
+    # Send each socket client what changed since the sequence it acked
+    subscriptions = {}
+    for sid, client in list(socket_clients.items()):
+        subscriptions.setdefault(client["room"], []).append(
+            (sid, client["ack"], client["sent"], client["binary"], client["view"])
+        )
+    if not subscriptions:
+        return
 
+    if shards is None:
+        frames = collect_frames(subscriptions)
+    else:
+        frames = []
+        for index, room_ids in shards.group_by_worker(subscriptions).items():
+            frames.extend(
+                shards.workers[index].call(
+                    "frames", {room_id: subscriptions[room_id] for room_id in room_ids}
+                )
+            )
 
-def check_enemy_spawn(current_time):
-    # Only proceed if we're supposed to spawn a new enemy
-    if current_time < game_state["nextEnemySpawn"]:
+    for sid, seq, payload in frames:
+        client = socket_clients.get(sid)
+        if client is not None:
+            client["sent"] = seq
+            # JSON frames are serialized by Socket.IO and go unmeasured
+            if isinstance(payload, bytes):
+                snapshot_bytes.observe(len(payload), "binary")
+            socketio.emit("state", payload, to=sid)
+
+
+def broadcast_frames():
+    # Spectators of a room share its frames: one per format, viewport and
+    # sequence they last received, encoded once and queued as is on each
+    # connection
+    channels = {}
+    for sid, spectator in list(spectators.items()):
+        group = (spectator["binary"], spectator["view"], spectator["sent"])
+        channels.setdefault(spectator["room"], {}).setdefault(group, []).append(sid)
+    if not channels:
         return
 
-    # Count current active AI tanks
-    active_enemies = 0
-    for tank in game_state["tanks"]:
-        if tank["id"] != 1 and tank["health"] > 0:
-            active_enemies += 1
-
-    # Get configuration for current level
-    level_conf = LEVEL_CONFIG.get(game_state["currentLevel"], LEVEL_CONFIG[5])
-
-    # If we have fewer enemies than the maximum allowed, spawn a new one
-    if active_enemies < level_conf["max_enemies"]:
-        # Find the highest ID currently in use
-        max_id = 1
-        for tank in game_state["tanks"]:
-            if tank["id"] > max_id:
-                max_id = tank["id"]
-
-        # Create new enemy with next ID
-        new_id = max_id + 1
-
-        # Pick a spawn position away from player
-        player_tank = None
-        for tank in game_state["tanks"]:
-            if tank["id"] == 1:
-                player_tank = tank
-                break
-
-        if player_tank:
-            # Try to spawn away from the player
-            spawn_x, spawn_y = get_spawn_position(player_tank)
-
-            # Get color based on level (cycling through available colors)
-            color_index = (game_state["currentLevel"] - 1) % len(ENEMY_COLORS)
-            enemy_color = ENEMY_COLORS[color_index]
-
-            # New enemy tank
-            enemy_health = 100  # Standard health for enemies
-            enemy_tank = {
-                "id": new_id,
-                "x": spawn_x,
-                "y": spawn_y,
-                "angle": random.randint(0, 359),
-                "health": enemy_health,
-                "maxHealth": enemy_health,  # Ensure maxHealth matches initial health
-                "color": enemy_color,
-                "barrels": 1,
-                "ai_skill": level_conf["ai_skill"],
-            }
-
-            game_state["tanks"].append(enemy_tank)
-
-            # Set next spawn time based on level configuration
-            game_state["nextEnemySpawn"] = current_time + level_conf["spawn_delay"]
-
-
-def get_spawn_position(player_tank):
-    """Get a spawn position for a new enemy, away from the player."""
-    map_width = game_state["mapWidth"]
-    map_height = game_state["mapHeight"]
-
-    # Try to find a position that's at least 300 pixels away from the player
-    for _ in range(10):  # Try 10 times
-        # Pick a quadrant opposite to the player
-        if player_tank["x"] < map_width / 2:
-            spawn_x = random.randint(int(map_width * 0.6), int(map_width * 0.9))
-        else:
-            spawn_x = random.randint(int(map_width * 0.1), int(map_width * 0.4))
+    requests = {room_id: list(groups) for room_id, groups in channels.items()}
+    if shards is None:
+        frames = collect_broadcasts(requests)
+    else:
+        frames = {}
+        for index, room_ids in shards.group_by_worker(requests).items():
+            frames.update(
+                shards.workers[index].call(
+                    "broadcasts", {room_id: requests[room_id] for room_id in room_ids}
+                )
+            )
 
-        if player_tank["y"] < map_height / 2:
-            spawn_y = random.randint(int(map_height * 0.6), int(map_height * 0.9))
+    eio = socketio.server.eio
+    sent = dropped = 0
+    for room_id, (seq, payloads) in frames.items():
+        for group, payload in zip(requests[room_id], payloads):
+            if payload is None:
+                continue
+            parts = Packet(EVENT, namespace="/", data=["state", payload]).encode()
+            if not isinstance(parts, list):
+                parts = [parts]
+            for sid in channels[room_id][group]:
+                spectator = spectators.get(sid)
+                if spectator is None:
+                    continue
+                socket = eio.sockets.get(spectator["eio_sid"])
+                if socket is None:
+                    continue
+                # A slow consumer misses frames rather than queueing them;
+                # its next one is a delta from the last it was sent
+                if socket.queue.qsize() > SPECTATOR_BACKLOG:
+                    dropped += 1
+                    continue
+                for part in parts:
+                    eio.send(spectator["eio_sid"], part)
+                spectator["sent"] = seq
+                sent += 1
+    spectator_frames.inc(sent, "sent")
+    spectator_frames.inc(dropped, "dropped")
+
+
+def spectator_loop():
+    # Spectators get frames at their own rate, apart from the tick loop
+    interval = 1.0 / SPECTATOR_RATE
+    next_frame = time.monotonic()
+    while True:
+        try:
+            broadcast_frames()
+        except Exception:
+            app.logger.exception("Broadcasting to spectators failed")
+        next_frame = max(next_frame + interval, time.monotonic())
+        socketio.sleep(next_frame - time.monotonic())
+
+
+def simulation_loop(simulate=True, push=True):
+    next_tick = time.monotonic()
+    next_sweep = next_tick + ROOM_SWEEP_INTERVAL
+
+    while True:
+        # Run every step that is due, replaying a few if we fell behind
+        steps = 0
+        while time.monotonic() >= next_tick and steps < MAX_CATCHUP_TICKS:
+            if simulate:
+                tick_rooms(next_tick + CLOCK_OFFSET)
+            next_tick += TICK_INTERVAL
+            steps += 1
+
+        if push and steps:
+            try:
+                push_frames()
+            except Exception:
+                app.logger.exception("Pushing frames failed")
+
+        if simulate and time.monotonic() >= next_sweep:
+            rooms.expire(game_clock())
+            next_sweep = time.monotonic() + ROOM_SWEEP_INTERVAL
+
+        # Too far behind to catch up: drop the backlog instead of spiralling
+        if time.monotonic() - next_tick > MAX_CATCHUP_TICKS * TICK_INTERVAL:
+            next_tick = time.monotonic()
+
+        socketio.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+def rebalance_loop():
+    while True:
+        socketio.sleep(REBALANCE_INTERVAL)
+        try:
+            shards.rebalance()
+        except Exception:
+            app.logger.exception("Rebalancing rooms failed")
+
+
+@app.before_first_request
+def start_simulation_loop():
+    global simulation_task, shards
+    with startup_lock:
+        if simulation_task is not None:
+            return
+        if SIM_WORKERS > 0:
+            # Workers simulate; this process only routes and pushes frames
+            shards = ShardPool(SIM_WORKERS, "app:ROOM_OPS")
+            shards.start()
+            socketio.start_background_task(rebalance_loop)
+            simulation_task = socketio.start_background_task(
+                simulation_loop, False, True
+            )
         else:
-            spawn_y = random.randint(int(map_height * 0.1), int(map_height * 0.4))
+            simulation_task = socketio.start_background_task(simulation_loop)
+        socketio.start_background_task(spectator_loop)
+
+
+@socketio.on("connect")
+def socket_connect():
+    start_simulation_loop()
+    # Snapshot format and viewport are negotiated once per connection
+    binary = request.args.get("format") == "binary"
+    view = parse_viewport(request.args.get("view"))
+    if "watch" in request.args:
+        # Spectators watch a room by its watch token and cannot send input
+        room_id = watched_room_id()
+        if room_id is None:
+            return False
+        spectators[request.sid] = {
+            "room": room_id,
+            "sent": None,
+            "binary": binary,
+            "view": view,
+            "eio_sid": socketio.server.manager.eio_sid_from_sid(request.sid, "/"),
+        }
+        return
+    socket_clients[request.sid] = {
+        "room": current_room_id(),
+        "ack": None,
+        "sent": None,
+        "binary": binary,
+        "view": view,
+    }
 
-        # Check distance to player
-        dx = player_tank["x"] - spawn_x
-        dy = player_tank["y"] - spawn_y
-        distance = math.sqrt(dx * dx + dy * dy)
 
-        if distance > 300:
-            return spawn_x, spawn_y
+@socketio.on("disconnect")
+def socket_disconnect():
+    socket_clients.pop(request.sid, None)
+    spectators.pop(request.sid, None)
 
-    # If we couldn't find a good spot, return a random position
-    return random.randint(50, map_width - 50), random.randint(50, map_height - 50)
 
+@socketio.on("ack")
+def socket_ack(data):
+    # Last snapshot sequence the client applied; later pushes are deltas
+    client = socket_clients.get(request.sid)
+    if client is not None:
+        client["ack"] = data.get("seq")
 
-def update_ai(current_time):
-    # Update all AI tanks
-    player_tank = None
 
-    # First, find the player tank
-    for tank in game_state["tanks"]:
-        if tank["id"] == 1:
-            player_tank = tank
-            break
+@socketio.on("input")
+def socket_input(data):
+    # Same payload as POST /api/update, streamed over the open connection
+    client = socket_clients.get(request.sid)
+    frame = input_frame(data)
+    if client is not None and frame is not None:
+        room_cast(client["room"], "input", frame)
 
-    if not player_tank or player_tank["health"] <= 0:
-        return  # Player is dead, no need to update AI
 
-    # Update each AI tank
-    for ai_tank in game_state["tanks"]:
-        if (
-            ai_tank["id"] != 1 and ai_tank["health"] > 0
-        ):  # Skip player tank and dead tanks
-            update_ai_tank(ai_tank, player_tank, current_time)
+# Room operations. These run in whichever process owns the room: this one,
+# or a simulation worker reached through the shard pool.
 
 
-def update_ai_tank(ai_tank, player_tank, current_time):
-    # Calculate distance to player
-    dx = player_tank["x"] - ai_tank["x"]
-    dy = player_tank["y"] - ai_tank["y"]
-    distance_to_player = math.sqrt(dx * dx + dy * dy)
+def open_room(room_id):
+    rooms.join(room_id, game_clock())
 
-    # Calculate angle to player
-    angle_to_player = math.degrees(math.atan2(dx, -dy)) % 360
 
-    # AI skill factor (higher levels have smarter AI)
-    ai_skill = ai_tank.get("ai_skill", 0.5)
+def start_room(room_id):
+    room_command(rooms.join(room_id, game_clock()), "start")
 
-    # Update AI state based on distance to player
-    if distance_to_player > 300:
-        ai_state = "patrol"
-    elif distance_to_player > 150:
-        ai_state = "pursue"
-    else:
-        ai_state = "attack"
-
-    # Perform actions based on AI state
-    if ai_state == "patrol":
-        # In patrol mode, move randomly and look for rewards
-        if current_time - ai_tank.get("lastUpdate", 0) > 1.0:
-            # Every second, potentially change direction
-            if (
-                random.random() < 0.7 * ai_skill
-            ):  # Higher skill means better at finding rewards
-                # Check if there are any rewards to move toward
-                closest_reward = None
-                min_distance = float("inf")
-
-                for reward in game_state["rewards"]:
-                    rx = reward["x"] - ai_tank["x"]
-                    ry = reward["y"] - ai_tank["y"]
-                    distance = math.sqrt(rx * rx + ry * ry)
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_reward = reward
-
-                if closest_reward:
-                    # Calculate angle to reward
-                    rx = closest_reward["x"] - ai_tank["x"]
-                    ry = closest_reward["y"] - ai_tank["y"]
-                    angle_to_reward = math.degrees(math.atan2(rx, -ry)) % 360
-
-                    # Rotate toward reward
-                    rotate_tank_to_angle(ai_tank, angle_to_reward)
-                    # Move forward toward reward
-                    move_tank_forward(ai_tank)
-
-                    # If close to reward, try to collect it
-                    if min_distance < 50:
-                        check_reward_collision(ai_tank)
-                else:
-                    # No reward found, move randomly
-                    ai_tank["angle"] = (
-                        ai_tank["angle"] + random.randint(-30, 30)
-                    ) % 360
-                    move_tank_forward(ai_tank)
-            else:
-                # Random movement
-                ai_tank["angle"] = (ai_tank["angle"] + random.randint(-30, 30)) % 360
-                move_tank_forward(ai_tank)
-
-            ai_tank["lastUpdate"] = current_time
-
-    elif ai_state == "pursue":
-        # In pursue mode, move toward player but keep some distance
-        rotate_tank_to_angle(ai_tank, angle_to_player)
-
-        # Decide whether to move forward or backward to maintain distance
-        if distance_to_player > 250:
-            move_tank_forward(ai_tank)
-        elif distance_to_player < 200:
-            move_tank_backward(ai_tank)
-
-        # Occasionally fire at player
-        if current_time - ai_tank.get("lastShot", 0) > (
-            1.5 - (ai_skill * 0.5)
-        ):  # Higher skill = faster firing
-            if (
-                abs(ai_tank["angle"] - angle_to_player) < (20 - (ai_skill * 10))
-                and random.random() < ai_skill
-            ):
-                fire_tank_weapon(ai_tank)
-                ai_tank["lastShot"] = current_time
-
-    elif ai_state == "attack":
-        # In attack mode, aim and fire at player
-        rotate_tank_to_angle(ai_tank, angle_to_player)
-
-        # Keep optimal distance from player
-        if distance_to_player > 180:
-            move_tank_forward(ai_tank)
-        elif distance_to_player < 120:
-            move_tank_backward(ai_tank)
-
-        # If aimed at player, fire
-        if abs((ai_tank["angle"] - angle_to_player + 180) % 360 - 180) < (
-            15 - (ai_skill * 5)
-        ):  # Higher skill = better aim
-            if current_time - ai_tank.get("lastShot", 0) > (
-                1.0 - (ai_skill * 0.3)
-            ):  # Higher skill = faster firing
-                fire_tank_weapon(ai_tank)
-                ai_tank["lastShot"] = current_time
-
-            # Also consider strafing to avoid being hit
-            if random.random() < (
-                0.3 + (ai_skill * 0.2)
-            ):  # Higher skill = more evasive
-                if random.random() < 0.5:
-                    move_tank_left(ai_tank)
-                else:
-                    move_tank_right(ai_tank)
 
+def stop_room(room_id):
+    room = rooms.visit(room_id, game_clock())
+    if room is not None:
+        room_command(room, "stop")
 
-def rotate_tank_to_angle(tank, target_angle):
-    # Calculate the shortest rotation direction
-    current = tank["angle"]
-    target = target_angle
 
-    # Find the shortest angle difference
-    angle_diff = ((target - current + 180) % 360) - 180
+def room_input(room_id, frame):
+    room = rooms.visit(room_id, game_clock())
+    # Input for a room that does not exist is dropped, and so is input for a
+    # room flooded with commands, like a full input queue
+    if room is not None and len(room.commands) < MAX_QUEUED_COMMANDS:
+        rooms.post(room, ("input", (frame,), None))
 
-    # Apply a limited rotation (5 degrees per update)
-    if abs(angle_diff) > 5:
-        if angle_diff > 0:
-            tank["angle"] = (tank["angle"] + 5) % 360
-        else:
-            tank["angle"] = (tank["angle"] - 5) % 360
-    else:
-        tank["angle"] = target_angle
-
-
-def move_tank_forward(tank):
-    speed = 5
-    rad_angle = math.radians(tank["angle"])
-    tank["x"] += math.sin(rad_angle) * speed
-    tank["y"] -= math.cos(rad_angle) * speed
-    keep_tank_in_bounds(tank)
-
-
-def move_tank_backward(tank):
-    speed = 5
-    rad_angle = math.radians(tank["angle"])
-    tank["x"] -= math.sin(rad_angle) * speed
-    tank["y"] += math.cos(rad_angle) * speed
-    keep_tank_in_bounds(tank)
-
-
-def move_tank_left(tank):
-    speed = 5
-    rad_angle = math.radians(tank["angle"] - 90)
-    tank["x"] += math.sin(rad_angle) * speed
-    tank["y"] -= math.cos(rad_angle) * speed
-    keep_tank_in_bounds(tank)
-
-
-def move_tank_right(tank):
-    speed = 5
-    rad_angle = math.radians(tank["angle"] + 90)
-    tank["x"] += math.sin(rad_angle) * speed
-    tank["y"] -= math.cos(rad_angle) * speed
-    keep_tank_in_bounds(tank)
-
-
-def keep_tank_in_bounds(tank):
-    # Keep tank within boundaries
-    map_width = game_state["mapWidth"]
-    map_height = game_state["mapHeight"]
-    tank["x"] = max(20, min(tank["x"], map_width - 20))
-    tank["y"] = max(20, min(tank["y"], map_height - 20))
-    check_reward_collision(tank)
-
-
-# Update the fire_tank_weapon function to apply damage boost
-
-
-def fire_tank_weapon(tank):
-    # Create a projectile for each barrel
-    barrels = tank.get("barrels", 1)
-
-    # Calculate damage - apply damage boost if active
-    base_damage = 20
-    damage_multiplier = tank.get("damageBoost", 1.0)
-    projectile_damage = base_damage * damage_multiplier
-
-    for i in range(barrels):
-        # Calculate angle adjustment for multiple barrels
-        angle_adjustment = 0
-        if barrels > 1:
-            # Spread from -15 to +15 degrees
-            angle_adjustment = (i / (barrels - 1) * 30) - 15
-
-        # Create a new projectile from the front of the tank
-        fire_angle = tank["angle"] + angle_adjustment
-        rad_angle = math.radians(fire_angle)
-
-        # Position the projectile at the end of the cannon
-        cannon_length = 30
-        front_x = tank["x"] + math.sin(rad_angle) * cannon_length
-        front_y = tank["y"] - math.cos(rad_angle) * cannon_length
-
-        # Calculate velocity components
-        projectile_speed = 15
-        velocity_x = math.sin(rad_angle) * projectile_speed
-        velocity_y = -math.cos(rad_angle) * projectile_speed
-
-        # Add visualization for boosted damage
-        projectile_color = "yellow"
-        if damage_multiplier > 1.0:
-            projectile_color = "orange"  # Boosted projectiles have orange color
-
-        projectile = {
-            "x": front_x,
-            "y": front_y,
-            "angle": fire_angle,
-            "owner": tank["id"],
-            "velocity_x": velocity_x,
-            "velocity_y": velocity_y,
-            "damage": projectile_damage,
-            "color": projectile_color,
-            "timestamp": time.time(),
-            "active": True,
-        }
-        game_state["projectiles"].append(projectile)
 
+def profile_room(room_id, kind, seconds):
+    # Profile the room's next ``seconds`` of ticks; returns where the profile
+    # will be written, or None for a room this process does not hold
+    room = rooms.get(room_id)
+    if room is None:
+        return None
+    profiler = RoomProfiler(room_id, kind, seconds, PROFILE_DIR)
+    rooms.post(room, ("profile", (profiler,), None))
+    return profiler.path
 
-def check_reward_spawn(current_time):
-    # Spawn rewards every 10-20 seconds, more frequently in higher levels
-    spawn_interval = max(5, 20 - (game_state["currentLevel"] * 2))
-    if current_time - game_state.get("lastRewardSpawn", 0) > random.uniform(
-        spawn_interval / 2, spawn_interval
-    ):
-        spawn_reward()
-        game_state["lastRewardSpawn"] = current_time
-
-    # Update reward durations and remove expired rewards
-    for reward in list(game_state["rewards"]):
-        if (
-            "spawnTime" in reward and current_time - reward["spawnTime"] > 15
-        ):  # Rewards disappear after 15 seconds
-            game_state["rewards"].remove(reward)
-
-    # Process all tanks for power-up expiration
-    for tank in game_state["tanks"]:
-        # Check barrel power-up expiration
-        if "powerupTime" in tank and current_time - tank["powerupTime"] > tank.get(
-            "powerupDuration", 45
-        ):
-            tank["barrels"] = 1  # Reset to default number of barrels
-            if "powerupMessage" in tank:
-                tank["powerupMessage"] = "Extra Barrels Expired"
-                # Remove after 2 seconds
-                tank["messageExpiry"] = current_time + 2
-
-            # Clear power-up data
-            if "powerupType" in tank:
-                del tank["powerupType"]
-            if "powerupColor" in tank:
-                del tank["powerupColor"]
-
-        # Check damage boost expiration
-        if "damageBoostTime" in tank and current_time - tank[
-            "damageBoostTime"
-        ] > tank.get("damageBoostDuration", 30):
-            tank["damageBoost"] = 1.0  # Reset to normal damage
-            if "powerupMessage" in tank:
-                tank["powerupMessage"] = "Damage Boost Expired"
-                # Remove after 2 seconds
-                tank["messageExpiry"] = current_time + 2
-
-            # Clear power-up data
-            if "damageBoostColor" in tank:
-                del tank["damageBoostColor"]
-
-        # Remove expired messages
-        if "messageExpiry" in tank and current_time > tank["messageExpiry"]:
-            if "powerupMessage" in tank:
-                del tank["powerupMessage"]
-            if "messageExpiry" in tank:
-                del tank["messageExpiry"]
 
+def room_state(room_id, since, binary, view=None, known_etags=()):
+    # The ETag of the room's latest snapshot, and the snapshot encoded once
+    # per tick for every reader, or None if the caller already has it; None
+    # for a room that does not exist
+    room = rooms.visit(room_id, game_clock())
+    if room is None:
+        return None
+    # Readers only ever see a published snapshot, never the live world
+    snapshot = room.snapshots.latest
+    etag = f"{room_id}.{snapshot.seq}"
+    if etag in known_etags:
+        return etag, None
+    started = time.perf_counter()
+    if binary:
+        payload = snapshot.delta_bytes(since, view)
+    else:
+        payload = snapshot.delta_json(since, view)
+    phase_seconds.inc(time.perf_counter() - started, "serialize")
+    return etag, payload
+
+
+def collect_frames(subscriptions):
+    # subscriptions: room id -> [(sid, acked seq, sent seq, binary, view)]
+    frames = []
+    now = game_clock()
+    for room_id, clients in subscriptions.items():
+        room = rooms.get(room_id)
+        if room is None:
+            continue
+        # Watched rooms never expire
+        room.touch(now)
+        snapshot = room.snapshots.latest
+        started = time.perf_counter()
+        try:
+            room_frames = []
+            for sid, ack, sent, binary, view in clients:
+                if snapshot.seq == sent:
+                    continue
+                if binary:
+                    payload = snapshot.delta_bytes(ack, view)
+                else:
+                    payload = snapshot.delta(ack, view)
+                room_frames.append((sid, snapshot.seq, payload))
+        except Exception:
+            # One room that cannot be encoded must not hold back the others
+            app.logger.exception("Frames of room %s failed", room_id)
+            continue
+        frames.extend(room_frames)
+        phase_seconds.inc(time.perf_counter() - started, "serialize")
+    return frames
+
+
+def collect_broadcasts(channels):
+    # channels: room id -> [(binary, view, last sent seq)]. Returns room id ->
+    # (seq, [payload for each entry, None where it is already up to date]).
+    frames = {}
+    now = game_clock()
+    for room_id, groups in channels.items():
+        room = rooms.get(room_id)
+        if room is None:
+            continue
+        room.touch(now)
+        snapshot = room.snapshots.latest
+        started = time.perf_counter()
+        payloads = []
+        try:
+            for binary, view, sent in groups:
+                if snapshot.seq == sent:
+                    payloads.append(None)
+                elif binary:
+                    payloads.append(snapshot.delta_bytes(sent, view))
+                else:
+                    payloads.append(snapshot.delta(sent, view))
+        except Exception:
+            app.logger.exception("Broadcast of room %s failed", room_id)
+            continue
+        frames[room_id] = (snapshot.seq, payloads)
+        phase_seconds.inc(time.perf_counter() - started, "serialize")
+    return frames
 
-@app.route("/api/update", methods=["POST"])
-def update_game():
-    data = request.json
-    player_id = data.get("id")
-    action = data.get("action")
-    value = data.get("value")
-
-    map_width = game_state["mapWidth"]
-    map_height = game_state["mapHeight"]
-
-    for tank in game_state["tanks"]:
-        if tank["id"] == player_id and tank["health"] > 0:
-            if action == "rotate":
-                # Smooth rotation based on value
-                tank["angle"] = (tank["angle"] + value) % 360
-            elif action == "move":
-                speed = 5  # Pixels per frame
-                # Handle direction: forward, backward, left, right
-                if value == "forward":
-                    # Move in direction of tank angle (0 degrees now points up)
-                    rad_angle = math.radians(tank["angle"])
-                    tank["x"] += math.sin(rad_angle) * speed
-                    tank["y"] -= math.cos(rad_angle) * speed
-                elif value == "backward":
-                    # Move opposite to the direction of tank angle
-                    rad_angle = math.radians(tank["angle"])
-                    tank["x"] -= math.sin(rad_angle) * speed
-                    tank["y"] += math.cos(rad_angle) * speed
-                elif value == "left":
-                    # Move perpendicular to tank angle (left)
-                    rad_angle = math.radians(tank["angle"] - 90)
-                    tank["x"] += math.sin(rad_angle) * speed
-                    tank["y"] -= math.cos(rad_angle) * speed
-                elif value == "right":
-                    # Move perpendicular to tank angle (right)
-                    rad_angle = math.radians(tank["angle"] + 90)
-                    tank["x"] += math.sin(rad_angle) * speed
-                    tank["y"] -= math.cos(rad_angle) * speed
-
-                # Keep tank within boundaries
-                tank["x"] = max(20, min(tank["x"], map_width - 20))
-                tank["y"] = max(20, min(tank["y"], map_height - 20))
-
-                # Check for reward collision
-                check_reward_collision(tank)
-
-            elif action == "fire":
-                # Prevent rapid fire (limit to one projectile per 0.5 seconds)
-                can_fire = True
-                for proj in game_state["projectiles"]:
-                    if (
-                        proj["owner"] == tank["id"]
-                        and time.time() - proj.get("timestamp", 0) < 0.5
-                    ):
-                        can_fire = False
-                        break
-
-                if can_fire:
-                    # Get the number of barrels this tank has
-                    barrels = tank.get("barrels", 1)
-
-                    # Calculate damage - apply damage boost if active
-                    base_damage = 20
-                    damage_multiplier = tank.get("damageBoost", 1.0)
-                    projectile_damage = base_damage * damage_multiplier
-
-                    # Create a projectile for each barrel
-                    # If barrels > 1, spread them out in a fan pattern
-                    for i in range(barrels):
-                        # Calculate angle adjustment for multiple barrels
-                        angle_adjustment = 0
-                        if barrels > 1:
-                            # Spread from -15 to +15 degrees
-                            angle_adjustment = (i / (barrels - 1) * 30) - 15
-
-                        # Create a new projectile from the front of the tank
-                        fire_angle = tank["angle"] + angle_adjustment
-                        rad_angle = math.radians(fire_angle)
-
-                        # Position the projectile at the end of the cannon
-                        cannon_length = 30
-                        front_x = tank["x"] + math.sin(rad_angle) * cannon_length
-                        front_y = tank["y"] - math.cos(rad_angle) * cannon_length
-
-                        # Calculate velocity components
-                        projectile_speed = 15
-                        velocity_x = math.sin(rad_angle) * projectile_speed
-                        velocity_y = -math.cos(rad_angle) * projectile_speed
-
-                        # Add visualization for boosted damage
-                        projectile_color = "yellow"
-                        if damage_multiplier > 1.0:
-                            projectile_color = (
-                                "orange"  # Boosted projectiles have orange color
-                            )
-
-                        projectile = {
-                            "x": front_x,
-                            "y": front_y,
-                            "angle": fire_angle,
-                            "owner": tank["id"],
-                            "velocity_x": velocity_x,
-                            "velocity_y": velocity_y,
-                            "damage": projectile_damage,
-                            "color": projectile_color,
-                            "timestamp": time.time(),
-                            "active": True,
-                        }
-                        game_state["projectiles"].append(projectile)
 
-    return jsonify({"status": "success"})
+def export_room(room_id):
+    # Hand a room over to another worker
+    room = rooms.get(room_id)
+    if room is None:
+        return None
+    return room_command(room, "export")
 
 
-# Update the check_reward_collision function for stacking and level scaling
-
-
-def check_reward_collision(tank):
-    # Check if tank has collided with any rewards
-    for reward in list(game_state["rewards"]):
-        dx = tank["x"] - reward["x"]
-        dy = tank["y"] - reward["y"]
-        distance = math.sqrt(dx * dx + dy * dy)
-
-        if distance < (20 + reward["radius"]):  # Tank radius + reward radius
-            # Apply reward effect
-            if reward["type"] == "barrel":
-                # Set maximum barrels (increase with level)
-                max_barrels = min(3 + math.floor(game_state["currentLevel"] / 2), 6)
-
-                # Increase barrel count
-                tank["barrels"] = min(tank.get("barrels", 1) + 1, max_barrels)
-
-                # Apply level scaling to duration - higher levels get longer duration
-                base_duration = reward["duration"]
-                level_bonus = (
-                    game_state["currentLevel"] - 1
-                ) * 5  # +5 seconds per level
-                total_duration = base_duration + level_bonus
-
-                # Check if we already have an active power-up
-                if "powerupTime" in tank and "powerupDuration" in tank:
-                    # Calculate remaining time on current power-up
-                    current_time = time.time()
-                    elapsed = current_time - tank["powerupTime"]
-                    remaining = max(0, tank["powerupDuration"] - elapsed)
-
-                    # Stack duration - add new duration to remaining time (if stackable)
-                    if reward.get("stackable", False):
-                        tank["powerupDuration"] = remaining + total_duration
-                        tank["powerupTime"] = current_time
-                    else:
-                        # Take the longer of the two durations
-                        if total_duration > remaining:
-                            tank["powerupDuration"] = total_duration
-                            tank["powerupTime"] = current_time
-                else:
-                    # New power-up
-                    tank["powerupTime"] = time.time()
-                    tank["powerupDuration"] = total_duration
+def import_room(room_id, data):
+    room_command(rooms.join(room_id, game_clock()), "import", data)
 
-                # Add visualization data
-                tank["powerupType"] = reward["type"]
-                tank["powerupColor"] = reward["color"]
 
-                # Send notification to client
-                tank["powerupMessage"] = (
-                    f"Extra Barrels: {tank['barrels']} ({int(tank['powerupDuration'])}s)"
-                )
+# Room commands. The tick loop runs these for the room, in the process that
+# owns it, as the room's only writer.
 
-            elif reward["type"] == "health":
-                # Health pack gives more health in higher levels
-                base_health = 30
-                level_bonus = (
-                    game_state["currentLevel"] - 1
-                ) * 5  # +5 health per level
-                health_gain = min(base_health + level_bonus, 50)  # Cap at +50 health
-
-                # Use maxHealth if defined, otherwise default to 100
-                max_health = tank.get("maxHealth", 100)
-                tank["health"] = min(tank.get("health", 0) + health_gain, max_health)
-
-                # Notification message
-                tank["powerupMessage"] = f"Health Restored: +{health_gain}"
-
-            elif reward["type"] == "damage":
-                # New reward: increased damage
-                tank["damageBoost"] = 2.0  # Double damage
-
-                # Apply level scaling to duration
-                base_duration = reward["duration"]
-                level_bonus = (
-                    game_state["currentLevel"] - 1
-                ) * 3  # +3 seconds per level
-                total_duration = base_duration + level_bonus
-
-                # Handle stacking similar to barrel power-up
-                if "damageBoostTime" in tank and "damageBoostDuration" in tank:
-                    current_time = time.time()
-                    elapsed = current_time - tank["damageBoostTime"]
-                    remaining = max(0, tank["damageBoostDuration"] - elapsed)
-
-                    if reward.get("stackable", False):
-                        tank["damageBoostDuration"] = remaining + total_duration
-                        tank["damageBoostTime"] = current_time
-                    else:
-                        if total_duration > remaining:
-                            tank["damageBoostDuration"] = total_duration
-                            tank["damageBoostTime"] = current_time
-                else:
-                    tank["damageBoostTime"] = time.time()
-                    tank["damageBoostDuration"] = total_duration
 
-                # Add visualization data
-                tank["damageBoostColor"] = reward["color"]
+def begin_match(room, current_time):
+    finish_recording(room)
+    room.clock.now = current_time
+    reset_game_state(room, ai_budget=AI_TICK_BUDGET)
+    room.snapshots.capture(room.state)
+    if RECORD_DIR:
+        seed = room.state["seed"]
+        room.recorder = MatchRecorder.start(
+            os.path.join(RECORD_DIR, f"{room.room_id}-{seed:016x}.match"),
+            seed,
+            room.clock(),
+            TICK_INTERVAL,
+        )
+    rooms.mark_running(room)
 
-                # Notification message
-                tank["powerupMessage"] = (
-                    f"Damage Boost: x2 ({int(tank['damageBoostDuration'])}s)"
-                )
 
-            # Remove the reward
-            game_state["rewards"].remove(reward)
-            break
+def end_match(room, current_time):
+    if room.active:
+        finish_recording(room)
+        room.state["gameActive"] = False
+        room.snapshots.capture(room.state)
 
 
-def update_projectiles(elapsed=0.033):  # Default to ~30 FPS
-    # Only process if game is active
-    if not game_state["gameActive"]:
-        return
+def queue_input(room, current_time, frame):
+    if room.active:
+        room.state["inputQueue"].append(frame)
 
-    # Move all projectiles
-    new_projectiles = []
-    map_width = game_state["mapWidth"]
-    map_height = game_state["mapHeight"]
 
-    for projectile in game_state["projectiles"]:
-        if not projectile.get("active", True):
-            continue
+def attach_profiler(room, current_time, profiler):
+    finish_profile(room)
+    room.profiler = profiler
 
-        # Move projectile according to velocity and elapsed time
-        projectile["x"] += projectile["velocity_x"] * elapsed * 30
-        projectile["y"] += projectile["velocity_y"] * elapsed * 30
 
-        # Check if projectile is still on the map
-        if 0 <= projectile["x"] <= map_width and 0 <= projectile["y"] <= map_height:
+def hand_over(room, current_time):
+    rooms.remove(room.room_id)
+    # A profile covers one process; it ends where the room leaves
+    finish_profile(room)
+    # The recording carries on from the new owner
+    recording = None
+    if room.recorder is not None:
+        recording = room.recorder.path
+        room.recorder.close()
+    return room.state, room.snapshots, recording
 
-            # Check for collisions with tanks
-            hit = False
-            for tank in game_state["tanks"]:
-                # Skip the owner's tank or tanks with 0 health
-                if tank["id"] == projectile["owner"] or tank["health"] <= 0:
-                    continue
 
-                # Collision detection
-                dx = tank["x"] - projectile["x"]
-                dy = tank["y"] - projectile["y"]
-                distance = math.sqrt(dx * dx + dy * dy)
+def take_over(room, current_time, data):
+    room.state, room.snapshots, recording = data
+    if recording is not None:
+        room.recorder = MatchRecorder(recording)
+    if room.active:
+        rooms.mark_running(room)
 
-                if distance < 25:  # Approximate tank radius for collision
-                    hit = True
-                    tank["health"] -= projectile["damage"]
 
-                    # Check if tank is destroyed
-                    if tank["health"] <= 0:
-                        tank["health"] = 0
+def finish_recording(room):
+    # Seal the room's recording with a digest of the state it ended in
+    if room.recorder is not None:
+        room.recorder.close(room.state)
+        room.recorder = None
 
-                        # If an enemy is killed by player, update enemy counter
-                        if tank["id"] != 1 and projectile["owner"] == 1:
-                            game_state["enemiesDefeated"] += 1
-                            check_level_completion()
 
-                        # Check for game over if player is destroyed
-                        if tank["id"] == 1:
-                            check_game_over()
+def finish_profile(room):
+    if room.profiler is not None:
+        room.profiler.save()
+        room.profiler = None
 
-                    # Deactivate the projectile
-                    projectile["active"] = False
-                    break
 
-            # Keep the projectile if it's still active and hasn't hit anything
-            if not hit and projectile.get("active", True):
-                new_projectiles.append(projectile)
+ROOM_COMMANDS = {
+    "start": begin_match,
+    "stop": end_match,
+    "input": queue_input,
+    "profile": attach_profiler,
+    "export": hand_over,
+    "import": take_over,
+}
 
-        # Remove projectiles that go off-screen
-        else:
-            projectile["active"] = False
 
-    game_state["projectiles"] = new_projectiles
+def worker_load():
+    global tick_busy, load_window_start
+    # Share of wall time spent ticking since the last report, per room too
+    now = time.monotonic()
+    window = max(now - load_window_start, 1e-6)
+    running = rooms.running_rooms()
+    load = {
+        "busy": tick_busy / window,
+        "rooms": [(room.room_id, room.cost / TICK_INTERVAL) for room in running],
+        "alive": list(rooms.rooms),
+    }
+    tick_busy = 0.0
+    load_window_start = now
+    return load
+
+
+def gone_rooms(room_ids):
+    # Which of the rooms this process no longer holds
+    return [room_id for room_id in room_ids if rooms.get(room_id) is None]
+
+
+def process_metrics():
+    # This process's metrics, with the room and entity gauges brought up to
+    # date; counted here rather than per tick
+    running = rooms.running_rooms()
+    room_count.set(len(running), "running")
+    room_count.set(len(rooms.rooms) - len(running), "idle")
+    for entity_type in ENTITY_TYPES:
+        entity_count.set(
+            sum(len(room.state[entity_type]) for room in running), entity_type
+        )
+    return metrics.snapshot()
+
+
+def start_worker():
+    global simulation_task
+    # Simulation worker: tick the rooms this process owns, push nothing
+    simulation_task = socketio.start_background_task(simulation_loop, True, False)
+
+
+ROOM_OPS = {
+    "boot": start_worker,
+    "open": open_room,
+    "start": start_room,
+    "stop": stop_room,
+    "input": room_input,
+    "state": room_state,
+    "frames": collect_frames,
+    "broadcasts": collect_broadcasts,
+    "export": export_room,
+    "import": import_room,
+    "load": worker_load,
+    "gone": gone_rooms,
+    "metrics": process_metrics,
+    "profile": profile_room,
+}
 
 
-# Update the check_level_completion function to respect maxHealth
-def check_level_completion():
-    # Check if player has defeated enough enemies to advance to next level
-    level_conf = LEVEL_CONFIG.get(game_state["currentLevel"], LEVEL_CONFIG[5])
+@app.route("/api/update", methods=["POST"])
+def update_game():
+    frame = input_frame(request.get_json(silent=True))
+    if frame is None:
+        return jsonify({"status": "error", "message": "Invalid input"}), 400
 
-    if game_state["enemiesDefeated"] >= level_conf["enemies_required"]:
-        # Level completed
-        next_level = game_state["currentLevel"] + 1
+    room_cast(current_room_id(), "input", frame)
 
-        # Check if this was the final level
-        if next_level > max(LEVEL_CONFIG.keys()):
-            # Player completed all levels
-            game_state["gameActive"] = False
-            game_state["gameOver"] = True
-            game_state["winner"] = 1  # Player wins
-            game_state["completed"] = (
-                True  # Indicates game was completed rather than lost
-            )
-        else:
-            # Advance to next level
-            game_state["currentLevel"] = next_level
-            game_state["enemiesDefeated"] = 0  # Reset enemy counter
-
-            # Configure for new level
-            new_conf = LEVEL_CONFIG.get(next_level, LEVEL_CONFIG[5])
-            game_state["enemiesRequired"] = new_conf["enemies_required"]
-            game_state["maxEnemies"] = new_conf["max_enemies"]
-
-            # Add a health bonus for completing a level
-            for tank in game_state["tanks"]:
-                if tank["id"] == 1:  # Player tank
-                    max_health = tank.get("maxHealth", 150)  # Use maxHealth if defined
-                    tank["health"] = min(
-                        tank["health"] + 20, max_health
-                    )  # Bonus health
-
-            # Remove all enemies and spawn new ones for next level
-            game_state["tanks"] = [
-                tank for tank in game_state["tanks"] if tank["id"] == 1
-            ]
-            game_state["nextEnemySpawn"] = time.time()  # Spawn first enemy immediately
-
-
-def check_game_over():
-    # Check if player is alive
-    player_alive = False
-
-    for tank in game_state["tanks"]:
-        if tank["id"] == 1 and tank["health"] > 0:
-            player_alive = True
-            break
-
-    # If player is eliminated, declare game over
-    if not player_alive:
-        game_state["gameActive"] = False
-        game_state["gameOver"] = True
-        game_state["winner"] = 0  # AI wins (no specific enemy)
+    return jsonify({"status": "success"})
 
 
 @app.route("/api/start-game", methods=["POST"])
 def start_game():
-    global game_state
-    # Reset game state
-    game_state = {
-        "tanks": [
-            {
-                "id": 1,
-                "x": 100,
-                "y": 100,
-                "angle": 0,
-                "health": 150,  # Changed from 100 to 150
-                "color": "green",
-                "barrels": 1,
-                "maxHealth": 150,  # Add maxHealth property to track max value
-            }
-        ],
-        "projectiles": [],
-        "rewards": [],
-        "gameActive": True,
-        "gameOver": False,
-        "winner": None,
-        "mapWidth": 800,
-        "mapHeight": 600,
-        "lastUpdate": time.time(),
-        "lastRewardSpawn": time.time(),
-        "lastAIUpdate": time.time(),
-        "currentLevel": 1,
-        "enemiesDefeated": 0,
-        "enemiesRequired": LEVEL_CONFIG[1]["enemies_required"],
-        "maxEnemies": LEVEL_CONFIG[1]["max_enemies"],
-        "nextEnemySpawn": time.time(),  # Spawn first enemy immediately
-    }
-
-    # Spawn initial rewards
-    for _ in range(2):
-        spawn_reward()
+    room_call(current_room_id(), "start")
 
     return jsonify({"status": "Game started"})
 
 
 @app.route("/api/stop-game", methods=["POST"])
 def stop_game():
-    global game_state
-    game_state["gameActive"] = False
+    room_call(current_room_id(), "stop")
     return jsonify({"status": "Game stopped"})
 
 
+@app.route("/api/maps/<name>")
+def get_map(name):
+    # Wall tiles of a map; clients fetch each map once, when a match moves
+    # to it
+    try:
+        level = load_level(name)
+    except (ValueError, OSError):
+        return jsonify({"status": "error", "message": "Unknown map"}), 404
+    return jsonify(level.record())
+
+
+@app.route("/api/metrics")
+def get_metrics():
+    # Prometheus text format; see src/metrics.py
+    socket_client_count.set(len(socket_clients))
+    spectator_count.set(len(spectators))
+    if shards is None:
+        process_metrics()
+        snapshots = ()
+    else:
+        snapshots = [worker.call("metrics") for worker in shards.workers]
+    return Response(metrics.render(snapshots), content_type=CONTENT_TYPE)
+
+
+def is_admin():
+    expected = f"Bearer {ADMIN_TOKEN}"
+    given = request.headers.get("Authorization", "")
+    return hmac.compare_digest(given.encode(), expected.encode())
+
+
+@app.route("/api/admin/profile", methods=["POST"])
+def start_profile():
+    # Profile one room's ticks for a while, with cProfile or by sampling;
+    # the owning process writes the profile under PROFILE_DIR
+    if ADMIN_TOKEN is None:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+    if not is_admin():
+        return jsonify({"status": "error", "message": "Forbidden"}), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    room_id = data.get("room")
+    kind = data.get("kind", "sample")
+    seconds = data.get("seconds", 10)
+    if (
+        not isinstance(room_id, str)
+        or not VALID_ROOM_ID.match(room_id)
+        or kind not in PROFILE_KINDS
+        or not isinstance(seconds, (int, float))
+        or not 0 < seconds <= MAX_PROFILE_SECONDS
+    ):
+        return jsonify({"status": "error", "message": "Invalid profile request"}), 400
+    if shards is not None and room_id not in shards.owners:
+        path = None
+    else:
+        path = room_call(room_id, "profile", kind, seconds)
+    if path is None:
+        return jsonify({"status": "error", "message": "Unknown room"}), 404
+    return jsonify({"status": "success", "path": path})
+
+
 @app.route("/favicon.ico")
 def favicon():
     return app.send_static_file("favicon.ico")
 
 
-# Update the spawn_reward function to include the new reward type
-
-
-def spawn_reward():
-    # Don't spawn too many rewards
-    max_rewards = 2 + game_state["currentLevel"]  # More rewards in higher levels
-    if len(game_state["rewards"]) >= max_rewards:
-        return
-
-    # Choose a random reward type based on weighted probabilities
-    roll = random.random()
-
-    # Health more common in higher levels
-    health_chance = 0.2 * game_state["currentLevel"]
-
-    # Damage boost more rare, but increases with level
-    damage_chance = 0.1 + (0.05 * game_state["currentLevel"])
-
-    if roll < health_chance:
-        reward_type = REWARD_TYPES[1]  # Health
-    elif roll < health_chance + damage_chance:
-        reward_type = REWARD_TYPES[2]  # Damage boost
-    else:
-        reward_type = REWARD_TYPES[0]  # Barrel
-
-    # Choose a random position away from tanks
-    valid_position = False
-    attempts = 0
-    x, y = 0, 0
-
-    while not valid_position and attempts < 10:
-        x = random.randint(50, game_state["mapWidth"] - 50)
-        y = random.randint(50, game_state["mapHeight"] - 50)
-
-        # Check if position is away from tanks
-        valid_position = True
-        for tank in game_state["tanks"]:
-            dx = tank["x"] - x
-            dy = tank["y"] - y
-            distance = math.sqrt(dx * dx + dy * dy)
-            if distance < 100:  # Keep rewards away from tanks
-                valid_position = False
-                break
-
-        attempts += 1
-
-    if valid_position:
-        reward = {
-            "type": reward_type["type"],
-            "x": x,
-            "y": y,
-            "color": reward_type["color"],
-            "radius": reward_type["radius"],
-            "duration": reward_type["duration"],
-            "stackable": reward_type.get("stackable", False),
-            "spawnTime": time.time(),
-        }
-        game_state["rewards"].append(reward)
-
-
 if __name__ == "__main__":
-    app.run(debug=True)
+    socketio.run(app, debug=True)
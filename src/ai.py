@@ -0,0 +1,264 @@
+import math
+import time
+
+import numpy as np
+
+# Distances to the player beyond which AI tanks patrol, and pursue
+PATROL_RANGE = 300
+ATTACK_RANGE = 150
+# Pixels a tank moves per step and degrees it turns per tick
+TANK_SPEED = 5
+TURN_RATE = 5
+# Tanks stay this far inside the map edges
+MAP_MARGIN = 20
+
+# Taylor series of sine and cosine, enough terms for the last bit of a
+# float64 within 45 degrees of zero, and of arctangent within 11.25 degrees
+SIN_TERMS = tuple((-1) ** k / math.factorial(2 * k + 1) for k in range(9))
+COS_TERMS = tuple((-1) ** k / math.factorial(2 * k) for k in range(9))
+ATAN_TERMS = tuple((-1) ** k / (2 * k + 1) for k in range(12))
+# Sine and cosine series evaluated side by side, as columns
+SIN_COS_TERMS = np.array([SIN_TERMS, COS_TERMS]).T[:, :, None]
+
+
+def polynomial(x, coefficients):
+    # Horner's rule, lowest coefficient first
+    result = x * coefficients[-1] + coefficients[-2]
+    for coefficient in coefficients[-3::-1]:
+        result = result * x + coefficient
+    return result
+
+
+def sin_cos(angle):
+    """Sines and cosines of an array of angles in degrees.
+
+    NumPy's np.sin, np.cos and np.arctan2 use SIMD kernels that can round
+    differently from one CPU to the next, which would make a recorded match
+    replay differently on another machine. These and bearing() only add,
+    multiply, divide and take square roots, which IEEE 754 rounds the same
+    everywhere, and still work on whole arrays at once.
+    """
+    quarters = np.rint(angle / 90)
+    radians = (angle - quarters * 90) * (math.pi / 180)
+    squared = radians * radians
+    series = polynomial(squared, SIN_COS_TERMS)
+    sine = series[0] * radians
+    cosine = series[1]
+    quadrant = quarters.astype(np.int64) % 4
+    return (
+        np.choose(quadrant, (sine, cosine, -sine, -cosine)),
+        np.choose(quadrant, (cosine, -sine, -cosine, sine)),
+    )
+
+
+def bearing(dx, dy):
+    # Degrees clockwise from straight up, the way tank angles are measured:
+    # math.degrees(math.atan2(dx, -dy)) % 360, see sin_cos()
+    across = np.abs(dx)
+    along = np.abs(dy)
+    larger = np.maximum(across, along)
+    ratio = np.minimum(across, along) / np.where(larger > 0, larger, 1)
+    # Halve the angle twice, tan(a / 2) = tan(a) / (1 + sqrt(1 + tan(a)^2)),
+    # so that the series converges quickly
+    for _ in range(2):
+        ratio = ratio / (1 + np.sqrt(1 + ratio * ratio))
+    angle = polynomial(ratio * ratio, ATAN_TERMS) * ratio * (720 / math.pi)
+    # That is the angle to the nearer axis; unfold it to the full circle
+    angle = np.where(across > along, 90 - angle, angle)
+    angle = np.where(dy > 0, 180 - angle, angle)
+    return np.where(dx < 0, 360 - angle, angle) % 360
+
+
+def turn_towards(angle, target):
+    # Turn at most TURN_RATE degrees, the short way round
+    difference = (target - angle + 180) % 360 - 180
+    step = np.where(difference > 0, TURN_RATE, -TURN_RATE)
+    return np.where(np.abs(difference) > TURN_RATE, (angle + step) % 360, target)
+
+
+def move(x, y, sine, cosine, steps, map_width, map_height):
+    # Move each tank `steps` speed units along the heading with the given
+    # sine and cosine, then keep it on the map
+    x = x + sine * TANK_SPEED * steps
+    y = y - cosine * TANK_SPEED * steps
+    x = np.clip(x, MAP_MARGIN, map_width - MAP_MARGIN)
+    y = np.clip(y, MAP_MARGIN, map_height - MAP_MARGIN)
+    return x, y
+
+
+def think(
+    tanks, player, rewards, current_time, map_width, map_height, rng, waypoints=None
+):
+    """One AI decision for every tank at once.
+
+    ``tanks`` maps x, y, angle, skill, last_update and last_shot to arrays
+    with one entry per AI tank, ``player`` is the player's (x, y) and
+    ``rewards`` the (x, y) arrays of the rewards on the map. Each tank
+    patrols, pursues or attacks by its distance to the player, exactly as
+    its skill dictates, with random draws from the NumPy generator ``rng``.
+    Pursuers and attackers with an (x, y) in ``waypoints``, arrays with NaN
+    for tanks in sight of the player, drive for it instead.
+
+    Only tanks that act this tick are worked on: pursuers, attackers and
+    patrollers due to pick a new course. Returns their indices as
+    ``acting``, their new x, y and angle, and masks over them of the
+    patrollers that picked a course (``deciding``) and of the tanks that
+    moved. ``fire`` lists the indices of the tanks that fire, and
+    ``patrol`` masks the patrollers among all the given tanks.
+    """
+    count = len(tanks["x"])
+    dx = player[0] - tanks["x"]
+    dy = player[1] - tanks["y"]
+    distance = np.sqrt(dx * dx + dy * dy)
+
+    # One set of draws per tank and tick, whichever state uses them: a
+    # chance, a strafing side and a wander turn of -30 to 30 degrees
+    chance, side, wander = rng.random((3, count))
+    wander = np.floor(wander * 61) - 30
+
+    # Patrollers pick a new course once a second and otherwise hold still
+    patrol = distance > PATROL_RANGE
+    idle = patrol & (current_time - tanks["last_update"] <= 1.0)
+    acting = np.flatnonzero(~idle)
+
+    x = tanks["x"][acting]
+    y = tanks["y"][acting]
+    angle = tanks["angle"][acting]
+    skill = tanks["skill"][acting]
+    last_shot = tanks["last_shot"][acting]
+    dx = dx[acting]
+    dy = dy[acting]
+    distance = distance[acting]
+    chance = chance[acting]
+    side = side[acting]
+    wander = wander[acting]
+    deciding = patrol[acting]
+    pursue = ~deciding & (distance > ATTACK_RANGE)
+    attack = ~deciding & ~pursue
+
+    # Higher skill means better at finding rewards; without one in sight
+    # patrollers wander
+    seeking = deciding & (chance < 0.7 * skill) & (len(rewards[0]) > 0)
+    wandering = deciding & ~seeking
+
+    # Bearings for everyone at once; patrollers' are overwritten or unused
+    target = bearing(dx, dy)
+    # Walls between them and the player: head for the waypoint, no shooting
+    routed = np.zeros(len(acting), dtype=bool)
+    if waypoints is not None:
+        waypoint_x = waypoints[0][acting]
+        routed = ~deciding & ~np.isnan(waypoint_x)
+        if routed.any():
+            target[routed] = bearing(
+                waypoint_x[routed] - x[routed], waypoints[1][acting][routed] - y[routed]
+            )
+        pursue &= ~routed
+        attack &= ~routed
+    if seeking.any():
+        # Nearest reward per seeker; ties go to the earlier reward
+        reward_dx = rewards[0][None, :] - x[seeking, None]
+        reward_dy = rewards[1][None, :] - y[seeking, None]
+        nearest = np.argmin(reward_dx * reward_dx + reward_dy * reward_dy, axis=1)
+        rows = np.arange(len(nearest))
+        target[seeking] = bearing(reward_dx[rows, nearest], reward_dy[rows, nearest])
+    new_angle = np.where(wandering, (angle + wander) % 360, turn_towards(angle, target))
+
+    # Pursuers keep some distance, attackers back off when too close
+    steps = np.zeros(len(acting))
+    steps[deciding] = 1
+    steps[pursue & (distance > 250)] = 1
+    steps[pursue & (distance < 200)] = -1
+    steps[attack & (distance > 180)] = 1
+    steps[attack & (distance < 120)] = -1
+    steps[routed] = 1
+    sine, cosine = sin_cos(new_angle)
+    new_x, new_y = move(x, y, sine, cosine, steps, map_width, map_height)
+
+    # Higher skill fires faster and aims tighter
+    since_shot = current_time - last_shot
+    pursuit_fire = (
+        pursue
+        & (since_shot > 1.5 - skill * 0.5)
+        & (np.abs(new_angle - target) < 20 - skill * 10)
+        & (chance < skill)
+    )
+    aimed = attack & (np.abs((new_angle - target + 180) % 360 - 180) < 15 - skill * 5)
+    attack_fire = aimed & (since_shot > 1.0 - skill * 0.3)
+
+    # Aimed attackers strafe to avoid being hit, more often when skilled
+    strafing = aimed & (chance < 0.3 + skill * 0.2)
+    if strafing.any():
+        # A quarter turn right, or left, of the heading, without more trig
+        turn = np.where(side[strafing] < 0.5, -1, 1)
+        new_x[strafing], new_y[strafing] = move(
+            new_x[strafing],
+            new_y[strafing],
+            cosine[strafing] * turn,
+            -sine[strafing] * turn,
+            1,
+            map_width,
+            map_height,
+        )
+
+    return {
+        "acting": acting,
+        "x": new_x,
+        "y": new_y,
+        "angle": new_angle,
+        "deciding": deciding,
+        "moved": (steps != 0) | strafing,
+        "fire": acting[pursuit_fire | attack_fire],
+        "patrol": patrol,
+    }
+
+
+class AIScheduler:
+    """Picks the AI tanks that think this tick and holds AI work to a budget.
+
+    Level of detail: each tank has a ``next_think`` game time, and tanks
+    that are not due yet are skipped. The AI pushes it back for patrollers,
+    far from the player, while pursuers and attackers think every tick.
+
+    Budget: with ``budget`` seconds set, no further tanks are started once
+    a tick has spent that long on AI. The tanks still due are deferred and
+    go first next tick, so under load every tank gets its turn round-robin.
+    A cut depends on wall time, so ``cut`` reports how many tanks the last
+    tick decided before it (None without a cut; update_ai resets it), and
+    setting ``limit`` replays a recorded cut. ``clock`` measures the time
+    spent, in seconds.
+    """
+
+    def __init__(self, budget=None, clock=time.perf_counter):
+        self.budget = budget
+        self.clock = clock
+        self.limit = None
+        self.cut = None
+        # Id of the first tank deferred by the last cut
+        self.cursor = 0
+        # Decisions skipped by level of detail and deferred by the budget
+        self.skipped = 0
+        self.deferred = 0
+        self.started = 0.0
+
+    def due(self, tanks, current_time):
+        # Tanks to think this tick, starting where the last cut left off
+        due = [tank for tank in tanks if tank.next_think <= current_time]
+        self.skipped += len(tanks) - len(due)
+        self.started = self.clock()
+        start = next(
+            (index for index, tank in enumerate(due) if tank.id >= self.cursor), 0
+        )
+        return due[start:] + due[:start]
+
+    def may_continue(self, decided):
+        if self.limit is not None:
+            return decided < self.limit
+        if self.budget is None:
+            return True
+        return self.clock() - self.started < self.budget
+
+    def defer(self, due, decided):
+        # Out of budget after ``decided`` of the due tanks
+        self.deferred += len(due) - decided
+        self.cursor = due[decided].id
+        self.cut = decided
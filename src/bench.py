@@ -0,0 +1,320 @@
+"""Headless benchmark of the game simulation.
+
+    python -m src.bench --ticks 3000 --tanks 50 --projectiles 200 --rewards 10
+    python -m src.bench --tanks 200 --map trenches
+    python -m src.bench --ai-scaling
+
+Steps one room as fast as possible on a manual clock, so no display, web
+server or wall-clock waiting is involved, and reports ticks per second,
+the time spent in each subsystem and the allocations made along the way.
+The world is seeded and topped up to the requested load before every tick,
+so the same arguments replay the same match on every run.
+"""
+
+import argparse
+import gc
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+from src.ai import PATROL_RANGE
+from src.game import (
+    ENEMY_COLORS,
+    REWARD_TYPES,
+    add_entity,
+    add_reward,
+    change_map,
+    find_player,
+    level_map,
+    next_entity_id,
+    reset_game_state,
+    step_world,
+    update_ai_batch,
+    update_ai_tank,
+)
+from src.room import GameRoom
+from src.tank import TANK_RADIUS, Tank
+
+# Game time the benchmark clock starts at
+EPOCH = 1_000_000.0
+# Owner id of the projectiles the benchmark adds; no tank has it, so their
+# kills never count towards the player's level progress
+NO_OWNER = 0
+# Horde sizes --ai-scaling compares the AI paths at
+AI_SCALING_COUNTS = (64, 128, 256, 512, 1024, 2048)
+
+
+def populate(room, rng, tanks, projectiles, rewards):
+    """Top the world up to the requested number of entities.
+
+    The player is healed every tick as well, so the match never ends and
+    every tick carries the same load. Placement draws from ``rng`` rather
+    than the room's own generator, which stays the match's alone, and
+    avoids walls.
+    """
+    game_state = room.state
+    map_width = game_state["mapWidth"]
+    map_height = game_state["mapHeight"]
+    level = level_map(room)
+
+    def open_point(margin, radius):
+        while True:
+            x = rng.uniform(margin, map_width - margin)
+            y = rng.uniform(margin, map_height - margin)
+            if level.is_free(x, y, radius):
+                return x, y
+
+    player = find_player(room)
+    player.health = player.max_health
+
+    for _ in range(tanks - (len(game_state["tanks"]) - 1)):
+        x, y = open_point(20, TANK_RADIUS)
+        enemy_tank = Tank(
+            next_entity_id(room),
+            x,
+            y,
+            rng.randint(0, 359),
+            100,
+            rng.choice(ENEMY_COLORS),
+            ai_skill=0.7,
+        )
+        add_entity(room, "tanks", enemy_tank)
+
+    buffer = game_state["projectiles"]
+    for _ in range(projectiles - len(buffer)):
+        angle = rng.uniform(0, 360)
+        buffer.spawn(
+            next_entity_id(room),
+            rng.uniform(0, map_width),
+            rng.uniform(0, map_height),
+            angle,
+            NO_OWNER,
+            rng.uniform(-15, 15),
+            rng.uniform(-15, 15),
+            20,
+            "yellow",
+            room.clock(),
+        )
+
+    for _ in range(rewards - len(game_state["rewards"])):
+        reward_type = rng.choice(REWARD_TYPES)
+        while True:
+            x = rng.randint(50, map_width - 50)
+            y = rng.randint(50, map_height - 50)
+            if level.is_free(x, y, reward_type["radius"]):
+                break
+        add_reward(room, reward_type, x, y)
+
+
+def run(ticks, tanks, projectiles, rewards, tick_rate=30, seed=0, map_name=None):
+    """Step a seeded room ``ticks`` times; returns its timings.
+
+    The match is played on ``map_name``, or the first level's map.
+    The result holds the total seconds spent stepping, seconds per
+    subsystem (including the snapshot the server captures after each
+    tick), garbage collections per generation, the AI decisions skipped by
+    level of detail and the final entity counts.
+    """
+    rng = random.Random(seed)
+    tick_interval = 1.0 / tick_rate
+    room = GameRoom("bench", EPOCH)
+    clock = room.clock
+    reset_game_state(room, seed)
+    if map_name is not None:
+        change_map(room, map_name)
+
+    timings = {}
+    collections = [stats["collections"] for stats in gc.get_stats()]
+    total = 0.0
+    for _ in range(ticks):
+        populate(room, rng, tanks, projectiles, rewards)
+        now = clock.advance(tick_interval)
+
+        started = time.perf_counter()
+        step_world(room, now, tick_interval, timings)
+        captured = time.perf_counter()
+        room.snapshots.capture(room.state)
+        finished = time.perf_counter()
+
+        timings["snapshot"] = timings.get("snapshot", 0.0) + finished - captured
+        total += finished - started
+
+    game_state = room.state
+    return {
+        "seconds": total,
+        "timings": timings,
+        "collections": [
+            stats["collections"] - before
+            for stats, before in zip(gc.get_stats(), collections)
+        ],
+        "aiSkipped": game_state["aiScheduler"].skipped,
+        "entities": {
+            "tanks": len(game_state["tanks"]),
+            "projectiles": len(game_state["projectiles"]),
+            "rewards": len(game_state["rewards"]),
+        },
+    }
+
+
+def horde_room(tanks, seed=0, map_name=None):
+    """A seeded room with ``tanks`` AI tanks in pursuit range of the player.
+
+    None of them patrol, so every one of them acts on every tick.
+    """
+    rng = random.Random(seed)
+    room = GameRoom("bench", EPOCH)
+    reset_game_state(room, seed)
+    if map_name is not None:
+        change_map(room, map_name)
+    game_state = room.state
+    player = find_player(room)
+    level = level_map(room)
+    while len(game_state["tanks"]) <= tanks:
+        distance = rng.uniform(TANK_RADIUS * 2, PATROL_RANGE)
+        direction = rng.uniform(0, 2 * math.pi)
+        x = player.x + distance * math.cos(direction)
+        y = player.y + distance * math.sin(direction)
+        if (
+            20 <= x <= game_state["mapWidth"] - 20
+            and 20 <= y <= game_state["mapHeight"] - 20
+            and level.is_free(x, y, TANK_RADIUS)
+        ):
+            enemy_tank = Tank(
+                next_entity_id(room),
+                x,
+                y,
+                rng.randint(0, 359),
+                100,
+                rng.choice(ENEMY_COLORS),
+                ai_skill=0.7,
+            )
+            add_entity(room, "tanks", enemy_tank)
+    return room
+
+
+def ai_scaling(counts, ticks=50, tick_rate=30, seed=0, map_name=None):
+    """Milliseconds per tick deciding for hordes of each size in ``counts``.
+
+    Returns (count, per-tank, batched) rows: the median tick of
+    update_ai_tank for every tank in turn, and of one update_ai_batch call
+    for all of them, each on its own copy of the same horde.
+    """
+    rows = []
+    for count in counts:
+        medians = []
+        for batched in (False, True):
+            room = horde_room(count, seed, map_name)
+            player = find_player(room)
+            ai_tanks = room.state["tanks"][1:]
+            times = []
+            for _ in range(ticks):
+                now = room.clock.advance(1.0 / tick_rate)
+                started = time.perf_counter()
+                if batched:
+                    update_ai_batch(room, ai_tanks, player, now)
+                else:
+                    for ai_tank in ai_tanks:
+                        update_ai_tank(room, ai_tank, player, now)
+                times.append(time.perf_counter() - started)
+            medians.append(sorted(times)[ticks // 2] * 1000)
+        rows.append((count, *medians))
+    return rows
+
+
+def trace_allocations(
+    ticks, tanks, projectiles, rewards, tick_rate=30, seed=0, map_name=None
+):
+    """Repeat a run under tracemalloc; returns peak and retained bytes.
+
+    Tracing slows the simulation down severalfold, so it is kept out of the
+    timed run. Also returns the five source lines that gained the most
+    memory over the run.
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run(ticks, tanks, projectiles, rewards, tick_rate, seed, map_name)
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "peak": peak,
+        "retained": current,
+        "top": after.compare_to(before, "lineno")[:5],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=3000)
+    parser.add_argument("--tanks", type=int, default=20, help="AI tanks to keep alive")
+    parser.add_argument("--projectiles", type=int, default=100)
+    parser.add_argument("--rewards", type=int, default=5)
+    parser.add_argument("--tick-rate", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--map", help="map from levels/ to play on")
+    parser.add_argument(
+        "--no-allocations", action="store_true", help="skip the tracemalloc pass"
+    )
+    parser.add_argument(
+        "--ai-scaling",
+        action="store_true",
+        help="only compare per-tank and batched AI for growing hordes",
+    )
+    parser.add_argument(
+        "--min-tps",
+        type=float,
+        help="exit with status 1 if fewer ticks per second than this are reached",
+    )
+    args = parser.parse_args(argv)
+    if args.ai_scaling:
+        print("tanks  per-tank ms/tick  batched ms/tick  speed-up")
+        for count, per_tank, batched in ai_scaling(
+            AI_SCALING_COUNTS,
+            tick_rate=args.tick_rate,
+            seed=args.seed,
+            map_name=args.map,
+        ):
+            print(
+                f"{count:5d}  {per_tank:16.3f}  {batched:15.3f}  {per_tank / batched:7.2f}x"
+            )
+        return 0
+    load = (args.ticks, args.tanks, args.projectiles, args.rewards)
+
+    result = run(*load, args.tick_rate, args.seed, args.map)
+    ticks_per_second = args.ticks / result["seconds"]
+    print(
+        f"{args.ticks} ticks in {result['seconds']:.3f}s: "
+        f"{ticks_per_second:.1f} ticks/s "
+        f"({1000 / ticks_per_second:.3f} ms/tick)"
+    )
+    for name, seconds in sorted(
+        result["timings"].items(), key=lambda item: item[1], reverse=True
+    ):
+        print(
+            f"  {name:<12} {seconds * 1000 / args.ticks:8.3f} ms/tick "
+            f"{seconds / result['seconds']:6.1%}"
+        )
+    print(f"gc collections per generation: {result['collections']}")
+    print(f"AI decisions skipped: {result['aiSkipped']}")
+    print(f"final entities: {result['entities']}")
+
+    if not args.no_allocations:
+        allocations = trace_allocations(*load, args.tick_rate, args.seed, args.map)
+        print(
+            f"allocations: peak {allocations['peak'] / 1024:.1f} KiB, "
+            f"retained {allocations['retained'] / 1024:.1f} KiB"
+        )
+        for stat in allocations["top"]:
+            print(f"  {stat}")
+
+    if args.min_tps is not None and ticks_per_second < args.min_tps:
+        print(f"below the required {args.min_tps:.1f} ticks/s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,62 +1,1270 @@
-import pygame
-import sys
-from tank import Tank
-from projectile import Projectile
-from level import Level
-from utils import check_collision
-
-# Initialize Pygame
-pygame.init()
-
-# Game settings
-WIDTH, HEIGHT = 800, 600
-FPS = 60
-
-# Create the game window
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Tank Game")
-
-# Initialize game variables
-clock = pygame.time.Clock()
-level = Level()
-player_tank = Tank(position=(100, 100))
-projectiles = []
-game_over = False
-
-def game_loop():
-    global game_over
-
-    while not game_over:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                game_over = True
-
-            # Handle tank movement and shooting
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    projectile = player_tank.shoot()
-                    if projectile:
-                        projectiles.append(projectile)
-
-        # Update game state
-        player_tank.update()
-        for projectile in projectiles:
-            projectile.update()
-            if check_collision(projectile, level):
-                projectiles.remove(projectile)
-
-        # Draw everything
-        screen.fill((0, 0, 0))  # Clear the screen
-        level.draw(screen)
-        player_tank.draw(screen)
-        for projectile in projectiles:
-            projectile.draw(screen)
-
-        pygame.display.flip()  # Update the display
-        clock.tick(FPS)  # Maintain the frame rate
-
-    pygame.quit()
-    sys.exit()
-
-if __name__ == "__main__":
-    game_loop()
\ No newline at end of file
+"""The game simulation, independent of any web framework.
+
+Every function takes the room whose world it works on; the world itself is
+the plain dict in ``room.state``. The server in app.py and the headless
+runner in src/bench.py drive it through reset_game_state and step_world.
+"""
+
+import math
+import os
+import random
+import time
+from operator import attrgetter
+
+import numpy as np
+
+from src.ai import AIScheduler, think
+from src.inputs import MOVE_DIRECTIONS, new_input_queue
+from src.level import FlowField, campaign, load_level
+from src.projectile import ProjectileBuffer
+from src.reward import Reward
+from src.spatial import SpatialHash, grid_pairs
+from src.tank import PLAYER_ID, TANK_RADIUS, Tank
+from src.timers import TimerQueue
+
+# Reward types - Increased base barrel duration from 30 to 45 seconds
+REWARD_TYPES = [
+    {
+        "type": "barrel",
+        "color": "purple",
+        "duration": 45,
+        "radius": 15,
+        "stackable": True,
+    },
+    {
+        "type": "health",
+        "color": "red",
+        "duration": 0,
+        "radius": 15,
+        "stackable": False,
+    },  # Health pack is instant
+    # New reward type: Double damage
+    {
+        "type": "damage",
+        "color": "orange",
+        "duration": 30,
+        "radius": 15,
+        "stackable": True,
+    },
+]
+
+
+# Seconds between looks at a patrolling AI tank; pursuers and attackers
+# think every tick
+PATROL_THINK_INTERVAL = 0.25
+# From this many due AI tanks on, update_ai decides for them in groups, as
+# even as possible and of at most AI_BATCH_SIZE, each with arrays at once.
+# Below it NumPy's per-call overhead outweighs the per-tank Python it saves;
+# `python -m src.bench --ai-scaling` measures where the two cross.
+BATCH_AI_MIN_TANKS = 256
+AI_BATCH_SIZE = 512
+# Tank fields the batched AI reads, by the names think() takes them
+AI_FIELDS = {
+    "x": attrgetter("x"),
+    "y": attrgetter("y"),
+    "angle": attrgetter("angle"),
+    "skill": attrgetter("ai_skill"),
+    "last_update": attrgetter("last_update"),
+    "last_shot": attrgetter("last_shot"),
+}
+
+# Largest reward radius, for broad-phase pickup queries
+MAX_REWARD_RADIUS = max(reward_type["radius"] for reward_type in REWARD_TYPES)
+
+
+# Enemy colors for different levels
+ENEMY_COLORS = ["blue", "red", "darkviolet", "darkgoldenrod", "darkcyan"]
+
+
+# Level configuration, from levels/campaign.json by way of the level pack
+LEVEL_CONFIG = campaign()
+
+
+def level_settings(number):
+    # Settings of level ``number``; any level past the last plays like it
+    settings = LEVEL_CONFIG.get(number)
+    if settings is None:
+        settings = LEVEL_CONFIG[max(LEVEL_CONFIG)]
+    return settings
+
+
+def tick_phases(room, current_time, elapsed):
+    # The subsystems one tick runs, in order, as (name, function, arguments)
+    return (
+        ("inputs", apply_queued_inputs, (room,)),
+        ("projectiles", update_projectiles, (room, elapsed)),
+        ("reap", reap_dead_tanks, (room,)),
+        ("tankIndex", rebuild_tank_index, (room,)),
+        ("timers", run_timers, (room, current_time)),
+        ("flowField", update_flow_field, (room,)),
+        ("ai", update_ai, (room, current_time)),
+    )
+
+
+def step_world(room, current_time, elapsed, timings=None):
+    """Advance the world by exactly one fixed simulation step.
+
+    ``elapsed`` is the step length in seconds. Pass a dict as ``timings``
+    to have the seconds spent in each subsystem added to it by name.
+    """
+    game_state = room.state
+    if not game_state["gameActive"]:
+        return
+
+    for name, phase, args in tick_phases(room, current_time, elapsed):
+        if timings is None:
+            phase(*args)
+        else:
+            started = time.perf_counter()
+            phase(*args)
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+    game_state["lastUpdate"] = current_time
+
+
+def rebuild_tank_index(room):
+    game_state = room.state
+    # Tanks hold still until the AI runs, so one rebuild serves the tick
+    game_state["tankIndex"].rebuild(game_state["tanks"])
+
+
+def level_map(room):
+    # The Level the room's match is played on
+    return load_level(room.state["map"])
+
+
+def change_map(room, name):
+    game_state = room.state
+    level = load_level(name)
+    game_state["map"] = name
+    game_state["mapWidth"] = level.width
+    game_state["mapHeight"] = level.height
+    game_state["flowField"] = None
+
+    # Nothing may be left inside the new walls
+    player_tank = find_player(room)
+    if player_tank and not level.is_free(player_tank.x, player_tank.y, TANK_RADIUS):
+        player_tank.x, player_tank.y = level.spawn
+    for reward in list(game_state["rewards"]):
+        if not level.is_free(reward.x, reward.y, reward.radius):
+            remove_reward(room, reward)
+
+
+def update_flow_field(room):
+    game_state = room.state
+    # AI tanks route to the player over one field per room, rebuilt only
+    # when the player enters another tile
+    level = level_map(room)
+    player_tank = find_player(room)
+    if not level.has_walls or not player_tank:
+        return
+    goal = level.cell(player_tank.x, player_tank.y)
+    flow_field = game_state["flowField"]
+    if flow_field is None or flow_field.goal != goal:
+        game_state["flowField"] = FlowField(level, goal)
+
+
+def enemy_spawn_due(room, current_time):
+    game_state = room.state
+    rng = game_state["rng"]
+    # Count current active AI tanks
+    active_enemies = 0
+    for tank in game_state["tanks"]:
+        if tank.id != PLAYER_ID and tank.health > 0:
+            active_enemies += 1
+
+    # Get configuration for current level
+    level_conf = level_settings(game_state["currentLevel"])
+
+    # If we have fewer enemies than the maximum allowed, spawn a new one
+    if active_enemies < level_conf["max_enemies"]:
+        # Pick a spawn position away from player
+        player_tank = find_player(room)
+
+        if player_tank:
+            # Try to spawn away from the player
+            spawn_x, spawn_y = get_spawn_position(room, player_tank)
+
+            # Get color based on level (cycling through available colors)
+            color_index = (game_state["currentLevel"] - 1) % len(ENEMY_COLORS)
+            enemy_color = ENEMY_COLORS[color_index]
+
+            # New enemy tank
+            enemy_health = 100  # Standard health for enemies
+            enemy_tank = Tank(
+                next_entity_id(room),
+                spawn_x,
+                spawn_y,
+                rng.randint(0, 359),
+                enemy_health,
+                enemy_color,
+                ai_skill=level_conf["ai_skill"],
+            )
+
+            add_entity(room, "tanks", enemy_tank)
+
+            # Set next spawn time based on level configuration
+            game_state["nextEnemySpawn"] = current_time + level_conf["spawn_delay"]
+            schedule_enemy_spawn(room)
+
+
+def get_spawn_position(room, player_tank):
+    """Get a spawn position for a new enemy, away from the player."""
+    game_state = room.state
+    rng = game_state["rng"]
+    map_width = game_state["mapWidth"]
+    map_height = game_state["mapHeight"]
+    level = level_map(room)
+
+    # Try to find a position that's at least 300 pixels away from the player
+    for _ in range(10):  # Try 10 times
+        if level.spawn_zones:
+            # The map says where enemies come in
+            left, top, right, bottom = rng.choice(level.spawn_zones)
+            spawn_x = rng.randint(left, right)
+            spawn_y = rng.randint(top, bottom)
+        else:
+            # Pick a quadrant opposite to the player
+            if player_tank.x < map_width / 2:
+                spawn_x = rng.randint(int(map_width * 0.6), int(map_width * 0.9))
+            else:
+                spawn_x = rng.randint(int(map_width * 0.1), int(map_width * 0.4))
+
+            if player_tank.y < map_height / 2:
+                spawn_y = rng.randint(int(map_height * 0.6), int(map_height * 0.9))
+            else:
+                spawn_y = rng.randint(int(map_height * 0.1), int(map_height * 0.4))
+
+        # Check distance to player
+        dx = player_tank.x - spawn_x
+        dy = player_tank.y - spawn_y
+        distance = math.sqrt(dx * dx + dy * dy)
+
+        if distance > 300 and level.is_free(spawn_x, spawn_y, TANK_RADIUS):
+            return spawn_x, spawn_y
+
+    # If we couldn't find a good spot, return a random position, or the
+    # middle of a random open tile if that one is walled
+    spawn_x = rng.randint(50, map_width - 50)
+    spawn_y = rng.randint(50, map_height - 50)
+    if level.is_free(spawn_x, spawn_y, TANK_RADIUS):
+        return spawn_x, spawn_y
+    return level.center(int(rng.choice(level.open_cells)))
+
+
+def update_ai(room, current_time):
+    game_state = room.state
+    scheduler = game_state["aiScheduler"]
+    scheduler.cut = None
+    player_tank = find_player(room)
+
+    if not player_tank or player_tank.health <= 0:
+        return  # Player is dead, no need to update AI
+
+    # Skip player tank and dead tanks
+    ai_tanks = [
+        tank
+        for tank in game_state["tanks"]
+        if tank.id != PLAYER_ID and tank.health > 0
+    ]
+    due = scheduler.due(ai_tanks, current_time)
+
+    # A few tanks are cheaper to run one by one than as arrays. Either way
+    # the budget is checked between groups, and the first always runs.
+    group_size = 1
+    if len(due) >= BATCH_AI_MIN_TANKS:
+        groups = -(-len(due) // AI_BATCH_SIZE)
+        group_size = -(-len(due) // groups)
+    for start in range(0, len(due), group_size):
+        if start and not scheduler.may_continue(start):
+            scheduler.defer(due, start)
+            break
+        if group_size == 1:
+            update_ai_tank(room, due[start], player_tank, current_time)
+        else:
+            update_ai_batch(
+                room, due[start : start + group_size], player_tank, current_time
+            )
+
+
+def update_ai_batch(room, ai_tanks, player_tank, current_time):
+    # update_ai_tank for a whole group, with the decisions made by think()
+    game_state = room.state
+    rewards = game_state["rewards"]
+    reward_x = np.array([reward.x for reward in rewards], dtype=float)
+    reward_y = np.array([reward.y for reward in rewards], dtype=float)
+    columns = {
+        name: np.fromiter(map(field, ai_tanks), dtype=float, count=len(ai_tanks))
+        for name, field in AI_FIELDS.items()
+    }
+    # Tanks with walls between them and the player get a waypoint to head for
+    waypoints = None
+    if game_state["flowField"] is not None:
+        waypoints = game_state["flowField"].waypoints(columns["x"], columns["y"])
+    plan = think(
+        columns,
+        (player_tank.x, player_tank.y),
+        (reward_x, reward_y),
+        current_time,
+        game_state["mapWidth"],
+        game_state["mapHeight"],
+        game_state["aiRng"],
+        waypoints,
+    )
+
+    # Moves that ran into a wall slide along it instead
+    acting = plan["acting"]
+    new_x = plan["x"]
+    new_y = plan["y"]
+    level = level_map(room)
+    if level.has_walls:
+        new_x, new_y = level.slides(
+            columns["x"][acting], columns["y"][acting], new_x, new_y, TANK_RADIUS
+        )
+
+    # Only tanks that acted have anything to write back, in one pass
+    acting_tanks = [ai_tanks[index] for index in acting.tolist()]
+    updates = zip(acting_tanks, new_x.tolist(), new_y.tolist(), plan["angle"].tolist())
+    for tank, x, y, angle in updates:
+        tank.x = x
+        tank.y = y
+        tank.angle = angle
+    for index in np.flatnonzero(plan["deciding"]).tolist():
+        acting_tanks[index].last_update = current_time
+
+    # Tanks that moved may have driven over a reward
+    if rewards:
+        moved = np.flatnonzero(plan["moved"])
+        rows, _ = grid_pairs(
+            new_x[moved], new_y[moved], reward_x, reward_y, 20 + MAX_REWARD_RADIUS
+        )
+        for index in np.unique(moved[rows]).tolist():
+            check_reward_collision(room, acting_tanks[index])
+
+    for index in plan["fire"].tolist():
+        ai_tank = ai_tanks[index]
+        fire_tank_weapon(room, ai_tank)
+        ai_tank.last_shot = current_time
+
+    next_think = current_time + PATROL_THINK_INTERVAL
+    for index in np.flatnonzero(plan["patrol"]).tolist():
+        ai_tanks[index].next_think = next_think
+
+
+def update_ai_tank(room, ai_tank, player_tank, current_time):
+    game_state = room.state
+    rng = game_state["rng"]
+    # Calculate distance to player
+    dx = player_tank.x - ai_tank.x
+    dy = player_tank.y - ai_tank.y
+    distance_to_player = math.sqrt(dx * dx + dy * dy)
+
+    # Calculate angle to player
+    angle_to_player = math.degrees(math.atan2(dx, -dy)) % 360
+
+    # AI skill factor (higher levels have smarter AI)
+    ai_skill = ai_tank.ai_skill
+
+    # Update AI state based on distance to player
+    if distance_to_player > 300:
+        ai_state = "patrol"
+    elif distance_to_player > 150:
+        ai_state = "pursue"
+    else:
+        ai_state = "attack"
+
+    # With walls in the way, drive along the room's flow field towards the
+    # player instead of aiming
+    if ai_state != "patrol" and game_state["flowField"] is not None:
+        waypoint = game_state["flowField"].waypoint(ai_tank.x, ai_tank.y)
+        if waypoint is not None:
+            wx = waypoint[0] - ai_tank.x
+            wy = waypoint[1] - ai_tank.y
+            rotate_tank_to_angle(ai_tank, math.degrees(math.atan2(wx, -wy)) % 360)
+            move_tank_forward(room, ai_tank)
+            return
+
+    # Perform actions based on AI state
+    if ai_state == "patrol":
+        # Far from the player, so look at this tank less often
+        ai_tank.next_think = current_time + PATROL_THINK_INTERVAL
+        # In patrol mode, move randomly and look for rewards
+        if current_time - ai_tank.last_update > 1.0:
+            # Every second, potentially change direction
+            if (
+                rng.random() < 0.7 * ai_skill
+            ):  # Higher skill means better at finding rewards
+                # Check if there are any rewards to move toward
+                closest_reward, min_distance = game_state["rewardIndex"].nearest(
+                    ai_tank.x, ai_tank.y
+                )
+
+                if closest_reward:
+                    # Calculate angle to reward
+                    rx = closest_reward.x - ai_tank.x
+                    ry = closest_reward.y - ai_tank.y
+                    angle_to_reward = math.degrees(math.atan2(rx, -ry)) % 360
+
+                    # Rotate toward reward
+                    rotate_tank_to_angle(ai_tank, angle_to_reward)
+                    # Move forward toward reward
+                    move_tank_forward(room, ai_tank)
+
+                    # If close to reward, try to collect it
+                    if min_distance < 50:
+                        check_reward_collision(room, ai_tank)
+                else:
+                    # No reward found, move randomly
+                    ai_tank.angle = (
+                        ai_tank.angle + rng.randint(-30, 30)
+                    ) % 360
+                    move_tank_forward(room, ai_tank)
+            else:
+                # Random movement
+                ai_tank.angle = (ai_tank.angle + rng.randint(-30, 30)) % 360
+                move_tank_forward(room, ai_tank)
+
+            ai_tank.last_update = current_time
+
+    elif ai_state == "pursue":
+        # In pursue mode, move toward player but keep some distance
+        rotate_tank_to_angle(ai_tank, angle_to_player)
+
+        # Decide whether to move forward or backward to maintain distance
+        if distance_to_player > 250:
+            move_tank_forward(room, ai_tank)
+        elif distance_to_player < 200:
+            move_tank_backward(room, ai_tank)
+
+        # Occasionally fire at player
+        if current_time - ai_tank.last_shot > (
+            1.5 - (ai_skill * 0.5)
+        ):  # Higher skill = faster firing
+            if (
+                abs(ai_tank.angle - angle_to_player) < (20 - (ai_skill * 10))
+                and rng.random() < ai_skill
+            ):
+                fire_tank_weapon(room, ai_tank)
+                ai_tank.last_shot = current_time
+
+    elif ai_state == "attack":
+        # In attack mode, aim and fire at player
+        rotate_tank_to_angle(ai_tank, angle_to_player)
+
+        # Keep optimal distance from player
+        if distance_to_player > 180:
+            move_tank_forward(room, ai_tank)
+        elif distance_to_player < 120:
+            move_tank_backward(room, ai_tank)
+
+        # If aimed at player, fire
+        if abs((ai_tank.angle - angle_to_player + 180) % 360 - 180) < (
+            15 - (ai_skill * 5)
+        ):  # Higher skill = better aim
+            if current_time - ai_tank.last_shot > (
+                1.0 - (ai_skill * 0.3)
+            ):  # Higher skill = faster firing
+                fire_tank_weapon(room, ai_tank)
+                ai_tank.last_shot = current_time
+
+            # Also consider strafing to avoid being hit
+            if rng.random() < (
+                0.3 + (ai_skill * 0.2)
+            ):  # Higher skill = more evasive
+                if rng.random() < 0.5:
+                    move_tank_left(room, ai_tank)
+                else:
+                    move_tank_right(room, ai_tank)
+
+
+def rotate_tank_to_angle(tank, target_angle):
+    # Calculate the shortest rotation direction
+    current = tank.angle
+    target = target_angle
+
+    # Find the shortest angle difference
+    angle_diff = ((target - current + 180) % 360) - 180
+
+    # Apply a limited rotation (5 degrees per update)
+    if abs(angle_diff) > 5:
+        if angle_diff > 0:
+            tank.angle = (tank.angle + 5) % 360
+        else:
+            tank.angle = (tank.angle - 5) % 360
+    else:
+        tank.angle = target_angle
+
+
+def move_tank_forward(room, tank):
+    speed = 5
+    rad_angle = math.radians(tank.angle)
+    move_tank_to(
+        room,
+        tank,
+        tank.x + math.sin(rad_angle) * speed,
+        tank.y - math.cos(rad_angle) * speed,
+    )
+
+
+def move_tank_backward(room, tank):
+    speed = 5
+    rad_angle = math.radians(tank.angle)
+    move_tank_to(
+        room,
+        tank,
+        tank.x - math.sin(rad_angle) * speed,
+        tank.y + math.cos(rad_angle) * speed,
+    )
+
+
+def move_tank_left(room, tank):
+    speed = 5
+    rad_angle = math.radians(tank.angle - 90)
+    move_tank_to(
+        room,
+        tank,
+        tank.x + math.sin(rad_angle) * speed,
+        tank.y - math.cos(rad_angle) * speed,
+    )
+
+
+def move_tank_right(room, tank):
+    speed = 5
+    rad_angle = math.radians(tank.angle + 90)
+    move_tank_to(
+        room,
+        tank,
+        tank.x + math.sin(rad_angle) * speed,
+        tank.y - math.cos(rad_angle) * speed,
+    )
+
+
+def move_tank_to(room, tank, x, y):
+    game_state = room.state
+    # Keep tank within boundaries
+    map_width = game_state["mapWidth"]
+    map_height = game_state["mapHeight"]
+    x = max(20, min(x, map_width - 20))
+    y = max(20, min(y, map_height - 20))
+    # and out of walls, sliding along any it runs into
+    level = level_map(room)
+    if level.has_walls:
+        x, y = level.slide(tank.x, tank.y, x, y, TANK_RADIUS)
+    tank.x = x
+    tank.y = y
+    check_reward_collision(room, tank)
+
+
+# Update the fire_tank_weapon function to apply damage boost
+
+
+def fire_tank_weapon(room, tank):
+    game_state = room.state
+    # Create a projectile for each barrel
+    barrels = tank.barrels
+
+    # Calculate damage - apply damage boost if active
+    base_damage = 20
+    damage_multiplier = tank.damage_multiplier
+    projectile_damage = base_damage * damage_multiplier
+
+    for i in range(barrels):
+        # Calculate angle adjustment for multiple barrels
+        angle_adjustment = 0
+        if barrels > 1:
+            # Spread from -15 to +15 degrees
+            angle_adjustment = (i / (barrels - 1) * 30) - 15
+
+        # Create a new projectile from the front of the tank
+        fire_angle = tank.angle + angle_adjustment
+        rad_angle = math.radians(fire_angle)
+
+        # Position the projectile at the end of the cannon
+        cannon_length = 30
+        front_x = tank.x + math.sin(rad_angle) * cannon_length
+        front_y = tank.y - math.cos(rad_angle) * cannon_length
+
+        # Calculate velocity components
+        projectile_speed = 15
+        velocity_x = math.sin(rad_angle) * projectile_speed
+        velocity_y = -math.cos(rad_angle) * projectile_speed
+
+        # Add visualization for boosted damage
+        projectile_color = "yellow"
+        if damage_multiplier > 1.0:
+            projectile_color = "orange"  # Boosted projectiles have orange color
+
+        game_state["projectiles"].spawn(
+            next_entity_id(room),
+            front_x,
+            front_y,
+            fire_angle,
+            tank.id,
+            velocity_x,
+            velocity_y,
+            projectile_damage,
+            projectile_color,
+            room.clock(),
+        )
+
+
+def next_entity_id(room):
+    game_state = room.state
+    # Ids are handed out once per game, so snapshot deltas and the entity
+    # index never confuse a new entity with one that was removed
+    entity_id = game_state["nextEntityId"]
+    game_state["nextEntityId"] += 1
+    return entity_id
+
+
+def add_entity(room, entity_type, entity):
+    game_state = room.state
+    game_state[entity_type].append(entity)
+    game_state["entities"][entity.id] = entity
+
+
+def find_player(room):
+    return room.state["entities"].get(PLAYER_ID)
+
+
+def remove_reward(room, reward):
+    game_state = room.state
+    game_state["rewards"].remove(reward)
+    game_state["rewardIndex"].remove(reward)
+    game_state["timers"].cancel(("rewardExpiry", reward.id))
+    del game_state["entities"][reward.id]
+
+
+def remove_tanks(room, condition):
+    game_state = room.state
+    # Drop matching tanks from the tank list and the id index
+    kept = []
+    for tank in game_state["tanks"]:
+        if condition(tank):
+            del game_state["entities"][tank.id]
+        else:
+            kept.append(tank)
+    game_state["tanks"] = kept
+
+
+def reap_dead_tanks(room):
+    game_state = room.state
+    # Destroyed enemies are removed rather than skipped on every later tick.
+    # The player's tank stays so clients can show the game-over state.
+    tank_count = len(game_state["tanks"])
+    remove_tanks(room, lambda tank: tank.id != PLAYER_ID and tank.health <= 0)
+    # A spawn held back by the enemy limit can go ahead once a slot frees up
+    if len(game_state["tanks"]) < tank_count:
+        schedule_enemy_spawn(room)
+
+
+def run_timers(room, current_time):
+    # Fire the timers that came due since the last tick; the cost follows
+    # the number of events firing, not the number of entities
+    for key in room.state["timers"].pop_due(current_time):
+        TIMER_HANDLERS[key[0]](room, current_time, *key[1:])
+
+
+def schedule_reward_spawn(room, current_time):
+    game_state = room.state
+    rng = game_state["rng"]
+    # Spawn rewards every 10-20 seconds, more frequently in higher levels
+    spawn_interval = max(5, 20 - (game_state["currentLevel"] * 2))
+    game_state["timers"].schedule(
+        ("rewardSpawn",),
+        current_time + rng.uniform(spawn_interval / 2, spawn_interval),
+    )
+
+
+def schedule_enemy_spawn(room):
+    game_state = room.state
+    game_state["timers"].schedule(("enemySpawn",), game_state["nextEnemySpawn"])
+
+
+def show_expiry_message(room, tank, message, current_time):
+    tank.powerup_message = message
+    # Remove after 2 seconds
+    tank.message_expiry = current_time + 2
+    room.state["timers"].schedule(("messageExpiry", tank.id), tank.message_expiry)
+
+
+def reward_spawn_due(room, current_time):
+    spawn_reward(room)
+    schedule_reward_spawn(room, current_time)
+
+
+def reward_expired(room, current_time, reward_id):
+    reward = room.state["entities"].get(reward_id)
+    if reward is not None:
+        remove_reward(room, reward)
+
+
+def barrels_expired(room, current_time, tank_id):
+    tank = room.state["entities"].get(tank_id)
+    if tank is None:
+        return
+
+    tank.barrels = 1  # Reset to default number of barrels
+    if tank.powerup_message is not None:
+        show_expiry_message(room, tank, "Extra Barrels Expired", current_time)
+
+    # Clear power-up data
+    tank.powerup_type = None
+    tank.powerup_color = None
+
+
+def damage_boost_expired(room, current_time, tank_id):
+    tank = room.state["entities"].get(tank_id)
+    if tank is None:
+        return
+
+    tank.damage_boost = 1.0  # Reset to normal damage
+    if tank.powerup_message is not None:
+        show_expiry_message(room, tank, "Damage Boost Expired", current_time)
+
+    # Clear power-up data
+    tank.damage_boost_color = None
+
+
+def message_expired(room, current_time, tank_id):
+    tank = room.state["entities"].get(tank_id)
+    if tank is not None:
+        tank.powerup_message = None
+        tank.message_expiry = None
+
+
+# Timer kinds, the first element of a timer key, and what firing one does
+TIMER_HANDLERS = {
+    "rewardSpawn": reward_spawn_due,
+    "rewardExpiry": reward_expired,
+    "barrelsExpiry": barrels_expired,
+    "damageBoostExpiry": damage_boost_expired,
+    "messageExpiry": message_expired,
+    "enemySpawn": enemy_spawn_due,
+}
+
+
+def apply_queued_inputs(room):
+    game_state = room.state
+    # Apply buffered input frames once per tick, in arrival order
+    queue = game_state["inputQueue"]
+    last_seq = game_state["inputSeq"]
+    while queue:
+        frame = queue.popleft()
+        seq = frame["seq"]
+        if seq is not None:
+            # Drop frames repeated or overtaken on the way here
+            if seq <= last_seq.get(frame["id"], -1):
+                continue
+            last_seq[frame["id"]] = seq
+        apply_input_frame(room, frame)
+
+
+def apply_input_frame(room, frame):
+    game_state = room.state
+    # Look the tank up once for every input held in this frame
+    tank = game_state["entities"].get(frame["id"])
+    if not isinstance(tank, Tank) or tank.health <= 0:
+        return
+
+    # Same order the client used to send separate actions in
+    if frame["rotate"]:
+        apply_tank_action(room, tank, "rotate", frame["rotate"])
+    for bit, direction in MOVE_DIRECTIONS:
+        if frame["keys"] & bit:
+            apply_tank_action(room, tank, "move", direction)
+    if frame["fire"]:
+        apply_tank_action(room, tank, "fire", None)
+
+
+def apply_tank_action(room, tank, action, value):
+    game_state = room.state
+
+    if action == "rotate":
+        # Smooth rotation based on value
+        tank.angle = (tank.angle + value) % 360
+    elif action == "move":
+        speed = 5  # Pixels per frame
+        x = tank.x
+        y = tank.y
+        # Handle direction: forward, backward, left, right
+        if value == "forward":
+            # Move in direction of tank angle (0 degrees now points up)
+            rad_angle = math.radians(tank.angle)
+            x += math.sin(rad_angle) * speed
+            y -= math.cos(rad_angle) * speed
+        elif value == "backward":
+            # Move opposite to the direction of tank angle
+            rad_angle = math.radians(tank.angle)
+            x -= math.sin(rad_angle) * speed
+            y += math.cos(rad_angle) * speed
+        elif value == "left":
+            # Move perpendicular to tank angle (left)
+            rad_angle = math.radians(tank.angle - 90)
+            x += math.sin(rad_angle) * speed
+            y -= math.cos(rad_angle) * speed
+        elif value == "right":
+            # Move perpendicular to tank angle (right)
+            rad_angle = math.radians(tank.angle + 90)
+            x += math.sin(rad_angle) * speed
+            y -= math.cos(rad_angle) * speed
+
+        # Keep tank within boundaries and out of walls, then check for
+        # reward collision
+        move_tank_to(room, tank, x, y)
+
+    elif action == "fire":
+        # Prevent rapid fire (limit to one projectile per 0.5 seconds)
+        can_fire = not game_state["projectiles"].fired_within(
+            tank.id, room.clock(), 0.5
+        )
+
+        if can_fire:
+            # Get the number of barrels this tank has
+            barrels = tank.barrels
+
+            # Calculate damage - apply damage boost if active
+            base_damage = 20
+            damage_multiplier = tank.damage_multiplier
+            projectile_damage = base_damage * damage_multiplier
+
+            # Create a projectile for each barrel
+            # If barrels > 1, spread them out in a fan pattern
+            for i in range(barrels):
+                # Calculate angle adjustment for multiple barrels
+                angle_adjustment = 0
+                if barrels > 1:
+                    # Spread from -15 to +15 degrees
+                    angle_adjustment = (i / (barrels - 1) * 30) - 15
+
+                # Create a new projectile from the front of the tank
+                fire_angle = tank.angle + angle_adjustment
+                rad_angle = math.radians(fire_angle)
+
+                # Position the projectile at the end of the cannon
+                cannon_length = 30
+                front_x = tank.x + math.sin(rad_angle) * cannon_length
+                front_y = tank.y - math.cos(rad_angle) * cannon_length
+
+                # Calculate velocity components
+                projectile_speed = 15
+                velocity_x = math.sin(rad_angle) * projectile_speed
+                velocity_y = -math.cos(rad_angle) * projectile_speed
+
+                # Add visualization for boosted damage
+                projectile_color = "yellow"
+                if damage_multiplier > 1.0:
+                    projectile_color = (
+                        "orange"  # Boosted projectiles have orange color
+                    )
+
+                game_state["projectiles"].spawn(
+                    next_entity_id(room),
+                    front_x,
+                    front_y,
+                    fire_angle,
+                    tank.id,
+                    velocity_x,
+                    velocity_y,
+                    projectile_damage,
+                    projectile_color,
+                    room.clock(),
+                )
+
+
+# Update the check_reward_collision function for stacking and level scaling
+
+
+def check_reward_collision(room, tank):
+    game_state = room.state
+    # Check if tank has collided with any rewards nearby
+    for reward in game_state["rewardIndex"].nearby(
+        tank.x, tank.y, 20 + MAX_REWARD_RADIUS
+    ):
+        dx = tank.x - reward.x
+        dy = tank.y - reward.y
+        distance = math.sqrt(dx * dx + dy * dy)
+
+        if distance < (20 + reward.radius):  # Tank radius + reward radius
+            # Apply reward effect
+            if reward.kind == "barrel":
+                # Set maximum barrels (increase with level)
+                max_barrels = min(3 + math.floor(game_state["currentLevel"] / 2), 6)
+
+                # Increase barrel count
+                tank.barrels = min(tank.barrels + 1, max_barrels)
+
+                # Apply level scaling to duration - higher levels get longer duration
+                base_duration = reward.duration
+                level_bonus = (
+                    game_state["currentLevel"] - 1
+                ) * 5  # +5 seconds per level
+                total_duration = base_duration + level_bonus
+
+                # Check if we already have an active power-up
+                if tank.powerup_time is not None and tank.powerup_duration is not None:
+                    # Calculate remaining time on current power-up
+                    current_time = room.clock()
+                    elapsed = current_time - tank.powerup_time
+                    remaining = max(0, tank.powerup_duration - elapsed)
+
+                    # Stack duration - add new duration to remaining time (if stackable)
+                    if reward.stackable:
+                        tank.powerup_duration = remaining + total_duration
+                        tank.powerup_time = current_time
+                    else:
+                        # Take the longer of the two durations
+                        if total_duration > remaining:
+                            tank.powerup_duration = total_duration
+                            tank.powerup_time = current_time
+                else:
+                    # New power-up
+                    tank.powerup_time = room.clock()
+                    tank.powerup_duration = total_duration
+
+                game_state["timers"].schedule(
+                    ("barrelsExpiry", tank.id),
+                    tank.powerup_time + tank.powerup_duration,
+                )
+
+                # Add visualization data
+                tank.powerup_type = reward.kind
+                tank.powerup_color = reward.color
+
+                # Send notification to client
+                tank.powerup_message = (
+                    f"Extra Barrels: {tank.barrels} ({int(tank.powerup_duration)}s)"
+                )
+
+            elif reward.kind == "health":
+                # Health pack gives more health in higher levels
+                base_health = 30
+                level_bonus = (
+                    game_state["currentLevel"] - 1
+                ) * 5  # +5 health per level
+                health_gain = min(base_health + level_bonus, 50)  # Cap at +50 health
+
+                tank.health = min(tank.health + health_gain, tank.max_health)
+
+                # Notification message
+                tank.powerup_message = f"Health Restored: +{health_gain}"
+
+            elif reward.kind == "damage":
+                # New reward: increased damage
+                tank.damage_boost = 2.0  # Double damage
+
+                # Apply level scaling to duration
+                base_duration = reward.duration
+                level_bonus = (
+                    game_state["currentLevel"] - 1
+                ) * 3  # +3 seconds per level
+                total_duration = base_duration + level_bonus
+
+                # Handle stacking similar to barrel power-up
+                if (
+                    tank.damage_boost_time is not None
+                    and tank.damage_boost_duration is not None
+                ):
+                    current_time = room.clock()
+                    elapsed = current_time - tank.damage_boost_time
+                    remaining = max(0, tank.damage_boost_duration - elapsed)
+
+                    if reward.stackable:
+                        tank.damage_boost_duration = remaining + total_duration
+                        tank.damage_boost_time = current_time
+                    else:
+                        if total_duration > remaining:
+                            tank.damage_boost_duration = total_duration
+                            tank.damage_boost_time = current_time
+                else:
+                    tank.damage_boost_time = room.clock()
+                    tank.damage_boost_duration = total_duration
+
+                game_state["timers"].schedule(
+                    ("damageBoostExpiry", tank.id),
+                    tank.damage_boost_time + tank.damage_boost_duration,
+                )
+
+                # Add visualization data
+                tank.damage_boost_color = reward.color
+
+                # Notification message
+                tank.powerup_message = (
+                    f"Damage Boost: x2 ({int(tank.damage_boost_duration)}s)"
+                )
+
+            # Remove the reward
+            remove_reward(room, reward)
+            break
+
+
+def update_projectiles(room, elapsed=0.033):  # Default to ~30 FPS
+    game_state = room.state
+    # Only process if game is active
+    if not game_state["gameActive"]:
+        return
+
+    # Move all projectiles, remembering where each step started
+    projectiles = game_state["projectiles"]
+    start_x, start_y = projectiles.advance(elapsed)
+
+    # Projectiles stop at the first wall on their path, hitting nothing
+    # behind it
+    level = level_map(room)
+    if level.has_walls:
+        projectiles.stop_at(
+            start_x,
+            start_y,
+            level.first_wall(
+                start_x, start_y, projectiles.live("x"), projectiles.live("y")
+            ),
+        )
+
+    # Swept hit test along each step, so long steps cannot skip past a tank
+    tanks = game_state["tanks"]
+    contacts = projectiles.contacts(
+        start_x,
+        start_y,
+        [tank.id for tank in tanks],
+        [tank.x for tank in tanks],
+        [tank.y for tank in tanks],
+    )
+
+    owners = projectiles.live("owner").tolist()
+    damages = projectiles.live("damage").tolist()
+    survivors = np.ones(len(projectiles), dtype=bool)
+
+    # Apply hits in the order they happen along the step, as each one can
+    # kill a tank or end the level
+    for index, column in contacts:
+        # A projectile stops at its first hit
+        if not survivors[index]:
+            continue
+        tank = tanks[column]
+        # Skip tanks with 0 health (the owner is never a contact)
+        if tank.health <= 0:
+            continue
+        # Skip enemies a level change earlier in this tick removed
+        if game_state["entities"].get(tank.id) is not tank:
+            continue
+
+        tank.health -= damages[index]
+
+        # Check if tank is destroyed
+        if tank.health <= 0:
+            tank.health = 0
+
+            # If an enemy is killed by player, update enemy counter
+            if tank.id != PLAYER_ID and owners[index] == PLAYER_ID:
+                game_state["enemiesDefeated"] += 1
+                check_level_completion(room)
+
+            # Check for game over if player is destroyed
+            if tank.id == PLAYER_ID:
+                check_game_over(room)
+
+        # Deactivate the projectile
+        survivors[index] = False
+
+    # Drop projectiles that hit something or left the map
+    projectiles.keep(
+        survivors & projectiles.on_map(game_state["mapWidth"], game_state["mapHeight"])
+    )
+
+
+# Update the check_level_completion function to respect maxHealth
+def check_level_completion(room):
+    game_state = room.state
+    # Check if player has defeated enough enemies to advance to next level
+    level_conf = level_settings(game_state["currentLevel"])
+
+    if game_state["enemiesDefeated"] >= level_conf["enemies_required"]:
+        # Level completed
+        next_level = game_state["currentLevel"] + 1
+
+        # Check if this was the final level
+        if next_level > max(LEVEL_CONFIG.keys()):
+            # Player completed all levels
+            game_state["gameActive"] = False
+            game_state["gameOver"] = True
+            game_state["winner"] = 1  # Player wins
+            game_state["completed"] = (
+                True  # Indicates game was completed rather than lost
+            )
+        else:
+            # Advance to next level
+            game_state["currentLevel"] = next_level
+            game_state["enemiesDefeated"] = 0  # Reset enemy counter
+
+            # Configure for new level
+            new_conf = level_settings(next_level)
+            game_state["enemiesRequired"] = new_conf["enemies_required"]
+            game_state["maxEnemies"] = new_conf["max_enemies"]
+
+            # Add a health bonus for completing a level
+            player_tank = find_player(room)
+            if player_tank:
+                player_tank.health = min(
+                    player_tank.health + 20, player_tank.max_health
+                )  # Bonus health
+
+            # Remove all enemies and spawn new ones for next level
+            remove_tanks(room, lambda tank: tank.id != PLAYER_ID)
+            change_map(room, new_conf["map"])
+            game_state["nextEnemySpawn"] = room.clock()  # Spawn first enemy immediately
+            schedule_enemy_spawn(room)
+
+
+def check_game_over(room):
+    game_state = room.state
+    # Check if player is alive
+    player_tank = find_player(room)
+    player_alive = player_tank is not None and player_tank.health > 0
+
+    # If player is eliminated, declare game over
+    if not player_alive:
+        game_state["gameActive"] = False
+        game_state["gameOver"] = True
+        game_state["winner"] = 0  # AI wins (no specific enemy)
+
+
+def new_seed():
+    return int.from_bytes(os.urandom(8), "little")
+
+
+def reset_game_state(room, seed=None, ai_budget=None):
+    """Start a new match in the room.
+
+    All randomness in the match comes from one generator seeded with
+    ``seed`` (a fresh one by default), and all time from ``room.clock``, so
+    the seed, the tick times and the input frames reproduce it exactly.
+    ``ai_budget`` caps the seconds of AI work per tick (no cap by default);
+    when it cuts a tick short, the cut is part of the match as well.
+    """
+    if seed is None:
+        seed = new_seed()
+    level = load_level(LEVEL_CONFIG[1]["map"])
+    room.state = {
+        "tanks": [],
+        "projectiles": ProjectileBuffer(),
+        "rewards": [],
+        "gameActive": True,
+        "gameOver": False,
+        "winner": None,
+        "map": level.name,
+        "mapWidth": level.width,
+        "mapHeight": level.height,
+        # Routes to the player for AI tanks, on maps with walls
+        "flowField": None,
+        "lastUpdate": room.clock(),
+        "lastAIUpdate": room.clock(),
+        "currentLevel": 1,
+        "enemiesDefeated": 0,
+        "enemiesRequired": LEVEL_CONFIG[1]["enemies_required"],
+        "maxEnemies": LEVEL_CONFIG[1]["max_enemies"],
+        "nextEnemySpawn": room.clock(),  # Spawn first enemy immediately
+        # Id index of tanks and rewards; ids are never reused within a game
+        "entities": {},
+        "nextEntityId": PLAYER_ID + 1,
+        # Input frames waiting for the next tick, and the last frame
+        # sequence applied per player
+        "inputQueue": new_input_queue(),
+        "inputSeq": {},
+        # Broad-phase indexes over the tank and reward lists
+        "tankIndex": SpatialHash(),
+        "rewardIndex": SpatialHash(),
+        # Reward spawns and expiries, power-up expiries and enemy spawns
+        "timers": TimerQueue(),
+        "seed": seed,
+        "rng": random.Random(seed),
+        # Bulk draws for the AI, seeded from the same match seed
+        "aiRng": np.random.default_rng(seed),
+        "aiScheduler": AIScheduler(ai_budget),
+    }
+
+    # Player tank
+    spawn_x, spawn_y = level.spawn
+    add_entity(room, "tanks", Tank(PLAYER_ID, spawn_x, spawn_y, 0, 150, "green"))
+    room.state["tankIndex"].rebuild(room.state["tanks"])
+
+    # Spawn initial rewards
+    for _ in range(2):
+        spawn_reward(room)
+    schedule_reward_spawn(room, room.clock())
+    schedule_enemy_spawn(room)
+
+
+# Update the spawn_reward function to include the new reward type
+
+
+def spawn_reward(room):
+    game_state = room.state
+    rng = game_state["rng"]
+    # Don't spawn too many rewards
+    max_rewards = 2 + game_state["currentLevel"]  # More rewards in higher levels
+    if len(game_state["rewards"]) >= max_rewards:
+        return
+
+    # Choose a random reward type based on weighted probabilities
+    roll = rng.random()
+
+    # Health more common in higher levels
+    health_chance = 0.2 * game_state["currentLevel"]
+
+    # Damage boost more rare, but increases with level
+    damage_chance = 0.1 + (0.05 * game_state["currentLevel"])
+
+    if roll < health_chance:
+        reward_type = REWARD_TYPES[1]  # Health
+    elif roll < health_chance + damage_chance:
+        reward_type = REWARD_TYPES[2]  # Damage boost
+    else:
+        reward_type = REWARD_TYPES[0]  # Barrel
+
+    # Choose a random position away from tanks
+    valid_position = False
+    attempts = 0
+    x, y = 0, 0
+    level = level_map(room)
+
+    while not valid_position and attempts < 10:
+        x = rng.randint(50, game_state["mapWidth"] - 50)
+        y = rng.randint(50, game_state["mapHeight"] - 50)
+
+        # Check if position is away from tanks
+        valid_position = True
+        for tank in game_state["tankIndex"].nearby(x, y, 100):
+            dx = tank.x - x
+            dy = tank.y - y
+            distance = math.sqrt(dx * dx + dy * dy)
+            if distance < 100:  # Keep rewards away from tanks
+                valid_position = False
+                break
+
+        # and clear of walls
+        if not level.is_free(x, y, reward_type["radius"]):
+            valid_position = False
+
+        attempts += 1
+
+    if valid_position:
+        add_reward(room, reward_type, x, y)
+
+
+def add_reward(room, reward_type, x, y):
+    game_state = room.state
+    reward = Reward(
+        next_entity_id(room),
+        reward_type["type"],
+        x,
+        y,
+        reward_type["color"],
+        reward_type["radius"],
+        reward_type["duration"],
+        reward_type.get("stackable", False),
+        room.clock(),
+    )
+    add_entity(room, "rewards", reward)
+    game_state["rewardIndex"].insert(reward)
+    # Rewards disappear after 15 seconds
+    game_state["timers"].schedule(("rewardExpiry", reward.id), reward.spawn_time + 15)
+    return reward
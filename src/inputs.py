@@ -0,0 +1,82 @@
+import math
+from collections import deque
+
+# Held-key bits of an input frame; the same values live in static/js/client.js
+INPUT_FORWARD = 1
+INPUT_BACKWARD = 2
+INPUT_LEFT = 4
+INPUT_RIGHT = 8
+
+# Movement bits in the order they are applied within one frame
+MOVE_DIRECTIONS = (
+    (INPUT_FORWARD, "forward"),
+    (INPUT_BACKWARD, "backward"),
+    (INPUT_LEFT, "left"),
+    (INPUT_RIGHT, "right"),
+)
+DIRECTION_BITS = {direction: bit for bit, direction in MOVE_DIRECTIONS}
+INPUT_MASK = INPUT_FORWARD | INPUT_BACKWARD | INPUT_LEFT | INPUT_RIGHT
+
+# Frames a room buffers between ticks; the oldest are dropped beyond this
+MAX_QUEUED_INPUTS = 256
+# Degrees one frame may rotate by either way; clients send a few at most
+MAX_ROTATE = 180
+
+# Integer fields must fit the signed 64-bit slots of match recordings
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+
+def new_input_queue():
+    return deque(maxlen=MAX_QUEUED_INPUTS)
+
+
+def is_int64(value):
+    return isinstance(value, int) and INT64_MIN <= value <= INT64_MAX
+
+
+def input_frame(data):
+    """Normalize one client input message, or return None if malformed.
+
+    The message is ``{id, seq, keys, rotate, fire}``: the player id, the
+    client's frame counter, the held-key bitmask, degrees to rotate and
+    whether fire was pressed. A single ``{id, action, value}`` action from
+    older clients is accepted as a frame holding just that input.
+    """
+    if not isinstance(data, dict):
+        return None
+
+    if "action" in data:
+        action = data.get("action")
+        value = data.get("value")
+        data = {"id": data.get("id")}
+        if action == "rotate":
+            data["rotate"] = value
+        elif action == "move" and value in DIRECTION_BITS:
+            data["keys"] = DIRECTION_BITS[value]
+        elif action == "fire":
+            data["fire"] = True
+        else:
+            return None
+
+    player_id = data.get("id")
+    seq = data.get("seq")
+    keys = data.get("keys", 0)
+    rotate = data.get("rotate", 0)
+    if not is_int64(player_id):
+        return None
+    if seq is not None and not is_int64(seq):
+        return None
+    if not isinstance(keys, int) or not isinstance(rotate, (int, float)):
+        return None
+    # JSON allows NaN and Infinity, which no tank angle survives
+    if isinstance(rotate, float) and not math.isfinite(rotate):
+        return None
+
+    return {
+        "id": player_id,
+        "seq": seq,
+        "keys": keys & INPUT_MASK,
+        "rotate": max(-MAX_ROTATE, min(rotate, MAX_ROTATE)),
+        "fire": bool(data.get("fire", False)),
+    }
@@ -1,26 +1,567 @@
+"""Tile maps, and the compiled level pack they are played from.
+
+    python -m src.level
+
+compiles every map in levels/ and the level settings in
+levels/campaign.json into levels/levels.pack. Servers map the pack into
+memory read-only, so all rooms and worker processes share one copy of it
+and starting a match parses nothing. A server that finds the pack missing
+or older than its sources compiles it first.
+"""
+
+import argparse
+import functools
+import glob
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from collections import deque
+
+import numpy as np
+
+from src.utils import load_level_data
+
+# Level files live in levels/<name>.json at the top of the project
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "levels")
+VALID_LEVEL_NAME = re.compile(r"^[a-z0-9_-]{1,32}$")
+# The order levels are played in and their settings
+CAMPAIGN_FILE = "campaign.json"
+PACK_FILE = "levels.pack"
+# Map to play every level of the campaign on instead of its own, such as
+# frontier, which is larger than the screen (unset by default)
+CAMPAIGN_MAP = os.environ.get("CAMPAIGN_MAP") or None
+
+# Tile characters in a level file's "tiles" rows
+WALL = "#"
+OPEN = "."
+
+# Paths are sampled this many times per tile when tested against walls
+SAMPLES_PER_TILE = 4
+
+# Neighbouring tiles as (column, row) steps; diagonals come last so that
+# straight moves win ties
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+# A pack is a header, a table of maps, a table of levels and then the
+# arrays of every map, each starting on an 8-byte boundary. Everything is
+# little-endian.
+
+PACK_MAGIC = b"TKLP"
+PACK_VERSION = 1
+
+# magic, version, map count, level count
+PACK_HEADER = struct.Struct("<4sBHH")
+# name, tile size, columns, rows, spawn x and y, enemy spawn zone count,
+# open tile count, and the offsets of the map's tiles, steps, open tiles
+# and enemy spawn zones
+MAP_ENTRY = struct.Struct("<32sHHHIIHIQQQQ")
+# map index, enemies required, max enemies, spawn delay, AI skill
+LEVEL_ENTRY = struct.Struct("<HHHdd")
+ALIGNMENT = 8
+
+# Per map arrays: a byte per tile, 1 for a wall; a byte per tile with a
+# bit per NEIGHBOURS step a body can take from it; the indices of the open
+# tiles; and left, top, right, bottom of each enemy spawn zone in pixels
+TILE_TYPE = np.uint8
+STEP_TYPE = np.uint8
+OPEN_TILE_TYPE = np.uint32
+ZONE_TYPE = np.uint32
+WALL_BYTE = b"\x01"
+
+
 class Level:
-    def __init__(self, level_data):
-        self.level_data = level_data
-        self.enemies = []
-        self.tanks = []
-        self.projectiles = []
-
-    def load_level(self):
-        # Load level data and initialize game objects
-        pass
-
-    def setup_environment(self):
-        # Set up the game environment based on level data
-        pass
-
-    def transition_to_next_level(self):
-        # Handle transitions to the next level
-        pass
-
-    def update(self):
-        # Update the state of the level, including enemies and projectiles
-        pass
-
-    def draw(self, screen):
-        # Draw the level elements on the screen
-        pass
\ No newline at end of file
+    """A map: its size in pixels and a grid of wall tiles.
+
+    Levels are read from a compiled pack (see compile_pack) and their
+    arrays are views of it, so they are read-only. ``entry`` is the map's
+    MAP_ENTRY in ``buffer``. A level pickles as its name and unpickles as
+    the same map from the receiving process's own pack.
+    """
+
+    def __init__(self, buffer, entry):
+        (
+            name,
+            self.tile_size,
+            self.columns,
+            self.rows,
+            spawn_x,
+            spawn_y,
+            zone_count,
+            open_count,
+            tiles_at,
+            steps_at,
+            open_at,
+            zones_at,
+        ) = entry
+        self.name = name.rstrip(b"\0").decode()
+        self.width = self.columns * self.tile_size
+        self.height = self.rows * self.tile_size
+        cell_count = self.rows * self.columns
+        self.buffer = buffer
+        self.tiles_at = tiles_at
+        self.walls = np.frombuffer(buffer, TILE_TYPE, cell_count, tiles_at)
+        self.walls = self.walls.view(bool).reshape(self.rows, self.columns)
+        self.steps = np.frombuffer(buffer, STEP_TYPE, cell_count, steps_at)
+        # Open tiles, to drop things on at random
+        self.open_cells = np.frombuffer(buffer, OPEN_TILE_TYPE, open_count, open_at)
+        self.has_walls = open_count < cell_count
+        self.spawn = (spawn_x, spawn_y)
+        # Where enemies come in, if the map says; (left, top, right, bottom)
+        self.spawn_zones = [
+            tuple(zone)
+            for zone in np.frombuffer(buffer, ZONE_TYPE, zone_count * 4, zones_at)
+            .reshape(zone_count, 4)
+            .tolist()
+        ]
+
+    def __reduce__(self):
+        return load_level, (self.name,)
+
+    @functools.cached_property
+    def neighbours(self):
+        # For every tile, the open tiles a body can step to from it, moving
+        # diagonally only past open corners. Built the first time a flow
+        # field needs it.
+        offsets = [row * self.columns + column for column, row in NEIGHBOURS]
+        return tuple(
+            tuple(
+                cell + offset for bit, offset in enumerate(offsets) if steps >> bit & 1
+            )
+            for cell, steps in enumerate(self.steps.tolist())
+        )
+
+    def record(self):
+        # What clients need to draw the map
+        return {
+            "name": self.name,
+            "tileSize": self.tile_size,
+            "tiles": [
+                "".join(WALL if wall else OPEN for wall in row)
+                for row in self.walls.tolist()
+            ],
+        }
+
+    def cell(self, x, y):
+        # Index of the tile under a point, clamped to the map
+        column = min(max(int(x / self.tile_size), 0), self.columns - 1)
+        row = min(max(int(y / self.tile_size), 0), self.rows - 1)
+        return row * self.columns + column
+
+    def cells(self, x, y):
+        # cell() for arrays of points
+        columns = np.clip((x / self.tile_size).astype(np.intp), 0, self.columns - 1)
+        rows = np.clip((y / self.tile_size).astype(np.intp), 0, self.rows - 1)
+        return rows * self.columns + columns
+
+    def center(self, cell):
+        row, column = divmod(cell, self.columns)
+        return (column + 0.5) * self.tile_size, (row + 0.5) * self.tile_size
+
+    def is_free(self, x, y, radius):
+        """True if a square of ``radius`` around (x, y) touches no wall."""
+        if not self.has_walls:
+            return True
+        tile_size = self.tile_size
+        first_column = max(int((x - radius) // tile_size), 0)
+        last_column = min(int((x + radius) // tile_size), self.columns - 1)
+        first_row = max(int((y - radius) // tile_size), 0)
+        last_row = min(int((y + radius) // tile_size), self.rows - 1)
+        # Search the pack's bytes directly; one tile at a time NumPy is slow
+        for row in range(first_row, last_row + 1):
+            start = self.tiles_at + row * self.columns
+            if (
+                self.buffer.find(
+                    WALL_BYTE, start + first_column, start + last_column + 1
+                )
+                >= 0
+            ):
+                return False
+        return True
+
+    def blocked(self, x, y, radius):
+        """Mask of the points whose square of ``radius`` touches a wall.
+
+        ``radius`` must be at most half the tile size, so that the square's
+        corners fall in every tile it covers.
+        """
+        blocked = np.zeros(len(x), dtype=bool)
+        if self.has_walls:
+            flat_walls = self.walls.ravel()
+            for corner_x in (x - radius, x + radius):
+                for corner_y in (y - radius, y + radius):
+                    blocked |= flat_walls[self.cells(corner_x, corner_y)]
+        return blocked
+
+    def slide(self, x, y, new_x, new_y, radius):
+        """Where a body at (x, y) ends up trying to move to (new_x, new_y).
+
+        A blocked move keeps whichever of its horizontal and vertical parts
+        is free, so bodies slide along walls instead of sticking to them.
+        """
+        if self.is_free(new_x, new_y, radius):
+            return new_x, new_y
+        if self.is_free(new_x, y, radius):
+            return new_x, y
+        if self.is_free(x, new_y, radius):
+            return x, new_y
+        return x, y
+
+    def slides(self, x, y, new_x, new_y, radius):
+        # slide() for arrays of moves, with three wall tests for all of them
+        blocked = self.blocked(new_x, new_y, radius)
+        if not blocked.any():
+            return new_x, new_y
+        keep_x = blocked & ~self.blocked(new_x, y, radius)
+        keep_y = blocked & ~keep_x & ~self.blocked(x, new_y, radius)
+        return (
+            np.where(blocked & ~keep_x, x, new_x),
+            np.where(blocked & ~keep_y, y, new_y),
+        )
+
+    def first_wall(self, start_x, start_y, end_x, end_y):
+        """Fraction of each path from start to end at which it meets a wall.
+
+        Paths are sampled SAMPLES_PER_TILE times per tile; paths that meet
+        no wall get infinity.
+        """
+        hits = np.full(len(start_x), np.inf)
+        if not self.has_walls or len(start_x) == 0:
+            return hits
+        step_x = end_x - start_x
+        step_y = end_y - start_y
+        length = np.sqrt(step_x * step_x + step_y * step_y)
+        samples = np.maximum(np.ceil(length * SAMPLES_PER_TILE / self.tile_size), 1)
+        # One row of sample points per step along the paths; each path has
+        # its own spacing, so its result does not depend on the others
+        steps = np.arange(1, int(samples.max()) + 1)[:, None]
+        fractions = np.minimum(steps / samples, 1.0)
+        x = start_x + step_x * fractions
+        y = start_y + step_y * fractions
+        on_map = (0 <= x) & (x < self.width) & (0 <= y) & (y < self.height)
+        walled = (steps <= samples) & on_map & self.walls.ravel()[self.cells(x, y)]
+        hit = walled.any(axis=0)
+        first = walled.argmax(axis=0)[hit]
+        hits[hit] = fractions[first, np.flatnonzero(hit)]
+        return hits
+
+
+def compile_map(name, level_data):
+    """Check a parsed map file and lay it out for a pack.
+
+    ``level_data`` has ``tileSize`` in pixels, ``tiles`` as one string per
+    row with ``#`` for a wall and ``.`` for open ground, the player's
+    ``spawn`` point and optionally ``enemySpawns``, a list of [left, top,
+    right, bottom] zones, in whole pixels. Returns the MAP_ENTRY fields up
+    to the offsets, and the map's arrays in offset order.
+    """
+    if not VALID_LEVEL_NAME.match(name):
+        raise ValueError(f"Invalid level name {name!r}")
+    tile_size = level_data.get("tileSize", 40)
+    rows = level_data["tiles"]
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError(f"Level {name} has no tiles or ragged rows")
+    if set("".join(rows)) - {WALL, OPEN}:
+        raise ValueError(f"Level {name} has tiles other than {WALL!r} and {OPEN!r}")
+    walls = np.array([[tile == WALL for tile in row] for row in rows])
+    row_count, column_count = walls.shape
+    width = column_count * tile_size
+    height = row_count * tile_size
+
+    # Steps a body can take from each tile: onto open tiles, diagonally
+    # only past open corners. A border of walls blocks steps off the map.
+    bordered = np.pad(walls, 1, constant_values=True)
+
+    def walls_at(step_column, step_row):
+        return bordered[
+            1 + step_row : 1 + step_row + row_count,
+            1 + step_column : 1 + step_column + column_count,
+        ]
+
+    steps = np.zeros(walls.shape, dtype=STEP_TYPE)
+    for bit, (step_column, step_row) in enumerate(NEIGHBOURS):
+        free = ~walls_at(step_column, step_row)
+        if step_column and step_row:
+            free &= ~walls_at(step_column, 0) & ~walls_at(0, step_row)
+        steps |= free.astype(STEP_TYPE) << bit
+
+    spawn_x, spawn_y = (int(value) for value in level_data.get("spawn", (100, 100)))
+    if (
+        not (0 <= spawn_x < width and 0 <= spawn_y < height)
+        or walls[spawn_y // tile_size, spawn_x // tile_size]
+    ):
+        raise ValueError(f"Level {name} has its spawn point off the map or in a wall")
+    zones = [
+        [int(value) for value in zone] for zone in level_data.get("enemySpawns", [])
+    ]
+    for left, top, right, bottom in zones:
+        if not (0 <= left <= right < width and 0 <= top <= bottom < height):
+            raise ValueError(f"Level {name} has an enemy spawn zone off the map")
+
+    open_cells = np.flatnonzero(~walls)
+    fields = (
+        name.encode(),
+        tile_size,
+        column_count,
+        row_count,
+        spawn_x,
+        spawn_y,
+        len(zones),
+        len(open_cells),
+    )
+    arrays = (
+        walls.astype(TILE_TYPE),
+        steps,
+        open_cells.astype(OPEN_TILE_TYPE),
+        np.array(zones, dtype=ZONE_TYPE).reshape(len(zones), 4),
+    )
+    return fields, arrays
+
+
+def compile_pack(level_dir=LEVEL_DIR):
+    """Compile the maps and campaign in ``level_dir``; returns the pack."""
+    maps = {}
+    for path in sorted(glob.glob(os.path.join(level_dir, "*.json"))):
+        file_name = os.path.basename(path)
+        if file_name != CAMPAIGN_FILE:
+            name = os.path.splitext(file_name)[0]
+            maps[name] = compile_map(name, load_level_data(path))
+    names = list(maps)
+    campaign = load_level_data(os.path.join(level_dir, CAMPAIGN_FILE))["levels"]
+    if not campaign:
+        raise ValueError("The campaign has no levels")
+    for settings in campaign:
+        if settings["map"] not in maps:
+            raise ValueError(
+                f"The campaign plays {settings['map']!r}, which has no map"
+            )
+
+    tables = [PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(maps), len(campaign))]
+    offset = PACK_HEADER.size + len(maps) * MAP_ENTRY.size
+    offset += len(campaign) * LEVEL_ENTRY.size
+    arrays = []
+    for fields, map_arrays in maps.values():
+        offsets = []
+        for array in map_arrays:
+            offset += -offset % ALIGNMENT
+            offsets.append(offset)
+            arrays.append((offset, array.tobytes()))
+            offset += array.nbytes
+        tables.append(MAP_ENTRY.pack(*fields, *offsets))
+    for settings in campaign:
+        tables.append(
+            LEVEL_ENTRY.pack(
+                names.index(settings["map"]),
+                settings["enemiesRequired"],
+                settings["maxEnemies"],
+                settings["spawnDelay"],
+                settings["aiSkill"],
+            )
+        )
+
+    pack = bytearray(b"".join(tables))
+    for offset, data in arrays:
+        pack += bytes(offset - len(pack))
+        pack += data
+    return bytes(pack)
+
+
+def pack_is_stale(level_dir, path):
+    # Missing, or older than any of its sources
+    try:
+        compiled = os.path.getmtime(path)
+    except OSError:
+        return True
+    sources = glob.glob(os.path.join(level_dir, "*.json"))
+    return any(os.path.getmtime(source) > compiled for source in sources)
+
+
+def write_pack(level_dir, path):
+    # Written aside and renamed into place, so that processes compiling at
+    # the same time never map a half-written pack
+    data = compile_pack(level_dir)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return data
+
+
+class LevelPack:
+    """The maps and level settings of the compiled pack in ``buffer``.
+
+    ``maps`` holds a Level by name and ``levels`` the settings of each
+    level by number, counted from 1, in the shape of game.LEVEL_CONFIG.
+    """
+
+    def __init__(self, buffer):
+        if len(buffer) < PACK_HEADER.size:
+            raise ValueError("Not a level pack")
+        magic, version, map_count, level_count = PACK_HEADER.unpack_from(buffer)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"Not a version {PACK_VERSION} level pack")
+        offset = PACK_HEADER.size
+        maps = []
+        for _ in range(map_count):
+            maps.append(Level(buffer, MAP_ENTRY.unpack_from(buffer, offset)))
+            offset += MAP_ENTRY.size
+        self.maps = {level.name: level for level in maps}
+        self.levels = {}
+        for number in range(1, level_count + 1):
+            map_index, enemies_required, max_enemies, spawn_delay, ai_skill = (
+                LEVEL_ENTRY.unpack_from(buffer, offset)
+            )
+            offset += LEVEL_ENTRY.size
+            self.levels[number] = {
+                "enemies_required": enemies_required,
+                "max_enemies": max_enemies,
+                "spawn_delay": spawn_delay,
+                "ai_skill": ai_skill,
+                "map": maps[map_index].name,
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def level_pack():
+    """The pack in levels/, mapped into memory once per process.
+
+    A missing or stale pack is compiled first, or only in memory if
+    levels/ cannot be written to.
+    """
+    path = os.path.join(LEVEL_DIR, PACK_FILE)
+    if pack_is_stale(LEVEL_DIR, path):
+        try:
+            write_pack(LEVEL_DIR, path)
+        except OSError:
+            return LevelPack(compile_pack(LEVEL_DIR))
+    with open(path, "rb") as file:
+        return LevelPack(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def load_level(name):
+    """The map called ``name``, from levels/<name>.json."""
+    level = level_pack().maps.get(name)
+    if level is None:
+        raise ValueError(f"No level named {name!r}")
+    return level
+
+
+def campaign():
+    # Settings of every level by number, from levels/campaign.json
+    levels = level_pack().levels
+    if CAMPAIGN_MAP is None:
+        return levels
+    load_level(CAMPAIGN_MAP)
+    return {
+        number: dict(settings, map=CAMPAIGN_MAP) for number, settings in levels.items()
+    }
+
+
+class FlowField:
+    """Routes to one goal tile from every open tile of a level.
+
+    One breadth-first search out of the goal gives each open tile the next
+    tile on a shortest path to it, moving diagonally only past open corners,
+    and marks the tiles from which the goal is in plain sight. A room keeps
+    one field towards the player's tile and builds a new one only when the
+    player enters another tile, so any number of AI tanks can route around
+    walls for the cost of that one search.
+    """
+
+    def __init__(self, level, goal):
+        self.level = level
+        self.goal = goal
+        cell_count = level.rows * level.columns
+        columns = level.columns
+        neighbours = level.neighbours
+
+        # Next tile towards the goal; -1 where the goal cannot be reached
+        next_cell = [-1] * cell_count
+        next_cell[goal] = goal
+        queue = deque([goal])
+        while queue:
+            cell = queue.popleft()
+            for neighbour in neighbours[cell]:
+                if next_cell[neighbour] == -1:
+                    next_cell[neighbour] = cell
+                    queue.append(neighbour)
+
+        self.next_cell = next_cell
+        next_cell = np.array(next_cell)
+        self.next_x = (next_cell % columns + 0.5) * level.tile_size
+        self.next_y = (next_cell // columns + 0.5) * level.tile_size
+        # Whether tanks on a tile head straight for the goal: it is in plain
+        # sight from the tile's center, or out of reach. Worked out for a
+        # tile the first time a tank stands on it.
+        self.direct = [None] * cell_count
+        self.direct_mask = np.zeros(cell_count, dtype=bool)
+
+    def _look(self, cells):
+        # Settle direct for the given tiles with one wall test for all
+        level = self.level
+        goal_x, goal_y = level.center(self.goal)
+        visible = np.isinf(
+            level.first_wall(
+                (cells % level.columns + 0.5) * level.tile_size,
+                (cells // level.columns + 0.5) * level.tile_size,
+                np.full(len(cells), goal_x),
+                np.full(len(cells), goal_y),
+            )
+        )
+        for cell, seen in zip(cells.tolist(), visible.tolist()):
+            direct = seen or self.next_cell[cell] < 0
+            self.direct[cell] = direct
+            self.direct_mask[cell] = direct
+
+    def waypoint(self, x, y):
+        """Point a tank at (x, y) should head for, or None to go straight."""
+        cell = self.level.cell(x, y)
+        if self.direct[cell] is None:
+            self._look(np.array([cell]))
+        if self.direct[cell]:
+            return None
+        return self.level.center(self.next_cell[cell])
+
+    def waypoints(self, x, y):
+        # waypoint() for arrays of positions, NaN where tanks go straight
+        cells = self.level.cells(x, y)
+        unsettled = sorted(
+            cell for cell in set(cells.tolist()) if self.direct[cell] is None
+        )
+        if unsettled:
+            self._look(np.array(unsettled))
+        direct = self.direct_mask[cells]
+        return (
+            np.where(direct, np.nan, self.next_x[cells]),
+            np.where(direct, np.nan, self.next_y[cells]),
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the level pack.")
+    parser.add_argument("--levels", default=LEVEL_DIR, help="directory of sources")
+    parser.add_argument("--output", help="pack to write (default <levels>/levels.pack)")
+    args = parser.parse_args(argv)
+
+    path = args.output or os.path.join(args.levels, PACK_FILE)
+    try:
+        data = write_pack(args.levels, path)
+    except (ValueError, KeyError) as error:
+        print(f"cannot compile {args.levels}: {error}", file=sys.stderr)
+        return 1
+    pack = LevelPack(data)
+    print(
+        f"{len(pack.maps)} maps and {len(pack.levels)} levels "
+        f"compiled into {path} ({len(data) / 1024:.1f} KiB)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Counters, gauges and histograms in the Prometheus text format.
+
+Recording is a dict update, plus a bisect for histograms, so metrics can
+stay on in production. Each process keeps its own registry. A process
+that fronts simulation workers collects theirs with ``snapshot`` and
+renders them summed with its own, one scrape at a time.
+"""
+
+import bisect
+import math
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from well inside one tick to several ticks
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Metric:
+    """One metric family, with at most one label.
+
+    ``values`` maps each value of the label (None without a label) to the
+    metric's value for it.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}
+
+    def merge(self, total, values):
+        # Add one process's values into ``total``
+        for label_value, value in values.items():
+            total[label_value] = total.get(label_value, 0) + value
+
+    def lines(self, values):
+        for label_value, value in sorted(values.items(), key=sort_key):
+            yield f"{self.name}{self.labels(label_value)} {number(value)}"
+
+    def labels(self, label_value, *pairs):
+        if label_value is not None:
+            pairs = ((self.label, label_value),) + pairs
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, label_value=None):
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, label_value=None):
+        self.values[label_value] = value
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, plus their sum.
+
+    A label value's entry holds the count of each bucket, the last one
+    for values above every bound, followed by the sum.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, label=None):
+        super().__init__(name, help_text, label)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, label_value=None):
+        entry = self.values.get(label_value)
+        if entry is None:
+            entry = self.values[label_value] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def merge(self, total, values):
+        for label_value, entry in values.items():
+            into = total.setdefault(label_value, [0] * len(entry))
+            for index, value in enumerate(entry):
+                into[index] += value
+
+    def lines(self, values):
+        bounds = self.buckets + (math.inf,)
+        for label_value, entry in sorted(values.items(), key=sort_key):
+            cumulative = 0
+            for bound, count in zip(bounds, entry):
+                cumulative += count
+                labels = self.labels(label_value, ("le", number(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = self.labels(label_value)
+            yield f"{self.name}_sum{labels} {number(entry[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """The metrics of one process, by name."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label=None):
+        return self.add(Counter(name, help_text, label))
+
+    def gauge(self, name, help_text, label=None):
+        return self.add(Gauge(name, help_text, label))
+
+    def histogram(self, name, help_text, buckets, label=None):
+        return self.add(Histogram(name, help_text, buckets, label))
+
+    def snapshot(self):
+        # Picklable copy of every value, for another process to render
+        return {
+            name: {
+                label_value: list(value) if isinstance(value, list) else value
+                for label_value, value in metric.values.items()
+            }
+            for name, metric in self.metrics.items()
+        }
+
+    def render(self, snapshots=()):
+        """This registry as Prometheus text, summed with ``snapshots``.
+
+        Snapshots come from registries with the same metrics, in other
+        processes.
+        """
+        lines = []
+        for name, metric in self.metrics.items():
+            values = {}
+            metric.merge(values, metric.values)
+            for snapshot in snapshots:
+                metric.merge(values, snapshot.get(name, {}))
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.lines(values))
+        return "\n".join(lines) + "\n"
+
+
+def sort_key(item):
+    # Unlabelled first, then by label value
+    return (item[0] is not None, str(item[0]))
+
+
+def number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(value)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
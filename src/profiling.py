@@ -0,0 +1,132 @@
+"""On-demand profiling of one room's ticks.
+
+A RoomProfiler hangs off ``room.profiler`` while it runs. The tick loop
+resumes it around that room's step and pauses it after, so nothing else
+the process does ends up in the profile, and a room without one costs a
+single ``is None`` test per tick. Two kinds are available:
+
+- ``cprofile``: cProfile, saved as a pstats file (``python -m pstats``,
+  snakeviz, flameprof).
+- ``sample``: a thread that samples the ticking thread's stack every
+  SAMPLE_INTERVAL seconds, saved as collapsed stacks, one ``a;b;c count``
+  line per stack, as read by flamegraph.pl and speedscope. It perturbs
+  the room far less than cProfile, at the price of exact call counts.
+  While it runs, the interpreter's thread switch interval is lowered to
+  the sample interval so that the sampler can interrupt a tick.
+"""
+
+import cProfile
+import os
+import sys
+import threading
+import time
+
+try:
+    # Under eventlet's monkey patching the sampler still needs a real
+    # thread and a real sleep, or it would never run during a tick
+    from eventlet.patcher import original
+
+    os_threading = original("threading")
+    os_time = original("time")
+except ImportError:
+    os_threading = threading
+    os_time = time
+
+PROFILE_KINDS = ("cprofile", "sample")
+# Longest profile an admin may ask for, in seconds
+MAX_PROFILE_SECONDS = 300
+SAMPLE_INTERVAL = 0.001
+
+
+class RoomProfiler:
+    """Profiles one room's ticks for ``seconds`` of wall time.
+
+    Call ``resume`` and ``pause`` around every step of the room, and
+    ``save`` once ``done``; the profile goes to ``path``.
+    """
+
+    def __init__(self, room_id, kind, seconds, directory):
+        if kind not in PROFILE_KINDS:
+            raise ValueError(f"Unknown profile kind {kind!r}")
+        self.kind = kind
+        self.deadline = time.monotonic() + seconds
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        extension = "pstats" if kind == "cprofile" else "folded"
+        self.path = os.path.join(directory, f"{room_id}-{stamp}.{extension}")
+        self.profile = cProfile.Profile() if kind == "cprofile" else None
+        # Sampling: the ticking thread, whether it is in the room's step,
+        # and the number of samples per collapsed stack
+        self.thread_id = None
+        self.sampling = False
+        self.stopped = False
+        self.stacks = {}
+        self.switch_interval = None
+
+    def resume(self):
+        if self.profile is not None:
+            self.profile.enable()
+            return
+        if self.thread_id is None:
+            self.thread_id = current_thread_id()
+            self.switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(SAMPLE_INTERVAL)
+            os_threading.Thread(target=self.sample, daemon=True).start()
+        self.sampling = True
+
+    def pause(self):
+        if self.profile is not None:
+            self.profile.disable()
+        else:
+            self.sampling = False
+
+    def done(self):
+        return time.monotonic() >= self.deadline
+
+    def sample(self):
+        while not self.stopped:
+            os_time.sleep(SAMPLE_INTERVAL)
+            if not self.sampling:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or not self.sampling:
+                continue
+            stack = collapse(frame)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def save(self):
+        """Write the profile out; returns its path."""
+        self.stopped = True
+        if self.switch_interval is not None:
+            sys.setswitchinterval(self.switch_interval)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if self.profile is not None:
+            self.profile.dump_stats(self.path)
+        else:
+            # A copy, in case the sampler is still finishing its last sample
+            stacks = dict(self.stacks)
+            with open(self.path, "w") as file:
+                for stack, count in sorted(stacks.items()):
+                    file.write(f"{stack} {count}\n")
+        return self.path
+
+
+def current_thread_id():
+    # Key of the calling OS thread in sys._current_frames(). Found by frame
+    # rather than threading.get_ident(), which eventlet makes return the id
+    # of the green thread.
+    here = sys._getframe()
+    for thread_id, frame in sys._current_frames().items():
+        if frame is here:
+            return thread_id
+    return threading.get_ident()
+
+
+def collapse(frame):
+    # One stack, outermost call first, as "function (file:line)" entries
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
@@ -1,31 +1,249 @@
+import numpy as np
+
+from src.spatial import CELL_SIZE, grid_pairs
+
+# Projectiles within this distance of a tank's center hit it
+HIT_RADIUS = 25
+# Initial number of projectile slots; the arrays double when full
+INITIAL_CAPACITY = 64
+
+# Array fields and their dtypes
+PROJECTILE_ARRAYS = (
+    ("id", np.int64),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("vx", np.float64),
+    ("vy", np.float64),
+    ("angle", np.float64),
+    ("damage", np.float64),
+    ("owner", np.int64),
+    ("timestamp", np.float64),
+    ("active", np.bool_),
+)
+
+
 class Projectile:
-    def __init__(self, x, y, speed, direction):
+    """One projectile read out of a ProjectileBuffer.
+
+    The buffer's arrays are the authoritative state; these objects are
+    snapshots of one slot, built when projectiles are iterated.
+    """
+
+    __slots__ = (
+        "id",
+        "x",
+        "y",
+        "angle",
+        "owner",
+        "velocity_x",
+        "velocity_y",
+        "damage",
+        "color",
+        "timestamp",
+    )
+
+    def __init__(
+        self,
+        projectile_id,
+        x,
+        y,
+        angle,
+        owner,
+        velocity_x,
+        velocity_y,
+        damage,
+        color,
+        timestamp,
+    ):
+        self.id = projectile_id
         self.x = x
         self.y = y
-        self.speed = speed
-        self.direction = direction
-
-    def update(self):
-        if self.direction == 'up':
-            self.y -= self.speed
-        elif self.direction == 'down':
-            self.y += self.speed
-        elif self.direction == 'left':
-            self.x -= self.speed
-        elif self.direction == 'right':
-            self.x += self.speed
-
-    def check_collision(self, other):
-        # Simple bounding box collision detection
-        return (self.x < other.x + other.width and
-                self.x + self.width > other.x and
-                self.y < other.y + other.height and
-                self.y + self.height > other.y)
-
-    @property
-    def width(self):
-        return 5  # Example width of the projectile
-
-    @property
-    def height(self):
-        return 5  # Example height of the projectile
\ No newline at end of file
+        self.angle = angle
+        self.owner = owner
+        self.velocity_x = velocity_x
+        self.velocity_y = velocity_y
+        self.damage = damage
+        self.color = color
+        self.timestamp = timestamp
+
+    def record(self):
+        return {
+            "id": self.id,
+            "x": self.x,
+            "y": self.y,
+            "angle": self.angle,
+            "owner": self.owner,
+            "damage": self.damage,
+            "color": self.color,
+        }
+
+
+class ProjectileBuffer:
+    """Live projectiles stored as parallel NumPy arrays.
+
+    Slots ``[0, count)`` hold live projectiles in firing order; everything
+    past ``count`` is spare capacity. Iterating yields a Projectile per
+    live slot.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.count = 0
+        self.arrays = {
+            name: np.zeros(capacity, dtype=dtype) for name, dtype in PROJECTILE_ARRAYS
+        }
+        # Colors are few and only read when building records
+        self.colors = [None] * capacity
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        arrays = {name: self.live(name).tolist() for name in self.arrays}
+        for index in range(self.count):
+            yield Projectile(
+                arrays["id"][index],
+                arrays["x"][index],
+                arrays["y"][index],
+                arrays["angle"][index],
+                arrays["owner"][index],
+                arrays["vx"][index],
+                arrays["vy"][index],
+                arrays["damage"][index],
+                self.colors[index],
+                arrays["timestamp"][index],
+            )
+
+    def live(self, name):
+        # View of one array over the live slots
+        return self.arrays[name][: self.count]
+
+    def _grow(self):
+        capacity = len(self.colors) * 2
+        for name, values in self.arrays.items():
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[: self.count] = values[: self.count]
+            self.arrays[name] = grown
+        self.colors.extend([None] * (capacity - len(self.colors)))
+
+    def spawn(self, entity_id, x, y, angle, owner, vx, vy, damage, color, timestamp):
+        if self.count == len(self.colors):
+            self._grow()
+        index = self.count
+        arrays = self.arrays
+        arrays["id"][index] = entity_id
+        arrays["x"][index] = x
+        arrays["y"][index] = y
+        arrays["vx"][index] = vx
+        arrays["vy"][index] = vy
+        arrays["angle"][index] = angle
+        arrays["damage"][index] = damage
+        arrays["owner"][index] = owner
+        arrays["timestamp"][index] = timestamp
+        arrays["active"][index] = True
+        self.colors[index] = color
+        self.count += 1
+
+    def fired_within(self, owner, now, cooldown):
+        # True if the owner has a live projectile younger than the cooldown
+        mine = self.live("owner") == owner
+        return bool(np.any(now - self.live("timestamp")[mine] < cooldown))
+
+    def keep(self, mask):
+        # Compact the buffer down to the projectiles selected by mask
+        kept = int(np.count_nonzero(mask))
+        for values in self.arrays.values():
+            values[:kept] = values[: self.count][mask]
+        self.colors[:kept] = [
+            color for color, selected in zip(self.colors, mask.tolist()) if selected
+        ]
+        self.colors[kept : self.count] = [None] * (self.count - kept)
+        self.count = kept
+
+    def advance(self, elapsed):
+        """Move every projectile; returns the positions it moved from."""
+        count = self.count
+        arrays = self.arrays
+        x = arrays["x"][:count]
+        y = arrays["y"][:count]
+        start_x = x.copy()
+        start_y = y.copy()
+        x += arrays["vx"][:count] * elapsed * 30
+        y += arrays["vy"][:count] * elapsed * 30
+        return start_x, start_y
+
+    def stop_at(self, start_x, start_y, fractions):
+        # Pull projectiles back to the given fraction of this step's path
+        # and finish them there; fractions above 1 leave a projectile be
+        stopped = fractions <= 1
+        for position, start in (("x", start_x), ("y", start_y)):
+            values = self.live(position)
+            values[stopped] = (
+                start[stopped] + (values[stopped] - start[stopped]) * fractions[stopped]
+            )
+        self.live("active")[stopped] = False
+
+    def on_map(self, map_width, map_height):
+        x = self.live("x")
+        y = self.live("y")
+        on_map = (0 <= x) & (x <= map_width) & (0 <= y) & (y <= map_height)
+        return on_map & self.live("active")
+
+    def contacts(
+        self, start_x, start_y, tank_ids, tank_x, tank_y, radius=HIT_RADIUS
+    ):
+        """Swept hit test of this step's paths against the tanks.
+
+        Each projectile's path from (start_x, start_y) to its current
+        position is tested as a segment against a circle around every tank
+        other than its owner. Returns ``(projectile index, tank index)``
+        pairs ordered by the time along the step at which the path first
+        enters the circle, so the earliest hit wins however far a projectile
+        moves per tick. Health is not considered here: whether a contact
+        becomes a hit depends on the hits applied before it.
+        """
+        if self.count == 0 or len(tank_ids) == 0:
+            return []
+
+        tank_ids = np.asarray(tank_ids)
+        tank_x = np.asarray(tank_x, dtype=float)
+        tank_y = np.asarray(tank_y, dtype=float)
+        end_x = self.live("x")
+        end_y = self.live("y")
+        step_x = end_x - start_x
+        step_y = end_y - start_y
+
+        # Broad phase: circles around each path's midpoint reaching both ends
+        half_step = float(np.sqrt(np.max(step_x * step_x + step_y * step_y))) / 2
+        reach = radius + half_step
+        rows, columns = grid_pairs(
+            start_x + step_x / 2,
+            start_y + step_y / 2,
+            tank_x,
+            tank_y,
+            reach,
+            max(CELL_SIZE, reach),
+        )
+        not_owner = self.live("owner")[rows] != tank_ids[columns]
+        rows = rows[not_owner]
+        columns = columns[not_owner]
+
+        # Solve |start + t * step - tank| = radius for the entry time t
+        dx = step_x[rows]
+        dy = step_y[rows]
+        fx = start_x[rows] - tank_x[columns]
+        fy = start_y[rows] - tank_y[columns]
+        a = dx * dx + dy * dy
+        b = fx * dx + fy * dy
+        c = fx * fx + fy * fy - radius * radius
+        discriminant = b * b - a * c
+
+        inside = c < 0
+        crossing = ~inside & (a > 0) & (discriminant > 0)
+        root = np.sqrt(np.maximum(discriminant, 0.0))
+        entry = np.where(crossing, (-b - root) / np.where(crossing, a, 1.0), 0.0)
+        hit = inside | (crossing & (entry >= 0) & (entry <= 1))
+
+        rows = rows[hit]
+        columns = columns[hit]
+        order = np.lexsort((columns, rows, entry[hit]))
+        return list(zip(rows[order].tolist(), columns[order].tolist()))
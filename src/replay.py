@@ -0,0 +1,275 @@
+"""Match recordings and an accelerated replayer.
+
+    python -m src.replay recordings/<room>-<seed>.match
+
+A match is fully determined by its seed, the time of every tick, the
+input frames each tick consumed and where the AI budget cut a tick short,
+so that is all a recording holds. Replaying
+re-simulates the match tick by tick as fast as possible and checks the
+final state against the digest the server wrote when the match ended.
+"""
+
+import argparse
+import hashlib
+import json
+import struct
+import sys
+import time
+
+from src.game import reset_game_state, step_world
+from src.room import GameRoom
+from src.snapshot import ENTITY_TYPES, PUBLIC_FIELDS
+
+# A recording is a header followed by records appended while the match
+# runs. The input records of a tick come right before its tick record, an
+# AI limit record right after it if the AI budget cut the tick short, and
+# an end record with the final state digest closes a finished match.
+# Everything is little-endian.
+
+RECORDING_MAGIC = b"TKMR"
+RECORDING_VERSION = 4
+
+# magic, version, seed, start time, tick interval
+HEADER = struct.Struct("<4sBQdd")
+TAG = struct.Struct("<B")
+# time
+TICK = struct.Struct("<d")
+# flags, player id, seq, keys, rotate (int64 or float64, see INPUT_INT_ROTATE)
+INPUT = struct.Struct("<BqqB8s")
+ROTATE_INT = struct.Struct("<q")
+ROTATE_FLOAT = struct.Struct("<d")
+# AI tanks decided before the budget ran out
+AI_LIMIT = struct.Struct("<I")
+DIGEST_SIZE = 32
+
+# Record tags
+RECORD_TICK = 1
+RECORD_INPUT = 2
+RECORD_END = 3
+RECORD_AI_LIMIT = 4
+
+# Input flags
+INPUT_FIRE = 1
+INPUT_HAS_SEQ = 2
+INPUT_INT_ROTATE = 4
+
+# Slowest ticks listed by the replayer
+SLOWEST_TICKS = 5
+
+
+def state_digest(state):
+    """SHA-256 of the world as clients see it, plus the generator state.
+
+    Two runs of a match agree bit for bit when their digests match.
+    """
+    view = {key: state.get(key) for key in PUBLIC_FIELDS}
+    for entity_type in ENTITY_TYPES:
+        view[entity_type] = [entity.record() for entity in state[entity_type]]
+    view["nextEntityId"] = state["nextEntityId"]
+    view["rng"] = state["rng"].getstate()
+    view["aiRng"] = state["aiRng"].bit_generator.state
+    return hashlib.sha256(json.dumps(view, sort_keys=True).encode()).digest()
+
+
+def encode_input(frame):
+    flags = 0
+    if frame["fire"]:
+        flags |= INPUT_FIRE
+    seq = frame["seq"]
+    if seq is not None:
+        flags |= INPUT_HAS_SEQ
+    rotate = frame["rotate"]
+    # Keep ints as ints, so the tank angles they produce match exactly
+    if isinstance(rotate, int):
+        flags |= INPUT_INT_ROTATE
+        rotate = ROTATE_INT.pack(rotate)
+    else:
+        rotate = ROTATE_FLOAT.pack(rotate)
+    return TAG.pack(RECORD_INPUT) + INPUT.pack(
+        flags, frame["id"], 0 if seq is None else seq, frame["keys"], rotate
+    )
+
+
+def decode_input(data, offset):
+    flags, player_id, seq, keys, rotate = INPUT.unpack_from(data, offset)
+    if flags & INPUT_INT_ROTATE:
+        (rotate,) = ROTATE_INT.unpack(rotate)
+    else:
+        (rotate,) = ROTATE_FLOAT.unpack(rotate)
+    return {
+        "id": player_id,
+        "seq": seq if flags & INPUT_HAS_SEQ else None,
+        "keys": keys,
+        "rotate": rotate,
+        "fire": bool(flags & INPUT_FIRE),
+    }
+
+
+class MatchRecorder:
+    """Appends one match's tick times and input frames to its recording.
+
+    Writes go through the file's buffer. A recording cut short by a crash
+    replays up to its last complete record.
+    """
+
+    def __init__(self, path, mode="ab"):
+        self.path = path
+        self.file = open(path, mode)
+
+    @classmethod
+    def start(cls, path, seed, start_time, tick_interval):
+        recorder = cls(path, "wb")
+        recorder.file.write(
+            HEADER.pack(
+                RECORDING_MAGIC, RECORDING_VERSION, seed, start_time, tick_interval
+            )
+        )
+        return recorder
+
+    def tick(self, current_time, frames):
+        # Record a tick and the frames it is about to consume
+        parts = [encode_input(frame) for frame in frames]
+        parts.append(TAG.pack(RECORD_TICK) + TICK.pack(current_time))
+        self.file.write(b"".join(parts))
+
+    def ai_limit(self, decided):
+        # The AI budget cut the tick just recorded short
+        self.file.write(TAG.pack(RECORD_AI_LIMIT) + AI_LIMIT.pack(decided))
+
+    def close(self, state=None):
+        # Given the final state, seal the recording with its digest
+        if state is not None:
+            self.file.write(TAG.pack(RECORD_END) + state_digest(state))
+        self.file.close()
+
+
+def read_recording(path):
+    """Load a recording; returns (seed, start time, tick interval, records).
+
+    Records are ``(tag, value)`` pairs in file order: a tick's time, an
+    input frame, an AI limit, or the final state digest.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a match recording")
+    magic, version, seed, start_time, tick_interval = HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError(f"{path} is not a version {RECORDING_VERSION} recording")
+
+    records = []
+    offset = HEADER.size
+    sizes = {
+        RECORD_TICK: TICK.size,
+        RECORD_INPUT: INPUT.size,
+        RECORD_END: DIGEST_SIZE,
+        RECORD_AI_LIMIT: AI_LIMIT.size,
+    }
+    while offset < len(data):
+        (tag,) = TAG.unpack_from(data, offset)
+        offset += TAG.size
+        size = sizes.get(tag)
+        if size is None:
+            raise ValueError(f"Unknown record {tag} at byte {offset - TAG.size}")
+        if offset + size > len(data):
+            break
+        if tag == RECORD_TICK:
+            (value,) = TICK.unpack_from(data, offset)
+        elif tag == RECORD_INPUT:
+            value = decode_input(data, offset)
+        elif tag == RECORD_AI_LIMIT:
+            (value,) = AI_LIMIT.unpack_from(data, offset)
+        else:
+            value = data[offset : offset + size]
+        records.append((tag, value))
+        offset += size
+
+    return seed, start_time, tick_interval, records
+
+
+def replay(path):
+    """Re-simulate a recorded match as fast as possible.
+
+    Steps the room exactly as the server's tick loop did, snapshot capture
+    included, so slow ticks in production are slow here too. Returns the
+    room at the end of the recording and a summary with the seconds per
+    tick and per subsystem, the AI decisions skipped and deferred, and
+    whether the final digest matched (None for an unfinished recording).
+    """
+    seed, start_time, tick_interval, records = read_recording(path)
+    room = GameRoom("replay", start_time)
+    reset_game_state(room, seed)
+    room.snapshots.capture(room.state)
+
+    scheduler = room.state["aiScheduler"]
+    timings = {}
+    tick_seconds = []
+    matched = None
+    for index, (tag, value) in enumerate(records):
+        if tag == RECORD_INPUT:
+            room.state["inputQueue"].append(value)
+        elif tag == RECORD_TICK:
+            # Cut the tick's AI short exactly where the server did
+            scheduler.limit = None
+            if index + 1 < len(records) and records[index + 1][0] == RECORD_AI_LIMIT:
+                scheduler.limit = records[index + 1][1]
+            started = time.perf_counter()
+            room.clock.now = value
+            step_world(room, value, tick_interval, timings)
+            room.snapshots.capture(room.state)
+            tick_seconds.append(time.perf_counter() - started)
+        elif tag == RECORD_END:
+            matched = state_digest(room.state) == value
+
+    return room, {
+        "seed": seed,
+        "ticks": len(tick_seconds),
+        "game_seconds": room.clock() - start_time,
+        "tick_seconds": tick_seconds,
+        "timings": timings,
+        "ai_skipped": scheduler.skipped,
+        "ai_deferred": scheduler.deferred,
+        "matched": matched,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    room, result = replay(args.recording)
+    wall_seconds = time.perf_counter() - started
+
+    print(
+        f"seed {result['seed']:016x}: {result['ticks']} ticks, "
+        f"{result['game_seconds']:.1f}s of play replayed in {wall_seconds:.2f}s "
+        f"({result['game_seconds'] / max(wall_seconds, 1e-9):.0f}x)"
+    )
+    for name, seconds in sorted(
+        result["timings"].items(), key=lambda item: item[1], reverse=True
+    ):
+        print(f"  {name:<12} {seconds:8.3f}s")
+    slowest = sorted(
+        enumerate(result["tick_seconds"]), key=lambda item: item[1], reverse=True
+    )
+    for index, seconds in slowest[:SLOWEST_TICKS]:
+        print(f"  tick {index:<8} {seconds * 1000:8.3f} ms")
+    print(
+        f"AI decisions skipped {result['ai_skipped']}, "
+        f"deferred {result['ai_deferred']}"
+    )
+
+    if result["matched"] is None:
+        print("recording has no final digest (match unfinished)")
+    elif result["matched"]:
+        print("final state matches the recording")
+    else:
+        print("final state DIVERGES from the recording", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
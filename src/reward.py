@@ -0,0 +1,38 @@
+class Reward:
+    """A power-up lying on the map until a tank drives over it."""
+
+    __slots__ = (
+        "id",
+        "kind",
+        "x",
+        "y",
+        "color",
+        "radius",
+        "duration",
+        "stackable",
+        "spawn_time",
+    )
+
+    def __init__(
+        self, reward_id, kind, x, y, color, radius, duration, stackable, spawn_time
+    ):
+        self.id = reward_id
+        self.kind = kind
+        self.x = x
+        self.y = y
+        self.color = color
+        self.radius = radius
+        # Seconds the power-up lasts once collected
+        self.duration = duration
+        self.stackable = stackable
+        self.spawn_time = spawn_time
+
+    def record(self):
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "x": self.x,
+            "y": self.y,
+            "color": self.color,
+            "radius": self.radius,
+        }
@@ -0,0 +1,176 @@
+import re
+import threading
+import uuid
+from collections import deque
+
+from src.snapshot import SnapshotHistory
+from src.timers import ManualClock
+
+# Rooms nobody has requested or watched for this long are dropped
+ROOM_IDLE_TIMEOUT = 300
+# Upper bound on rooms held by one process
+MAX_ROOMS = 10000
+# Inputs beyond this many commands waiting for a room are dropped
+MAX_QUEUED_COMMANDS = 1024
+
+VALID_ROOM_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class RoomLimitError(Exception):
+    pass
+
+
+class RoomUnavailableError(Exception):
+    pass
+
+
+def new_room_id():
+    return uuid.uuid4().hex[:12]
+
+
+class GameRoom:
+    """One match: its world state and snapshot history.
+
+    A room that has never been started holds no world state at all, so an
+    idle room costs a few small objects and nothing per tick.
+
+    The tick loop is the room's only writer. Everyone else posts commands
+    (see RoomRegistry.post), which the tick loop runs before it steps the
+    room, and reads ``snapshots.latest``, which is never modified once
+    published. Nothing about a room needs a lock.
+    """
+
+    __slots__ = (
+        "room_id",
+        "state",
+        "snapshots",
+        "commands",
+        "last_seen",
+        "cost",
+        "clock",
+        "recorder",
+        "profiler",
+    )
+
+    def __init__(self, room_id, now):
+        self.room_id = room_id
+        # World state dict, created by the first start-game
+        self.state = None
+        self.snapshots = SnapshotHistory()
+        # (name, *args) tuples waiting for the tick loop, oldest first
+        self.commands = deque()
+        self.last_seen = now
+        # Smoothed seconds spent stepping this room per tick
+        self.cost = 0.0
+        # Game time as seen by the simulation. Whoever steps the room sets
+        # it to the tick's time, so a match only depends on its seed, its
+        # tick times and its inputs.
+        self.clock = ManualClock(now)
+        # MatchRecorder while the match is being recorded
+        self.recorder = None
+        # RoomProfiler while an admin profiles the room's ticks
+        self.profiler = None
+
+    @property
+    def active(self):
+        return self.state is not None and self.state["gameActive"]
+
+    def touch(self, now):
+        self.last_seen = now
+
+
+class RoomRegistry:
+    """Rooms keyed by id, plus the subset the tick loop has to step."""
+
+    def __init__(self, idle_timeout=ROOM_IDLE_TIMEOUT, max_rooms=MAX_ROOMS):
+        self.idle_timeout = idle_timeout
+        self.max_rooms = max_rooms
+        self.rooms = {}
+        # Ids of rooms with a running match
+        self.running = set()
+        # Ids of rooms that were posted commands since the last tick
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
+
+    def create(self, room_id, now):
+        with self.lock:
+            if room_id in self.rooms:
+                return self.rooms[room_id]
+            if len(self.rooms) >= self.max_rooms:
+                raise RoomLimitError("Room limit reached")
+            room = GameRoom(room_id, now)
+            self.rooms[room_id] = room
+            return room
+
+    def join(self, room_id, now):
+        # Join an existing room, or open it under the requested id
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.create(room_id, now)
+        room.touch(now)
+        return room
+
+    def visit(self, room_id, now):
+        # An existing room, kept from expiring; None if there is none, as
+        # reads never open rooms
+        room = self.rooms.get(room_id)
+        if room is not None:
+            room.touch(now)
+        return room
+
+    def remove(self, room_id):
+        with self.lock:
+            self.running.discard(room_id)
+            return self.rooms.pop(room_id, None)
+
+    def mark_running(self, room):
+        with self.lock:
+            self.running.add(room.room_id)
+
+    def post(self, room, command):
+        # Queue a command for the room's writer, the tick loop
+        room.commands.append(command)
+        with self.lock:
+            self.pending.add(room.room_id)
+
+    def busy_rooms(self):
+        # Rooms the tick loop has to visit: running ones, then the others
+        # with commands waiting
+        with self.lock:
+            pending, self.pending = self.pending, set()
+        rooms = self.running_rooms()
+        pending.difference_update(room.room_id for room in rooms)
+        for room_id in pending:
+            room = self.rooms.get(room_id)
+            if room is not None:
+                rooms.append(room)
+        return rooms
+
+    def running_rooms(self):
+        # Rooms whose match ended are dropped from the tick set here
+        with self.lock:
+            rooms = []
+            for room_id in list(self.running):
+                room = self.rooms.get(room_id)
+                if room is None or not room.active:
+                    self.running.discard(room_id)
+                else:
+                    rooms.append(room)
+            return rooms
+
+    def expire(self, now):
+        expired = []
+        with self.lock:
+            for room_id, room in list(self.rooms.items()):
+                if now - room.last_seen < self.idle_timeout:
+                    continue
+                del self.rooms[room_id]
+                self.running.discard(room_id)
+                expired.append(room_id)
+        return expired
@@ -0,0 +1,271 @@
+import functools
+import importlib
+import itertools
+import multiprocessing
+import os
+import threading
+
+try:
+    from eventlet import tpool
+    from eventlet.patcher import is_monkey_patched
+except ImportError:
+    tpool = None
+
+# Move rooms when the busiest worker spends more than this share of its
+# time ticking...
+REBALANCE_THRESHOLD = 0.5
+# ...and is at least this much busier than the idlest one
+REBALANCE_MARGIN = 0.2
+# Seconds to wait for a worker's reply before giving up on it
+CALL_TIMEOUT = 10
+
+
+class WorkerError(Exception):
+    pass
+
+
+def receiver(conn):
+    """Return a function that waits for the next message on ``conn``.
+
+    Under eventlet's monkey patching a pipe comes out non-blocking, which
+    ``Connection.recv`` cannot handle, and a blocking read would stall
+    every green thread of the process. There the pipe is made blocking
+    again and read from one of eventlet's real threads.
+    """
+    if tpool is None or not is_monkey_patched("thread"):
+        return conn.recv
+    os.set_blocking(conn.fileno(), True)
+    return functools.partial(tpool.execute, conn.recv)
+
+
+def worker_main(conn, ops_path):
+    """Entry point of a simulation worker process.
+
+    ``ops_path`` names a ``module:attribute`` dict mapping operation names to
+    callables. The ``boot`` operation starts the worker's own tick loop; all
+    others are served here, one request at a time, in arrival order.
+    """
+    module_name, attribute = ops_path.split(":")
+    ops = getattr(importlib.import_module(module_name), attribute)
+    ops["boot"]()
+    # After boot, which may have monkey patched the worker
+    recv = receiver(conn)
+
+    while True:
+        try:
+            message = recv()
+        except EOFError:
+            break
+        request_id, op, args = message
+        try:
+            result = (True, ops[op](*args))
+        except Exception as error:
+            result = (False, error)
+        # Casts (request_id None) expect no reply
+        if request_id is not None:
+            conn.send((request_id,) + result)
+
+
+class WorkerHandle:
+    """Front-process end of the pipe to one worker."""
+
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.recv = receiver(conn)
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        # Set once the worker's end of the pipe is gone
+        self.closed = False
+        self.request_ids = itertools.count(1)
+        self.reader = threading.Thread(target=self.read_replies, daemon=True)
+        self.reader.start()
+
+    def read_replies(self):
+        while True:
+            try:
+                request_id, ok, result = self.recv()
+            except (EOFError, OSError):
+                break
+            waiter = self.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter.append((ok, result))
+                waiter[0].set()
+        # The worker is gone: fail everyone still waiting on it, and anyone
+        # who asks from now on
+        with self.send_lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for waiter in pending.values():
+            waiter.append((False, WorkerError(f"Worker {self.index} exited")))
+            waiter[0].set()
+
+    def send(self, message):
+        # Under send_lock
+        if self.closed:
+            raise WorkerError(f"Worker {self.index} exited")
+        try:
+            self.conn.send(message)
+        except OSError as error:
+            raise WorkerError(f"Worker {self.index} exited") from error
+
+    def call(self, op, *args):
+        return self.reply(self.request(op, *args))
+
+    def request(self, op, *args):
+        # Send a call without waiting; pass the result to ``reply``
+        waiter = [threading.Event()]
+        with self.send_lock:
+            request_id = next(self.request_ids)
+            self.pending[request_id] = waiter
+            try:
+                self.send((request_id, op, args))
+            except WorkerError:
+                del self.pending[request_id]
+                raise
+        return request_id, op, waiter
+
+    def reply(self, request):
+        request_id, op, waiter = request
+        if not waiter[0].wait(CALL_TIMEOUT):
+            self.pending.pop(request_id, None)
+            raise WorkerError(f"Worker {self.index} did not reply to {op}")
+        ok, result = waiter[1]
+        if not ok:
+            raise result
+        return result
+
+    def cast(self, op, *args):
+        with self.send_lock:
+            self.send((None, op, args))
+
+
+class ShardPool:
+    """Simulation worker processes with sticky room-to-worker routing.
+
+    Each room is owned by exactly one worker. New rooms go to the worker
+    owning the fewest rooms, and ``rebalance`` moves running rooms off a
+    worker whose tick loop is saturated.
+    """
+
+    def __init__(self, size, ops_path):
+        self.size = size
+        self.ops_path = ops_path
+        self.workers = []
+        # room id -> worker index
+        self.owners = {}
+        # room id -> Event set once the room has moved, for rooms in flight
+        self.moving = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Spawned rather than forked so workers never inherit the front
+        # process's server threads or event loop
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.size):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=worker_main,
+                args=(child_conn, self.ops_path),
+                name=f"sim-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.workers.append(WorkerHandle(index, process, parent_conn))
+
+    def worker_for(self, room_id, wait=True, send=None):
+        # The worker owning the room, which it becomes on first use. For a
+        # room in flight, wait until it has landed, or return None. With
+        # ``send``, return send(worker) instead, sent under the lock so that
+        # rebalance never sees a room with a request on its way.
+        while True:
+            with self.lock:
+                moving = self.moving.get(room_id)
+                if moving is None:
+                    index = self.owners.get(room_id)
+                    if index is None:
+                        counts = [0] * self.size
+                        for owner in self.owners.values():
+                            counts[owner] += 1
+                        index = counts.index(min(counts))
+                        self.owners[room_id] = index
+                    worker = self.workers[index]
+                    return worker if send is None else send(worker)
+            if not wait:
+                return None
+            moving.wait()
+
+    def call(self, room_id, op, *args):
+        def send(worker):
+            return worker, worker.request(op, room_id, *args)
+
+        worker, request = self.worker_for(room_id, send=send)
+        return worker.reply(request)
+
+    def cast(self, room_id, op, *args):
+        self.worker_for(room_id, send=lambda worker: worker.cast(op, room_id, *args))
+
+    def group_by_worker(self, room_ids):
+        # Rooms in flight are left out rather than waited for
+        groups = {}
+        for room_id in room_ids:
+            worker = self.worker_for(room_id, wait=False)
+            if worker is not None:
+                groups.setdefault(worker.index, []).append(room_id)
+        return groups
+
+    def migrate(self, room_id, target):
+        # Requests for the room wait in worker_for while it is in flight, so
+        # they reach neither worker; other rooms are routed as usual
+        with self.lock:
+            source = self.owners.get(room_id)
+            if source is None or source == target or room_id in self.moving:
+                return False
+            moving = self.moving[room_id] = threading.Event()
+        owner = source
+        try:
+            data = self.workers[source].call("export", room_id)
+            # Exported, the room has left the source whatever happens next
+            owner = target
+            if data is not None:
+                self.workers[target].call("import", room_id, data)
+        finally:
+            with self.lock:
+                self.owners[room_id] = owner
+                del self.moving[room_id]
+            moving.set()
+        return True
+
+    def rebalance(self):
+        loads = [worker.call("load") for worker in self.workers]
+
+        # Forget rooms their worker has expired. The loads may be stale by
+        # now, so the worker confirms; under the lock no request can reach
+        # it in between and bring the room back.
+        alive = [set(load["alive"]) for load in loads]
+        with self.lock:
+            missing = {}
+            for room_id, index in self.owners.items():
+                if room_id not in self.moving and room_id not in alive[index]:
+                    missing.setdefault(index, []).append(room_id)
+            for index, room_ids in missing.items():
+                for room_id in self.workers[index].call("gone", room_ids):
+                    del self.owners[room_id]
+
+        busiest = max(range(self.size), key=lambda index: loads[index]["busy"])
+        idlest = min(range(self.size), key=lambda index: loads[index]["busy"])
+        gap = loads[busiest]["busy"] - loads[idlest]["busy"]
+        if loads[busiest]["busy"] < REBALANCE_THRESHOLD or gap < REBALANCE_MARGIN:
+            return []
+
+        # Move the costliest rooms that fit in half the gap
+        moved = []
+        budget = gap / 2
+        for room_id, share in sorted(
+            loads[busiest]["rooms"], key=lambda item: item[1], reverse=True
+        ):
+            if share <= budget and self.migrate(room_id, idlest):
+                moved.append(room_id)
+                budget -= share
+        return moved
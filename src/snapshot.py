@@ -0,0 +1,388 @@
+import json
+import threading
+from collections import deque
+
+from src.tank import PLAYER_ID
+from src.wire import encode_snapshot
+
+# Top-level fields sent to clients. Timers and AI bookkeeping such as
+# lastAIUpdate, nextEnemySpawn and the timer queue stay on the server.
+PUBLIC_FIELDS = (
+    "gameActive",
+    "gameOver",
+    "winner",
+    "completed",
+    "map",
+    "mapWidth",
+    "mapHeight",
+    "currentLevel",
+    "enemiesDefeated",
+    "enemiesRequired",
+    "maxEnemies",
+)
+
+# Entity lists in the world state; each entity provides record() with the
+# fields sent to clients
+ENTITY_TYPES = ("tanks", "projectiles", "rewards")
+
+# Deltas can reach back this many snapshots; older clients get a keyframe
+MAX_DELTA_GAP = 64
+
+# Clients with a viewport get the entities in their camera's view plus this
+# many pixels around it, so that nothing pops in at the edge of the screen
+VIEW_MARGIN = 200
+# Largest viewport a client may ask for, in pixels
+MAX_VIEWPORT = 4096
+# Viewports are rounded up to a multiple of this many pixels, so that
+# clients of about the same size share their messages
+VIEWPORT_STEP = 200
+# What was in view is remembered for this many viewports at most, the ones
+# used least recently are forgotten first
+MAX_VIEWPORTS = 8
+
+
+def parse_viewport(text):
+    """A client's camera size, from ``"<width>x<height>"``, rounded up to
+    VIEWPORT_STEP; None if invalid.
+    """
+    try:
+        width, height = (int(value) for value in text.split("x"))
+    except (AttributeError, ValueError):
+        return None
+    if not (0 < width <= MAX_VIEWPORT and 0 < height <= MAX_VIEWPORT):
+        return None
+    return (
+        -(-width // VIEWPORT_STEP) * VIEWPORT_STEP,
+        -(-height // VIEWPORT_STEP) * VIEWPORT_STEP,
+    )
+
+
+class Snapshot:
+    """One numbered capture of the public world state, never changed again.
+
+    The writer publishes a new one every tick. Readers on any thread build
+    their messages from the one they hold, while the writer captures the
+    next; messages are cached on it per base sequence and viewport.
+
+    A client that gives its viewport only gets what is in view of a camera
+    of that size centred on the player, and kept on the map. What such a
+    client holds after a message is then exactly the entities that were in
+    view, which are remembered in ``views`` for every sequence a message
+    was built at. A client acks late, so it may hold any of the messages
+    sent since its ack; view deltas are built to be right against all of
+    them. Clients whose viewport has been forgotten get a keyframe.
+    """
+
+    def __init__(
+        self, seq, fields, entities, removals, max_gap, views=None, views_lock=None
+    ):
+        self.seq = seq
+        self.fields = fields
+        # type -> {id: (record, modified_seq)}
+        self.entities = entities
+        # (seq, ((type, id), ...)) for every capture that removed entities
+        self.removals = removals
+        self.max_gap = max_gap
+        # viewport -> {seq: {type: ids in view}, or None if the whole map
+        # was}, shared along the history, least recently used first
+        self.views = {} if views is None else views
+        self.views_lock = threading.Lock() if views_lock is None else views_lock
+        # Messages and their encodings keyed by base sequence and viewport
+        self._keys = {}
+        self._cache = {}
+        self._json_cache = {}
+        self._binary_cache = {}
+
+    def __getstate__(self):
+        # Rooms moving to another worker are pickled; locks are not
+        state = dict(self.__dict__)
+        del state["views_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.views_lock = threading.Lock()
+
+    def keyframe(self):
+        message = {"seq": self.seq, "keyframe": True}
+        message.update(self.fields)
+        for entity_type, entities in self.entities.items():
+            message[entity_type] = [record for record, _ in entities.values()]
+        return message
+
+    def area(self, viewport):
+        """The part of the map in view of ``viewport``, as (left, top,
+        right, bottom), margin included; None if that is the whole map.
+        """
+        player = self.entities["tanks"].get(PLAYER_ID)
+        if player is None:
+            return None
+        record = player[0]
+        map_width = self.fields["mapWidth"]
+        map_height = self.fields["mapHeight"]
+        view_width, view_height = viewport
+        # The camera follows the player but stops at the edges of the map
+        left = min(max(record["x"] - view_width / 2, 0), max(map_width - view_width, 0))
+        top = min(
+            max(record["y"] - view_height / 2, 0), max(map_height - view_height, 0)
+        )
+        left -= VIEW_MARGIN
+        top -= VIEW_MARGIN
+        right = left + view_width + 2 * VIEW_MARGIN
+        bottom = top + view_height + 2 * VIEW_MARGIN
+        if left <= 0 and top <= 0 and right >= map_width and bottom >= map_height:
+            return None
+        return left, top, right, bottom
+
+    def remember(self, viewport, visible):
+        # What a client with ``viewport`` holds once it has this snapshot
+        with self.views_lock:
+            seen = self.views.pop(viewport, None)
+            if seen is None:
+                seen = {}
+                while len(self.views) >= MAX_VIEWPORTS:
+                    del self.views[next(iter(self.views))]
+            self.views[viewport] = seen
+            seen[self.seq] = visible
+            # Keep twice the gap, for readers still on an older snapshot
+            for seq in list(seen):
+                if seq < self.seq - 2 * self.max_gap:
+                    del seen[seq]
+
+    def in_view(self, viewport, area):
+        # type -> ids in ``area``
+        visible = self.views.get(viewport, {}).get(self.seq)
+        if visible is None:
+            left, top, right, bottom = area
+            visible = {
+                entity_type: {
+                    entity_id
+                    for entity_id, (record, _) in entities.items()
+                    if left <= record["x"] <= right and top <= record["y"] <= bottom
+                }
+                for entity_type, entities in self.entities.items()
+            }
+            self.remember(viewport, visible)
+        return visible
+
+    def sent_since(self, since, viewport):
+        # What was in view for each message built at ``since`` or later;
+        # None if nothing is remembered at ``since``
+        with self.views_lock:
+            seen = self.views.get(viewport)
+            if seen is None or since not in seen:
+                return None
+            return [held for seq, held in seen.items() if since <= seq < self.seq]
+
+    def message_key(self, since, viewport):
+        # (base, viewport) of the message a client gets: base None for a
+        # keyframe, viewport None for the whole map
+        key = self._keys.get((since, viewport))
+        if key is None:
+            key = self._keys[since, viewport] = self._message_key(since, viewport)
+        return key
+
+    def _message_key(self, since, viewport):
+        # Unknown, future or too old a base: fall back to a full keyframe
+        if since is not None and not self.seq - self.max_gap <= since <= self.seq:
+            since = None
+        if viewport is None:
+            return since, None
+        if self.area(viewport) is None:
+            self.remember(viewport, None)
+            # All of the map is in view now; if it was not in a message
+            # since the base, the client lacks entities that have not
+            # changed since
+            if since is not None:
+                sent = self.sent_since(since, viewport)
+                if sent is None or any(held is not None for held in sent):
+                    since = None
+            return since, None
+        # The client must have held what was in view at the base, and never
+        # the whole map since
+        if since is not None:
+            sent = self.sent_since(since, viewport)
+            if sent is None or None in sent:
+                since = None
+        return since, viewport
+
+    def delta(self, since=None, viewport=None):
+        key = self.message_key(since, viewport)
+        message = self._cache.get(key)
+        if message is not None:
+            return message
+
+        since, viewport = key
+        if viewport is not None:
+            message = self.view_delta(since, viewport)
+        elif since is None:
+            message = self.keyframe()
+        else:
+            message = {"seq": self.seq, "base": since, "keyframe": False}
+            message.update(self.fields)
+            removed = {entity_type: [] for entity_type in self.entities}
+
+            for entity_type, entities in self.entities.items():
+                message[entity_type] = [
+                    record
+                    for record, modified in entities.values()
+                    if modified > since
+                ]
+
+            for seq, removed_entities in self.removals:
+                if seq <= since:
+                    continue
+                for entity_type, entity_id in removed_entities:
+                    # Ids that came back since are already sent as upserts
+                    if entity_id not in self.entities[entity_type]:
+                        removed[entity_type].append(entity_id)
+
+            message["removed"] = removed
+
+        self._cache[key] = message
+        return message
+
+    def view_delta(self, since, viewport):
+        # What is in view, against every message the client may have
+        # applied since ``since``: entities that changed or were out of view
+        # in any of them, and removals of those in any of them that are out
+        # of view or off the map now
+        visible = self.in_view(viewport, self.area(viewport))
+        # None, for a keyframe, also if the viewport was forgotten since the
+        # message key was made
+        sent = None if since is None else self.sent_since(since, viewport)
+        message = {"seq": self.seq, "keyframe": sent is None}
+        if sent is not None:
+            message["base"] = since
+        message.update(self.fields)
+        removed = {}
+        for entity_type, entities in self.entities.items():
+            ids = visible[entity_type]
+            if sent is None:
+                message[entity_type] = [entities[i][0] for i in sorted(ids)]
+                continue
+            before = [held[entity_type] for held in sent]
+            message[entity_type] = [
+                entities[i][0]
+                for i in sorted(ids)
+                if entities[i][1] > since or any(i not in held for held in before)
+            ]
+            removed[entity_type] = sorted(set().union(*before) - ids)
+        if sent is not None:
+            message["removed"] = removed
+        return message
+
+    def delta_json(self, since=None, viewport=None):
+        # delta() as JSON bytes, encoded once per base sequence and viewport
+        key = self.message_key(since, viewport)
+        data = self._json_cache.get(key)
+        if data is None:
+            data = json.dumps(self.delta(since, viewport), separators=(",", ":"))
+            data = self._json_cache[key] = data.encode()
+        return data
+
+    def delta_bytes(self, since=None, viewport=None):
+        # Binary form of delta(), encoded once per base sequence and viewport
+        key = self.message_key(since, viewport)
+        data = self._binary_cache.get(key)
+        if data is None:
+            message = self.delta(since, viewport)
+            data = self._binary_cache[key] = encode_snapshot(message)
+        return data
+
+
+class SnapshotHistory:
+    """Numbered snapshots of the public world state.
+
+    Every entity remembers the sequence number at which it last changed and
+    every removal is logged with its sequence number. A delta against any
+    acknowledged sequence is then the set of entities modified after it plus
+    the ids removed after it, which stays correct for a client that has
+    applied any snapshot between the base and the current one.
+
+    Only the room's writer calls capture(). Each capture publishes a new
+    Snapshot as ``latest``; readers take that and never see it change.
+    """
+
+    def __init__(self, max_gap=MAX_DELTA_GAP):
+        self.max_gap = max_gap
+        self.entities = {entity_type: {} for entity_type in ENTITY_TYPES}
+        # (seq, ((type, id), ...)) for every capture that removed entities
+        self.removals = deque()
+        # What clients with each viewport were sent, for deltas against it
+        self.views = {}
+        self.views_lock = threading.Lock()
+        self.latest = Snapshot(
+            0, {}, dict(self.entities), (), max_gap, self.views, self.views_lock
+        )
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["views_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # One lock again for the history and its latest snapshot
+        self.views_lock = self.latest.views_lock
+
+    @property
+    def seq(self):
+        return self.latest.seq
+
+    def capture(self, state):
+        seq = self.latest.seq + 1
+        fields = {key: state.get(key) for key in PUBLIC_FIELDS}
+        # The last input frame applied to the player's tank, for clients to
+        # replay the ones they sent since on top of this snapshot
+        fields["lastInputSeq"] = state["inputSeq"].get(PLAYER_ID)
+        removed = []
+
+        for entity_type in ENTITY_TYPES:
+            previous = self.entities[entity_type]
+            current = {}
+
+            for entity in state[entity_type]:
+                record = entity.record()
+                entity_id = record["id"]
+                old = previous.get(entity_id)
+                if old is not None and old[0] == record:
+                    current[entity_id] = old
+                else:
+                    current[entity_id] = (record, seq)
+
+            for entity_id in previous:
+                if entity_id not in current:
+                    removed.append((entity_type, entity_id))
+
+            # A new dict every time: published snapshots keep the old one
+            self.entities[entity_type] = current
+
+        if removed:
+            self.removals.append((seq, tuple(removed)))
+        # Forget removals that no delta can reach any more
+        while self.removals and self.removals[0][0] <= seq - self.max_gap:
+            self.removals.popleft()
+
+        self.latest = Snapshot(
+            seq,
+            fields,
+            dict(self.entities),
+            tuple(self.removals),
+            self.max_gap,
+            self.views,
+            self.views_lock,
+        )
+        return seq
+
+    def keyframe(self):
+        return self.latest.keyframe()
+
+    def delta(self, since=None, viewport=None):
+        return self.latest.delta(since, viewport)
+
+    def delta_json(self, since=None, viewport=None):
+        return self.latest.delta_json(since, viewport)
+
+    def delta_bytes(self, since=None, viewport=None):
+        return self.latest.delta_bytes(since, viewport)
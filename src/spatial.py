@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+
+# Side of one grid cell in pixels. Broad-phase queries are cheapest when
+# this is close to the largest query radius used every tick.
+CELL_SIZE = 64
+
+# Cell coordinates are packed into one int64 key for the array grid
+_KEY_OFFSET = 1 << 20
+_KEY_STRIDE = 1 << 21
+
+
+def cell_of(x, y, cell_size=CELL_SIZE):
+    return (math.floor(x / cell_size), math.floor(y / cell_size))
+
+
+class SpatialHash:
+    """Uniform-grid index of entities by their ``x``/``y`` position.
+
+    Queries return candidates only: callers still run their own exact
+    distance test, so results do not depend on the cell size. Candidates
+    come back in id order, which for tanks and rewards is also their order
+    in the state lists.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        # (cx, cy) -> {entity id: entity}
+        self.cells = {}
+        # entity id -> (cx, cy)
+        self.where = {}
+
+    def __len__(self):
+        return len(self.where)
+
+    def rebuild(self, entities):
+        self.cells = {}
+        self.where = {}
+        for entity in entities:
+            self.insert(entity)
+
+    def insert(self, entity):
+        cell = cell_of(entity.x, entity.y, self.cell_size)
+        self.cells.setdefault(cell, {})[entity.id] = entity
+        self.where[entity.id] = cell
+
+    def remove(self, entity):
+        cell = self.where.pop(entity.id, None)
+        if cell is None:
+            return
+        bucket = self.cells[cell]
+        del bucket[entity.id]
+        if not bucket:
+            del self.cells[cell]
+
+    def move(self, entity):
+        # Re-bin an entity whose position changed
+        cell = cell_of(entity.x, entity.y, self.cell_size)
+        if self.where.get(entity.id) != cell:
+            self.remove(entity)
+            self.insert(entity)
+
+    def nearby(self, x, y, radius):
+        """Entities in the cells overlapping the square around (x, y)."""
+        min_cx, min_cy = cell_of(x - radius, y - radius, self.cell_size)
+        max_cx, max_cy = cell_of(x + radius, y + radius, self.cell_size)
+
+        found = []
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self.cells):
+            # Query wider than the occupied area: walk the occupied cells
+            for (cx, cy), bucket in self.cells.items():
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy:
+                    found.extend(bucket.values())
+        else:
+            for cx in range(min_cx, max_cx + 1):
+                for cy in range(min_cy, max_cy + 1):
+                    bucket = self.cells.get((cx, cy))
+                    if bucket:
+                        found.extend(bucket.values())
+
+        found.sort(key=lambda entity: entity.id)
+        return found
+
+    def nearest(self, x, y):
+        """Closest entity to (x, y) and its distance, or (None, inf).
+
+        Searches rings of cells outward from the query cell and stops once
+        no unvisited cell can hold anything closer. Ties go to the lowest
+        id, matching a first-wins scan of the state list.
+        """
+        if not self.cells:
+            return None, float("inf")
+
+        center_x, center_y = cell_of(x, y, self.cell_size)
+        reach = max(
+            max(abs(cx - center_x), abs(cy - center_y)) for cx, cy in self.cells
+        )
+
+        best = None
+        best_distance = float("inf")
+        for ring in range(reach + 1):
+            # Every cell in this ring is at least (ring - 1) cells away
+            if best is not None and best_distance < (ring - 1) * self.cell_size:
+                break
+            for cell in ring_cells(center_x, center_y, ring):
+                bucket = self.cells.get(cell)
+                if not bucket:
+                    continue
+                for entity in bucket.values():
+                    dx = entity.x - x
+                    dy = entity.y - y
+                    distance = math.sqrt(dx * dx + dy * dy)
+                    if distance < best_distance or (
+                        distance == best_distance and entity.id < best.id
+                    ):
+                        best = entity
+                        best_distance = distance
+
+        return best, best_distance
+
+
+def ring_cells(center_x, center_y, ring):
+    if ring == 0:
+        yield (center_x, center_y)
+        return
+    for cx in range(center_x - ring, center_x + ring + 1):
+        yield (cx, center_y - ring)
+        yield (cx, center_y + ring)
+    for cy in range(center_y - ring + 1, center_y + ring):
+        yield (center_x - ring, cy)
+        yield (center_x + ring, cy)
+
+
+def cell_keys(x, y, cell_size=CELL_SIZE):
+    cx = np.floor_divide(np.asarray(x, dtype=float), cell_size).astype(np.int64)
+    cy = np.floor_divide(np.asarray(y, dtype=float), cell_size).astype(np.int64)
+    return (cx + _KEY_OFFSET) * _KEY_STRIDE + (cy + _KEY_OFFSET)
+
+
+def grid_pairs(ax, ay, bx, by, radius, cell_size=CELL_SIZE):
+    """Candidate index pairs (i, j) with point a[i] near point b[j].
+
+    Points of ``a`` are bucketed by cell and sorted by cell key; each point
+    of ``b`` then looks up its 3x3 block of neighboring cells with binary
+    searches. The cost is linear in the number of points plus the number of
+    candidate pairs, instead of len(a) * len(b). Candidates can be further
+    apart than ``radius``; callers apply the exact test.
+    """
+    if radius > cell_size:
+        raise ValueError("Query radius must not exceed the cell size")
+
+    empty = np.empty(0, dtype=np.int64)
+    if len(ax) == 0 or len(bx) == 0:
+        return empty, empty
+
+    a_keys = cell_keys(ax, ay, cell_size)
+    order = np.argsort(a_keys, kind="stable")
+    sorted_keys = a_keys[order]
+
+    b_keys = cell_keys(bx, by, cell_size)
+    offsets = np.array(
+        [dx * _KEY_STRIDE + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)],
+        dtype=np.int64,
+    )
+    neighbor_keys = (b_keys[:, None] + offsets[None, :]).ravel()
+
+    starts = np.searchsorted(sorted_keys, neighbor_keys, side="left")
+    lengths = np.searchsorted(sorted_keys, neighbor_keys, side="right") - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return empty, empty
+
+    # Expand every (start, length) run into the positions it covers
+    b_index = np.repeat(np.repeat(np.arange(len(b_keys)), len(offsets)), lengths)
+    run_starts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    a_index = order[run_starts + np.arange(total)]
+    return a_index, b_index
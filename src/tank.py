@@ -1,31 +1,100 @@
-class Tank:
-    def __init__(self, x, y, health=100):
-        self.x = x
-        self.y = y
-        self.health = health
-        self.alive = True
+# The player's tank always has this id; enemies get ids from the room's
+# entity allocator
+PLAYER_ID = 1
+# Half the width of the square a tank takes up against walls
+TANK_RADIUS = 18
 
-    def move(self, dx, dy):
-        self.x += dx
-        self.y += dy
+# Power-up fields sent to clients only while set, as (record key, attribute)
+OPTIONAL_FIELDS = (
+    ("powerupTime", "powerup_time"),
+    ("powerupDuration", "powerup_duration"),
+    ("powerupType", "powerup_type"),
+    ("powerupColor", "powerup_color"),
+    ("powerupMessage", "powerup_message"),
+    ("damageBoost", "damage_boost"),
+    ("damageBoostTime", "damage_boost_time"),
+    ("damageBoostDuration", "damage_boost_duration"),
+    ("damageBoostColor", "damage_boost_color"),
+)
 
-    def shoot(self):
-        return Projectile(self.x, self.y)
 
-    def take_damage(self, damage):
-        self.health -= damage
-        if self.health <= 0:
-            self.alive = False
+class Tank:
+    """A player or AI tank.
+
+    Power-up fields are None while the tank has never had that power-up,
+    and such fields are left out of the tank's snapshot record.
+    """
 
-class Projectile:
-    def __init__(self, x, y, speed=5):
+    __slots__ = (
+        "id",
+        "x",
+        "y",
+        "angle",
+        "health",
+        "max_health",
+        "color",
+        "barrels",
+        "ai_skill",
+        "last_update",
+        "last_shot",
+        "next_think",
+        "powerup_time",
+        "powerup_duration",
+        "powerup_type",
+        "powerup_color",
+        "powerup_message",
+        "message_expiry",
+        "damage_boost",
+        "damage_boost_time",
+        "damage_boost_duration",
+        "damage_boost_color",
+    )
+
+    def __init__(
+        self, tank_id, x, y, angle, health, color, max_health=None, ai_skill=0.5
+    ):
+        self.id = tank_id
         self.x = x
         self.y = y
-        self.speed = speed
+        self.angle = angle
+        self.health = health
+        self.max_health = health if max_health is None else max_health
+        self.color = color
+        self.barrels = 1
+        self.ai_skill = ai_skill
+        # Game times of the AI's last decision and last shot
+        self.last_update = 0
+        self.last_shot = 0
+        # Game time the AI next looks at the tank, see AIScheduler
+        self.next_think = 0
+        self.powerup_time = None
+        self.powerup_duration = None
+        self.powerup_type = None
+        self.powerup_color = None
+        self.powerup_message = None
+        self.message_expiry = None
+        self.damage_boost = None
+        self.damage_boost_time = None
+        self.damage_boost_duration = None
+        self.damage_boost_color = None
 
-    def update(self):
-        self.y -= self.speed
+    @property
+    def damage_multiplier(self):
+        return 1.0 if self.damage_boost is None else self.damage_boost
 
-    def check_collision(self, target):
-        # Placeholder for collision detection logic
-        pass
\ No newline at end of file
+    def record(self):
+        record = {
+            "id": self.id,
+            "x": self.x,
+            "y": self.y,
+            "angle": self.angle,
+            "health": self.health,
+            "maxHealth": self.max_health,
+            "color": self.color,
+            "barrels": self.barrels,
+        }
+        for key, attribute in OPTIONAL_FIELDS:
+            value = getattr(self, attribute)
+            if value is not None:
+                record[key] = value
+        return record
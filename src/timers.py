@@ -0,0 +1,80 @@
+import heapq
+import time
+
+# One monotonic clock drives the whole simulation. The offset keeps game
+# timestamps comparable with the client's Date.now() for power-up timers.
+CLOCK_OFFSET = time.time() - time.monotonic()
+
+
+def game_clock():
+    return time.monotonic() + CLOCK_OFFSET
+
+
+class ManualClock:
+    """A clock that only moves when it is set or advanced.
+
+    Call it like game_clock(). A room reads the time of the tick being
+    stepped from one, whether the ticks follow the wall clock or a replay
+    runs them as fast as it can.
+    """
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+        return self.now
+
+
+class TimerQueue:
+    """One-shot timers keyed by event, fired in order of their due time.
+
+    A key names what happens when the timer fires, e.g.
+    ``("rewardExpiry", reward_id)``. Scheduling a key again replaces its
+    pending timer, and cancelling it drops it; the superseded heap entries
+    are skipped when they surface. Checking for due timers costs nothing
+    per pending timer, only per timer that fires.
+    """
+
+    def __init__(self):
+        self.heap = []
+        # key -> sequence number of its live heap entry
+        self.pending = {}
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def schedule(self, key, due):
+        self.seq += 1
+        self.pending[key] = self.seq
+        heapq.heappush(self.heap, (due, self.seq, key))
+        # Drop superseded entries once they dominate the heap
+        if len(self.heap) > 2 * len(self.pending) + 64:
+            self.heap = [
+                entry for entry in self.heap if self.pending.get(entry[2]) == entry[1]
+            ]
+            heapq.heapify(self.heap)
+
+    def cancel(self, key):
+        self.pending.pop(key, None)
+
+    def scheduled(self, key):
+        return key in self.pending
+
+    def pop_due(self, now):
+        """Keys of the timers due at or before ``now``, earliest first.
+
+        Timers scheduled while the returned keys are handled wait for the
+        next call, even if they are already due.
+        """
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self.heap)
+            if self.pending.get(key) == seq:
+                del self.pending[key]
+                due.append(key)
+        return due
@@ -0,0 +1,369 @@
+import struct
+
+# Compact binary encoding of snapshot messages (see SnapshotHistory).
+# Everything is little-endian. Coordinates are fixed point with
+# COORD_SCALE steps per pixel, angles are uint16 fractions of a turn and
+# health/damage are stored in tenths. Colors and reward types are sent as
+# small enums; the same tables live in static/js/client.js.
+
+WIRE_VERSION = 4
+COORD_SCALE = 8
+ANGLE_SCALE = 65536 / 360
+TENTHS = 10
+
+COLORS = (
+    "green",
+    "blue",
+    "red",
+    "darkviolet",
+    "darkgoldenrod",
+    "darkcyan",
+    "yellow",
+    "orange",
+    "purple",
+)
+REWARD_KINDS = ("barrel", "health", "damage")
+COLOR_CODES = {color: code for code, color in enumerate(COLORS)}
+REWARD_CODES = {kind: code for code, kind in enumerate(REWARD_KINDS)}
+
+# Entity ids, including projectile owners, are uint32
+MAX_ENTITY_ID = 0xFFFFFFFF
+
+# Header flags
+FLAG_KEYFRAME = 1
+FLAG_GAME_ACTIVE = 2
+FLAG_GAME_OVER = 4
+FLAG_COMPLETED = 8
+
+# Optional tank fields
+TANK_POWERUP_TIMER = 1
+TANK_POWERUP_STYLE = 2
+TANK_DAMAGE_BOOST = 4
+TANK_BOOST_TIMER = 8
+TANK_BOOST_COLOR = 16
+TANK_MESSAGE = 32
+
+# version, flags, seq, base, winner, level, defeated, required, max enemies,
+# map width, map height, last input sequence applied to the player (0 for
+# none), followed by the map name
+HEADER = struct.Struct("<BBIIbBHHHHHI")
+NAME_LENGTH = struct.Struct("<B")
+COUNT = struct.Struct("<H")
+ENTITY_ID = struct.Struct("<I")
+# id, x, y, angle, health, max health, color, barrels, optional fields
+TANK = struct.Struct("<IiiHHHBBB")
+# id, x, y, angle, owner, damage, color
+PROJECTILE = struct.Struct("<IiiHIHB")
+# id, x, y, type, color, radius
+REWARD = struct.Struct("<IiiBBB")
+POWERUP_TIMER = struct.Struct("<df")
+POWERUP_STYLE = struct.Struct("<BB")
+DAMAGE_BOOST = struct.Struct("<f")
+BOOST_TIMER = struct.Struct("<df")
+BOOST_COLOR = struct.Struct("<B")
+MESSAGE_LENGTH = struct.Struct("<B")
+
+
+def wire_id(value):
+    if not 0 <= value <= MAX_ENTITY_ID:
+        raise ValueError(f"entity id {value} does not fit the wire format")
+    return value
+
+
+def quantize(value):
+    return int(round(value * COORD_SCALE))
+
+
+def quantize_angle(angle):
+    return int(round((angle % 360) * ANGLE_SCALE)) & 0xFFFF
+
+
+def tenths(value):
+    return max(0, min(int(round(value * TENTHS)), 0xFFFF))
+
+
+def color_code(color):
+    # Unknown colors fall back to the first entry rather than failing the frame
+    return COLOR_CODES.get(color, 0)
+
+
+def encode_tank(tank, parts):
+    optional = 0
+    if "powerupTime" in tank and "powerupDuration" in tank:
+        optional |= TANK_POWERUP_TIMER
+    if "powerupType" in tank and "powerupColor" in tank:
+        optional |= TANK_POWERUP_STYLE
+    if "damageBoost" in tank:
+        optional |= TANK_DAMAGE_BOOST
+    if "damageBoostTime" in tank and "damageBoostDuration" in tank:
+        optional |= TANK_BOOST_TIMER
+    if "damageBoostColor" in tank:
+        optional |= TANK_BOOST_COLOR
+    if "powerupMessage" in tank:
+        optional |= TANK_MESSAGE
+
+    parts.append(
+        TANK.pack(
+            wire_id(tank["id"]),
+            quantize(tank["x"]),
+            quantize(tank["y"]),
+            quantize_angle(tank["angle"]),
+            tenths(tank["health"]),
+            tenths(tank.get("maxHealth", 0)),
+            color_code(tank["color"]),
+            tank.get("barrels", 1),
+            optional,
+        )
+    )
+
+    if optional & TANK_POWERUP_TIMER:
+        parts.append(POWERUP_TIMER.pack(tank["powerupTime"], tank["powerupDuration"]))
+    if optional & TANK_POWERUP_STYLE:
+        parts.append(
+            POWERUP_STYLE.pack(
+                REWARD_CODES.get(tank["powerupType"], 0),
+                color_code(tank["powerupColor"]),
+            )
+        )
+    if optional & TANK_DAMAGE_BOOST:
+        parts.append(DAMAGE_BOOST.pack(tank["damageBoost"]))
+    if optional & TANK_BOOST_TIMER:
+        parts.append(
+            BOOST_TIMER.pack(tank["damageBoostTime"], tank["damageBoostDuration"])
+        )
+    if optional & TANK_BOOST_COLOR:
+        parts.append(BOOST_COLOR.pack(color_code(tank["damageBoostColor"])))
+    if optional & TANK_MESSAGE:
+        message = tank["powerupMessage"].encode("utf-8")[:255]
+        parts.append(MESSAGE_LENGTH.pack(len(message)))
+        parts.append(message)
+
+
+def encode_projectile(projectile, parts):
+    parts.append(
+        PROJECTILE.pack(
+            wire_id(projectile["id"]),
+            quantize(projectile["x"]),
+            quantize(projectile["y"]),
+            quantize_angle(projectile["angle"]),
+            wire_id(projectile["owner"]),
+            tenths(projectile["damage"]),
+            color_code(projectile["color"]),
+        )
+    )
+
+
+def encode_reward(reward, parts):
+    parts.append(
+        REWARD.pack(
+            wire_id(reward["id"]),
+            quantize(reward["x"]),
+            quantize(reward["y"]),
+            REWARD_CODES.get(reward["type"], 0),
+            color_code(reward["color"]),
+            reward["radius"],
+        )
+    )
+
+
+ENCODERS = (
+    ("tanks", encode_tank),
+    ("projectiles", encode_projectile),
+    ("rewards", encode_reward),
+)
+
+
+def encode_snapshot(message):
+    """Pack a keyframe or delta message into bytes."""
+    keyframe = message["keyframe"]
+    flags = 0
+    if keyframe:
+        flags |= FLAG_KEYFRAME
+    if message.get("gameActive"):
+        flags |= FLAG_GAME_ACTIVE
+    if message.get("gameOver"):
+        flags |= FLAG_GAME_OVER
+    if message.get("completed"):
+        flags |= FLAG_COMPLETED
+
+    winner = message.get("winner")
+    parts = [
+        HEADER.pack(
+            WIRE_VERSION,
+            flags,
+            message["seq"],
+            message.get("base", 0),
+            -1 if winner is None else winner,
+            message.get("currentLevel") or 0,
+            message.get("enemiesDefeated") or 0,
+            message.get("enemiesRequired") or 0,
+            message.get("maxEnemies") or 0,
+            message.get("mapWidth") or 0,
+            message.get("mapHeight") or 0,
+            # Clients count from 1 per match; any int64 a client sent fits
+            (message.get("lastInputSeq") or 0) & 0xFFFFFFFF,
+        )
+    ]
+    map_name = (message.get("map") or "").encode("utf-8")[:255]
+    parts.append(NAME_LENGTH.pack(len(map_name)))
+    parts.append(map_name)
+
+    for entity_type, encode in ENCODERS:
+        entities = message[entity_type]
+        parts.append(COUNT.pack(len(entities)))
+        for entity in entities:
+            encode(entity, parts)
+
+        if not keyframe:
+            removed = message["removed"][entity_type]
+            parts.append(COUNT.pack(len(removed)))
+            parts.extend(ENTITY_ID.pack(wire_id(value)) for value in removed)
+
+    return b"".join(parts)
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return values
+
+    def text(self, length):
+        value = self.data[self.offset : self.offset + length].decode("utf-8")
+        self.offset += length
+        return value
+
+
+def decode_tank(reader):
+    (
+        entity_id,
+        x,
+        y,
+        angle,
+        health,
+        max_health,
+        color,
+        barrels,
+        optional,
+    ) = reader.unpack(TANK)
+    tank = {
+        "id": entity_id,
+        "x": x / COORD_SCALE,
+        "y": y / COORD_SCALE,
+        "angle": angle / ANGLE_SCALE,
+        "health": health / TENTHS,
+        "maxHealth": max_health / TENTHS,
+        "color": COLORS[color],
+        "barrels": barrels,
+    }
+    if optional & TANK_POWERUP_TIMER:
+        tank["powerupTime"], tank["powerupDuration"] = reader.unpack(POWERUP_TIMER)
+    if optional & TANK_POWERUP_STYLE:
+        kind, color = reader.unpack(POWERUP_STYLE)
+        tank["powerupType"] = REWARD_KINDS[kind]
+        tank["powerupColor"] = COLORS[color]
+    if optional & TANK_DAMAGE_BOOST:
+        (tank["damageBoost"],) = reader.unpack(DAMAGE_BOOST)
+    if optional & TANK_BOOST_TIMER:
+        tank["damageBoostTime"], tank["damageBoostDuration"] = reader.unpack(
+            BOOST_TIMER
+        )
+    if optional & TANK_BOOST_COLOR:
+        (color,) = reader.unpack(BOOST_COLOR)
+        tank["damageBoostColor"] = COLORS[color]
+    if optional & TANK_MESSAGE:
+        (length,) = reader.unpack(MESSAGE_LENGTH)
+        tank["powerupMessage"] = reader.text(length)
+    return tank
+
+
+def decode_projectile(reader):
+    entity_id, x, y, angle, owner, damage, color = reader.unpack(PROJECTILE)
+    return {
+        "id": entity_id,
+        "x": x / COORD_SCALE,
+        "y": y / COORD_SCALE,
+        "angle": angle / ANGLE_SCALE,
+        "owner": owner,
+        "damage": damage / TENTHS,
+        "color": COLORS[color],
+    }
+
+
+def decode_reward(reader):
+    entity_id, x, y, kind, color, radius = reader.unpack(REWARD)
+    return {
+        "id": entity_id,
+        "x": x / COORD_SCALE,
+        "y": y / COORD_SCALE,
+        "type": REWARD_KINDS[kind],
+        "color": COLORS[color],
+        "radius": radius,
+    }
+
+
+DECODERS = (
+    ("tanks", decode_tank),
+    ("projectiles", decode_projectile),
+    ("rewards", decode_reward),
+)
+
+
+def decode_snapshot(data):
+    """Unpack bytes from encode_snapshot(), as static/js/client.js does.
+
+    Values come back quantized; the client is the real reader, this one is
+    for tests and tools.
+    """
+    reader = Reader(data)
+    (
+        version,
+        flags,
+        seq,
+        base,
+        winner,
+        level,
+        defeated,
+        required,
+        max_enemies,
+        map_width,
+        map_height,
+        last_input_seq,
+    ) = reader.unpack(HEADER)
+    if version != WIRE_VERSION:
+        raise ValueError(f"wire version {version}, expected {WIRE_VERSION}")
+    keyframe = bool(flags & FLAG_KEYFRAME)
+    message = {
+        "seq": seq,
+        "keyframe": keyframe,
+        "gameActive": bool(flags & FLAG_GAME_ACTIVE),
+        "gameOver": bool(flags & FLAG_GAME_OVER),
+        "completed": bool(flags & FLAG_COMPLETED),
+        "winner": None if winner < 0 else winner,
+        "currentLevel": level,
+        "enemiesDefeated": defeated,
+        "enemiesRequired": required,
+        "maxEnemies": max_enemies,
+        "mapWidth": map_width,
+        "mapHeight": map_height,
+        "lastInputSeq": last_input_seq,
+    }
+    if not keyframe:
+        message["base"] = base
+        message["removed"] = {}
+    (length,) = reader.unpack(NAME_LENGTH)
+    message["map"] = reader.text(length)
+
+    for entity_type, decode in DECODERS:
+        (count,) = reader.unpack(COUNT)
+        message[entity_type] = [decode(reader) for _ in range(count)]
+        if not keyframe:
+            (count,) = reader.unpack(COUNT)
+            message["removed"][entity_type] = [
+                reader.unpack(ENTITY_ID)[0] for _ in range(count)
+            ]
+    return message
@@ -7,6 +7,8 @@ document.addEventListener('DOMContentLoaded', function() {
     // Set canvas dimensions
     canvas.width = 800;
     canvas.height = 600;
+    // The server only sends what is around this view of the map
+    const VIEW = `${canvas.width}x${canvas.height}`;
 
     // Game variables
     let gameActive = false;
@@ -19,8 +21,33 @@ document.addEventListener('DOMContentLoaded', function() {
     // Player controls (WASD for movement, left/right arrows for rotation)
     const keysPressed = {};
     const PLAYER_ID = 1; // Default to player 1
+    
+    // Room this page plays in; share the URL to let others join the match
+    const ROOM_ID = document.body.dataset.room;
+    const roomQuery = `room=${encodeURIComponent(ROOM_ID)}`;
+    if (ROOM_ID && !new URLSearchParams(window.location.search).has('room')) {
+        window.history.replaceState(null, '', `?${roomQuery}`);
+    }
+    // Watch a room read-only, with /?watch=<token> from its player's page.
+    // Spectators never learn the room id, only this token.
+    const SPECTATING = 'spectating' in document.body.dataset;
+    const WATCH_TOKEN = document.body.dataset.watch;
     const ROTATION_SPEED = 5; // Degrees per frame
+    
+    // Held-key bits of an input frame (see src/inputs.py)
+    const INPUT_FORWARD = 1;
+    const INPUT_BACKWARD = 2;
+    const INPUT_LEFT = 4;
+    const INPUT_RIGHT = 8;
+    // Input frames sent since the game started; the server drops repeats
+    let inputSeq = 0;
     const MOVEMENT_SPEED = 5; // Pixels per frame
+    // Tanks stay this far inside the map and keep a square of
+    // TANK_RADIUS clear of walls (see src/game.py)
+    const MAP_MARGIN = 20;
+    const TANK_RADIUS = 18;
+    // Input frames sent but not yet applied by the server, oldest first
+    let pendingInputs = [];
 
     // Reaction messages system
     const hitReactions = {
@@ -73,7 +100,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Game functions
     async function startGame() {
         try {
-            const response = await fetch('/api/start-game', {
+            const response = await fetch(`/api/start-game?${roomQuery}`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -82,6 +109,8 @@ document.addEventListener('DOMContentLoaded', function() {
             
             if (response.ok) {
                 gameActive = true;
+                inputSeq = 0;
+                pendingInputs = [];
                 showingLevelTransition = true;
                 levelTransitionTime = performance.now();
                 // Start game loop using requestAnimationFrame for smoother animation
@@ -96,7 +125,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     async function stopGame() {
         try {
-            const response = await fetch('/api/stop-game', {
+            const response = await fetch(`/api/stop-game?${roomQuery}`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -112,11 +141,308 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Entities mirrored from server snapshots, keyed by id. The server
+    // sends a keyframe first and afterwards only what changed since the
+    // last snapshot sequence we applied.
+    const ENTITY_TYPES = ['tanks', 'projectiles', 'rewards'];
+    const worldEntities = {
+        tanks: new Map(),
+        projectiles: new Map(),
+        rewards: new Map()
+    };
+    let lastAppliedSeq = null;
+
+    function applySnapshot(snapshot) {
+        if (!snapshot.keyframe) {
+            // Ignore deltas we cannot apply: stale, or based on a snapshot
+            // newer than ours (the server answers the next ack with a keyframe)
+            if (lastAppliedSeq === null || snapshot.seq <= lastAppliedSeq ||
+                snapshot.base > lastAppliedSeq) {
+                return null;
+            }
+        }
+
+        ENTITY_TYPES.forEach(type => {
+            const entities = worldEntities[type];
+            if (snapshot.keyframe) {
+                entities.clear();
+            } else {
+                snapshot.removed[type].forEach(id => entities.delete(id));
+            }
+            snapshot[type].forEach(entity => entities.set(entity.id, entity));
+        });
+        lastAppliedSeq = snapshot.seq;
+
+        // Rebuild the plain game state object the renderer works with
+        const state = Object.assign({}, snapshot);
+        delete state.removed;
+        ENTITY_TYPES.forEach(type => {
+            state[type] = Array.from(worldEntities[type].values());
+        });
+        return reconcile(state);
+    }
+
+    // Client-side prediction: our own inputs move the player's tank at
+    // once, by the same rules the server applies them with. Each snapshot
+    // says which input it includes last; the ones sent after it are
+    // applied again on top of where the server put the tank.
+    function reconcile(state) {
+        const applied = state.lastInputSeq || 0;
+        pendingInputs = pendingInputs.filter(frame => frame.seq > applied);
+        const index = state.tanks.findIndex(tank => tank.id === PLAYER_ID);
+        if (index < 0) return state;
+        // A copy: the entity itself stays as the server sent it
+        const playerTank = Object.assign({}, state.tanks[index]);
+        if (state.gameActive) {
+            pendingInputs.forEach(frame => applyInputFrame(state, playerTank, frame));
+        }
+        state.tanks[index] = playerTank;
+        return state;
+    }
+
+    function predictInput(frame) {
+        pendingInputs.push(frame);
+        if (!currentGameState || !currentGameState.gameActive) return;
+        const playerTank = currentGameState.tanks.find(tank => tank.id === PLAYER_ID);
+        if (playerTank) {
+            applyInputFrame(currentGameState, playerTank, frame);
+        }
+    }
+
+    // Held-key bits with the angle each moves at, relative to the tank's
+    // heading, and in which sense; in the order the server applies them
+    const INPUT_STEPS = [
+        [INPUT_FORWARD, 0, 1],
+        [INPUT_BACKWARD, 0, -1],
+        [INPUT_LEFT, -90, 1],
+        [INPUT_RIGHT, 90, 1]
+    ];
+
+    // apply_input_frame() in src/game.py, without firing
+    function applyInputFrame(state, tank, frame) {
+        if (tank.health <= 0) return;
+        if (frame.rotate) {
+            tank.angle = ((tank.angle + frame.rotate) % 360 + 360) % 360;
+        }
+        INPUT_STEPS.forEach(([bit, offset, sense]) => {
+            if (!(frame.keys & bit)) return;
+            const radians = (tank.angle + offset) * Math.PI / 180;
+            let x = tank.x + Math.sin(radians) * MOVEMENT_SPEED * sense;
+            let y = tank.y - Math.cos(radians) * MOVEMENT_SPEED * sense;
+            x = Math.max(MAP_MARGIN, Math.min(x, state.mapWidth - MAP_MARGIN));
+            y = Math.max(MAP_MARGIN, Math.min(y, state.mapHeight - MAP_MARGIN));
+            // Slide along walls like Level.slide() in src/level.py
+            if (isFree(state, x, y)) {
+                tank.x = x;
+                tank.y = y;
+            } else if (isFree(state, x, tank.y)) {
+                tank.x = x;
+            } else if (isFree(state, tank.x, y)) {
+                tank.y = y;
+            }
+        });
+    }
+
+    function isFree(state, x, y) {
+        // Level.is_free() for a tank; maps not loaded yet have no walls
+        if (!currentMap || currentMap.name !== state.map) return true;
+        const size = currentMap.tileSize;
+        const rows = currentMap.tiles;
+        const firstColumn = Math.max(Math.floor((x - TANK_RADIUS) / size), 0);
+        const lastColumn = Math.min(Math.floor((x + TANK_RADIUS) / size), rows[0].length - 1);
+        const firstRow = Math.max(Math.floor((y - TANK_RADIUS) / size), 0);
+        const lastRow = Math.min(Math.floor((y + TANK_RADIUS) / size), rows.length - 1);
+        for (let row = firstRow; row <= lastRow; row++) {
+            if (rows[row].slice(firstColumn, lastColumn + 1).includes('#')) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    // Compact binary snapshots, mirroring the layout in src/wire.py.
+    // Negotiated per connection; set to false to receive JSON instead.
+    const USE_BINARY_SNAPSHOTS = true;
+    const COORD_SCALE = 8;
+    const ANGLE_SCALE = 65536 / 360;
+    const WIRE_COLORS = ['green', 'blue', 'red', 'darkviolet', 'darkgoldenrod',
+        'darkcyan', 'yellow', 'orange', 'purple'];
+    const WIRE_REWARD_KINDS = ['barrel', 'health', 'damage'];
+    const textDecoder = new TextDecoder();
+
+    function decodeSnapshot(buffer) {
+        const view = new DataView(buffer);
+        let offset = 0;
+
+        function u8() { const v = view.getUint8(offset); offset += 1; return v; }
+        function i8() { const v = view.getInt8(offset); offset += 1; return v; }
+        function u16() { const v = view.getUint16(offset, true); offset += 2; return v; }
+        function u32() { const v = view.getUint32(offset, true); offset += 4; return v; }
+        function f32() { const v = view.getFloat32(offset, true); offset += 4; return v; }
+        function f64() { const v = view.getFloat64(offset, true); offset += 8; return v; }
+        function coord() { const v = view.getInt32(offset, true); offset += 4; return v / COORD_SCALE; }
+        function angle() { return u16() / ANGLE_SCALE; }
+        function tenths() { return u16() / 10; }
+
+        u8(); // wire version
+        const flags = u8();
+        const snapshot = {
+            seq: u32(),
+            base: u32(),
+            keyframe: (flags & 1) !== 0,
+            gameActive: (flags & 2) !== 0,
+            gameOver: (flags & 4) !== 0,
+            completed: (flags & 8) !== 0
+        };
+        const winner = i8();
+        snapshot.winner = winner < 0 ? null : winner;
+        snapshot.currentLevel = u8();
+        snapshot.enemiesDefeated = u16();
+        snapshot.enemiesRequired = u16();
+        snapshot.maxEnemies = u16();
+        snapshot.mapWidth = u16();
+        snapshot.mapHeight = u16();
+        snapshot.lastInputSeq = u32();
+        const mapNameLength = u8();
+        snapshot.map = textDecoder.decode(new Uint8Array(buffer, offset, mapNameLength));
+        offset += mapNameLength;
+
+        const readers = {
+            tanks: function() {
+                const tank = {
+                    id: u32(), x: coord(), y: coord(), angle: angle(),
+                    health: tenths(), maxHealth: tenths(),
+                    color: WIRE_COLORS[u8()], barrels: u8()
+                };
+                const optional = u8();
+                if (optional & 1) {
+                    tank.powerupTime = f64();
+                    tank.powerupDuration = f32();
+                }
+                if (optional & 2) {
+                    tank.powerupType = WIRE_REWARD_KINDS[u8()];
+                    tank.powerupColor = WIRE_COLORS[u8()];
+                }
+                if (optional & 4) {
+                    tank.damageBoost = f32();
+                }
+                if (optional & 8) {
+                    tank.damageBoostTime = f64();
+                    tank.damageBoostDuration = f32();
+                }
+                if (optional & 16) {
+                    tank.damageBoostColor = WIRE_COLORS[u8()];
+                }
+                if (optional & 32) {
+                    const length = u8();
+                    tank.powerupMessage = textDecoder.decode(new Uint8Array(buffer, offset, length));
+                    offset += length;
+                }
+                return tank;
+            },
+            projectiles: function() {
+                return {
+                    id: u32(), x: coord(), y: coord(), angle: angle(),
+                    owner: u32(), damage: tenths(), color: WIRE_COLORS[u8()]
+                };
+            },
+            rewards: function() {
+                return {
+                    id: u32(), x: coord(), y: coord(),
+                    type: WIRE_REWARD_KINDS[u8()], color: WIRE_COLORS[u8()], radius: u8()
+                };
+            }
+        };
+
+        if (!snapshot.keyframe) {
+            snapshot.removed = {};
+        }
+        ENTITY_TYPES.forEach(type => {
+            const count = u16();
+            const entities = new Array(count);
+            for (let i = 0; i < count; i++) {
+                entities[i] = readers[type]();
+            }
+            snapshot[type] = entities;
+
+            if (!snapshot.keyframe) {
+                const removedCount = u16();
+                const removed = new Array(removedCount);
+                for (let i = 0; i < removedCount; i++) {
+                    removed[i] = u32();
+                }
+                snapshot.removed[type] = removed;
+            }
+        });
+        return snapshot;
+    }
+
+    // Persistent socket channel: the server pushes state every tick and
+    // inputs are streamed back over the same connection. When the socket
+    // is unavailable we fall back to the HTTP endpoints.
+    let socket = null;
+    let socketConnected = false;
+    let pushedGameState = null;
+
+    function connectSocket() {
+        // Socket.IO client failed to load, stay on HTTP polling
+        if (typeof io === 'undefined') return;
+
+        const query = SPECTATING ? { watch: WATCH_TOKEN, view: VIEW } : { room: ROOM_ID, view: VIEW };
+        if (USE_BINARY_SNAPSHOTS) {
+            query.format = 'binary';
+        }
+        socket = io({ query: query });
+        socket.on('connect', function() {
+            socketConnected = true;
+        });
+        socket.on('disconnect', function() {
+            socketConnected = false;
+            pushedGameState = null;
+        });
+        socket.on('state', function(message) {
+            const snapshot = message instanceof ArrayBuffer ? decodeSnapshot(message) : message;
+            const state = applySnapshot(snapshot);
+            if (state) {
+                pushedGameState = state;
+                // Spectators share broadcast frames and send nothing back
+                if (!SPECTATING) {
+                    socket.emit('ack', { seq: lastAppliedSeq });
+                }
+            }
+        });
+    }
+
+    connectSocket();
+
+    if (SPECTATING) {
+        startButton.style.display = 'none';
+        stopButton.style.display = 'none';
+        requestAnimationFrame(gameLoop);
+    }
+
     async function getGameState() {
+        // Use the latest pushed state once the socket has delivered one
+        if (socketConnected && pushedGameState) {
+            return pushedGameState;
+        }
+
         try {
-            const response = await fetch('/api/game-state');
+            const params = new URLSearchParams(
+                SPECTATING ? { watch: WATCH_TOKEN, view: VIEW } : { room: ROOM_ID, view: VIEW });
+            if (lastAppliedSeq !== null) {
+                params.set('since', lastAppliedSeq);
+            }
+            if (USE_BINARY_SNAPSHOTS) {
+                params.set('format', 'binary');
+            }
+            const response = await fetch(`/api/game-state?${params}`);
             if (response.ok) {
-                return await response.json();
+                const snapshot = USE_BINARY_SNAPSHOTS ?
+                    decodeSnapshot(await response.arrayBuffer()) : await response.json();
+                const state = applySnapshot(snapshot);
+                // Nothing new to apply, keep rendering the current state
+                return state || currentGameState;
             }
         } catch (error) {
             console.error('Error getting game state:', error);
@@ -124,65 +450,79 @@ document.addEventListener('DOMContentLoaded', function() {
         return null;
     }
 
-    async function sendPlayerAction(action, value = null) {
+    async function sendInputFrame(frame) {
         try {
-            const payload = {
-                id: PLAYER_ID,
-                action: action
-            };
-            
-            if (value !== null) {
-                payload.value = value;
+            if (socketConnected) {
+                socket.emit('input', frame);
+                return;
             }
             
-            const response = await fetch('/api/update', {
+            const response = await fetch(`/api/update?${roomQuery}`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify(payload)
+                body: JSON.stringify(frame)
             });
             
             if (!response.ok) {
-                console.error('Failed to send player action');
+                console.error('Failed to send player input');
             }
         } catch (error) {
-            console.error('Error sending player action:', error);
+            console.error('Error sending player input:', error);
         }
     }
 
     function handleInput() {
+        if (SPECTATING) return;
         // Don't process input during level transitions
         if (showingLevelTransition) return;
         
+        // Everything held this frame goes out as one input message
+        let keys = 0;
+        let rotate = 0;
+        
         // Handle rotation - using ArrowLeft and ArrowRight for rotation
         if (keysPressed['ArrowLeft']) {
-            sendPlayerAction('rotate', -ROTATION_SPEED);
+            rotate -= ROTATION_SPEED;
         }
         if (keysPressed['ArrowRight']) {
-            sendPlayerAction('rotate', ROTATION_SPEED);
+            rotate += ROTATION_SPEED;
         }
         
         // Handle movement - using WASD
         if (keysPressed['w']) {
-            sendPlayerAction('move', 'forward');
+            keys |= INPUT_FORWARD;
         }
         if (keysPressed['s']) {
-            sendPlayerAction('move', 'backward');
+            keys |= INPUT_BACKWARD;
         }
         if (keysPressed['a']) {
-            sendPlayerAction('move', 'left');
+            keys |= INPUT_LEFT;
         }
         if (keysPressed['d']) {
-            sendPlayerAction('move', 'right');
+            keys |= INPUT_RIGHT;
         }
         
         // Fire with spacebar
-        if (keysPressed[' ']) {
-            sendPlayerAction('fire');
-            // Reset space to prevent continuous firing
-            keysPressed[' '] = false;
-        }
+        const fire = Boolean(keysPressed[' ']);
+        // Reset space to prevent continuous firing
+        keysPressed[' '] = false;
+        
+        // Nothing held, nothing to send
+        if (!keys && !rotate && !fire) return;
+        
+        inputSeq += 1;
+        const frame = {
+            id: PLAYER_ID,
+            seq: inputSeq,
+            keys: keys,
+            rotate: rotate,
+            fire: fire
+        };
+        // Show the move now rather than a round trip later
+        predictInput(frame);
+        sendInputFrame(frame);
     }
 
     function drawTank(tank) {
@@ -1172,6 +1512,60 @@ document.addEventListener('DOMContentLoaded', function() {
         ctx.fillRect(0, scanLineY, canvas.width, 2);
     }
 
+    // Wall tiles of the map being played, fetched once per map
+    let currentMap = null;
+    let requestedMap = null;
+
+    async function loadMap(name) {
+        requestedMap = name;
+        try {
+            const response = await fetch(`/api/maps/${encodeURIComponent(name)}`);
+            if (response.ok && requestedMap === name) {
+                currentMap = await response.json();
+            }
+        } catch (error) {
+            console.error('Error loading map:', error);
+            requestedMap = null;
+        }
+    }
+
+    // Top left of the part of the map on screen. The camera follows the
+    // player's tank and stops at the edges of the map, the way the server
+    // places it to pick what to send (see src/snapshot.py).
+    const camera = { x: 0, y: 0 };
+
+    function updateCamera() {
+        const playerTank = currentGameState.tanks.find(tank => tank.id === PLAYER_ID);
+        if (!playerTank) return;
+        const mapWidth = currentGameState.mapWidth || canvas.width;
+        const mapHeight = currentGameState.mapHeight || canvas.height;
+        camera.x = Math.min(Math.max(playerTank.x - canvas.width / 2, 0),
+                            Math.max(mapWidth - canvas.width, 0));
+        camera.y = Math.min(Math.max(playerTank.y - canvas.height / 2, 0),
+                            Math.max(mapHeight - canvas.height, 0));
+    }
+
+    function drawWalls() {
+        if (!currentMap || currentMap.name !== currentGameState.map) return;
+        const size = currentMap.tileSize;
+        ctx.fillStyle = '#555555';
+        // Only the tiles on screen
+        const firstRow = Math.max(Math.floor(camera.y / size), 0);
+        const lastRow = Math.min(Math.floor((camera.y + canvas.height) / size),
+                                 currentMap.tiles.length - 1);
+        for (let rowIndex = firstRow; rowIndex <= lastRow; rowIndex++) {
+            const row = currentMap.tiles[rowIndex];
+            const firstColumn = Math.max(Math.floor(camera.x / size), 0);
+            const lastColumn = Math.min(Math.floor((camera.x + canvas.width) / size),
+                                        row.length - 1);
+            for (let column = firstColumn; column <= lastColumn; column++) {
+                if (row[column] === '#') {
+                    ctx.fillRect(column * size, rowIndex * size, size, size);
+                }
+            }
+        }
+    }
+
     function render() {
         if (!currentGameState) return;
         
@@ -1186,6 +1580,14 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Draw game elements if game isn't over
         if (!currentGameState.gameOver) {
+            // The world scrolls with the camera, the HUD stays put
+            updateCamera();
+            ctx.save();
+            ctx.translate(-camera.x, -camera.y);
+
+            // Draw walls
+            drawWalls();
+
             // Draw rewards
             if (currentGameState.rewards) {
                 currentGameState.rewards.forEach(reward => {
@@ -1210,6 +1612,8 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Draw hit reaction messages
             drawHitMessages();
+
+            ctx.restore();
             
             // Draw boundaries
             ctx.strokeStyle = '#000000';
@@ -1271,6 +1675,9 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             
             currentGameState = newGameState;
+            if (currentGameState.map && currentGameState.map !== requestedMap) {
+                loadMap(currentGameState.map);
+            }
             
             // Check if level changed
             checkLevelChanged();
@@ -1293,6 +1700,12 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Always render, even if game is over
         render();
+
+        // Spectators keep watching between matches
+        if (SPECTATING && !(newGameState && newGameState.gameActive)) {
+            requestAnimationFrame(gameLoop);
+            return;
+        }
         
         // If game is over but we're still in game loop, exit
         if (!gameActive) {
@@ -0,0 +1,264 @@
+import math
+
+import numpy as np
+import pytest
+
+from src import game
+from src.ai import AIScheduler, bearing, sin_cos, think
+from src.game import (
+    add_entity,
+    find_player,
+    next_entity_id,
+    reset_game_state,
+    update_ai,
+    update_ai_batch,
+    update_ai_tank,
+)
+from src.room import GameRoom
+from src.tank import PLAYER_ID, Tank
+from src.timers import ManualClock
+
+EPOCH = 1000.0
+PLAYER = (400.0, 300.0)
+
+
+def columns(**fields):
+    # think()'s arrays for tanks that differ from a default only in ``fields``
+    count = max(len(values) for values in fields.values())
+    tanks = {
+        "x": [PLAYER[0]] * count,
+        "y": [PLAYER[1] - 100] * count,
+        "angle": [180.0] * count,
+        "skill": [0.7] * count,
+        "last_update": [0.0] * count,
+        "last_shot": [0.0] * count,
+    }
+    tanks.update(fields)
+    return {name: np.array(values, dtype=float) for name, values in tanks.items()}
+
+
+def decide(tanks, current_time=10.0, rewards=((), ()), seed=0):
+    return think(
+        tanks,
+        PLAYER,
+        (np.array(rewards[0], dtype=float), np.array(rewards[1], dtype=float)),
+        current_time,
+        800,
+        600,
+        np.random.default_rng(seed),
+    )
+
+
+def test_sin_cos_matches_math():
+    angles = np.concatenate(
+        [np.arange(-720, 721, 15.0), np.random.default_rng(1).uniform(-360, 720, 1000)]
+    )
+    sine, cosine = sin_cos(angles)
+    # math.radians() rounds large angles by more than sin_cos() is off
+    for angle, s, c in zip(angles.tolist(), sine.tolist(), cosine.tolist()):
+        assert s == pytest.approx(math.sin(math.radians(angle)), abs=1e-14)
+        assert c == pytest.approx(math.cos(math.radians(angle)), abs=1e-14)
+
+
+def test_bearing_matches_atan2():
+    dx, dy = np.random.default_rng(2).normal(0, 300, (2, 1000))
+    # The axes and diagonals, where the angle is unfolded from
+    dx = np.concatenate([dx, [0, 5, 0, -5, 5, -5, 5, -5]])
+    dy = np.concatenate([dy, [-5, 0, 5, 0, -5, -5, 5, 5]])
+    for x, y, angle in zip(dx.tolist(), dy.tolist(), bearing(dx, dy).tolist()):
+        expected = math.degrees(math.atan2(x, -y)) % 360
+        assert (angle - expected + 180) % 360 - 180 == pytest.approx(0, abs=1e-12)
+
+
+def test_states_by_distance_to_the_player():
+    # A patroller that picked a course half a second ago, one due to pick
+    # another, a pursuer and an attacker
+    plan = decide(
+        columns(
+            y=[PLAYER[1] - 400, PLAYER[1] - 400, PLAYER[1] - 220, PLAYER[1] - 100],
+            last_update=[9.5, 8.0, 0.0, 0.0],
+        )
+    )
+    assert plan["patrol"].tolist() == [True, True, False, False]
+    assert plan["acting"].tolist() == [1, 2, 3]
+    assert plan["deciding"].tolist() == [True, False, False]
+
+
+def test_fire_list_is_scaled_by_skill():
+    # Attackers aimed at the player, 0.8 s after their last shot: only the
+    # skilled one has reloaded, and the one not facing the player holds fire
+    plan = decide(
+        columns(
+            skill=[1.0, 0.0, 1.0],
+            angle=[180.0, 180.0, 90.0],
+            last_shot=[9.2, 9.2, 9.2],
+        )
+    )
+    assert plan["fire"].tolist() == [0]
+
+
+def test_decisions_are_seeded():
+    tanks = columns(
+        x=np.random.default_rng(3).uniform(0, 800, 200),
+        y=np.random.default_rng(4).uniform(0, 600, 200),
+    )
+    first = decide(tanks, rewards=([100], [100]), seed=5)
+    second = decide(tanks, rewards=([100], [100]), seed=5)
+    for name, values in first.items():
+        assert np.array_equal(values, second[name])
+
+
+def pursuers(count):
+    # A room with ``count`` AI tanks at pursuing distances around the player,
+    # turned up to 15 degrees away from it, and all of them having just
+    # fired: they keep pursuing, and nothing random happens
+    room = GameRoom("test", EPOCH)
+    reset_game_state(room, seed=1)
+    player = find_player(room)
+    player.x, player.y = PLAYER
+    for index in range(count):
+        direction = 2 * math.pi * index / count
+        distance = (170, 220, 280)[index % 3]
+        dx = distance * math.cos(direction)
+        dy = distance * math.sin(direction)
+        facing = math.degrees(math.atan2(-dx, dy)) % 360
+        ai_tank = Tank(
+            next_entity_id(room),
+            player.x + dx,
+            player.y + dy,
+            (facing + index % 7 * 5 - 15) % 360,
+            100,
+            "red",
+            ai_skill=0.7,
+        )
+        ai_tank.last_shot = EPOCH
+        add_entity(room, "tanks", ai_tank)
+    return room
+
+
+def test_batch_moves_like_one_tank_at_a_time():
+    start = pursuers(90).state["tanks"]
+    batched = pursuers(90)
+    single = pursuers(90)
+    for _ in range(10):
+        now = batched.clock.advance(1 / 30)
+        single.clock.advance(1 / 30)
+        update_ai_batch(batched, batched.state["tanks"][1:], find_player(batched), now)
+        for ai_tank in single.state["tanks"][1:]:
+            update_ai_tank(single, ai_tank, find_player(single), now)
+
+    turned = moved = 0
+    for ai_tank, expected, before in zip(
+        batched.state["tanks"], single.state["tanks"], start
+    ):
+        assert ai_tank.id == expected.id
+        if ai_tank.id == PLAYER_ID:
+            continue
+        turned += ai_tank.angle != before.angle
+        moved += (ai_tank.x, ai_tank.y) != (before.x, before.y)
+        assert ai_tank.x == pytest.approx(expected.x, abs=1e-9)
+        assert ai_tank.y == pytest.approx(expected.y, abs=1e-9)
+        assert ai_tank.angle == pytest.approx(expected.angle, abs=1e-9)
+    assert turned and moved
+    assert len(batched.state["projectiles"]) == len(single.state["projectiles"]) == 0
+
+
+def squad(count, first_id=2):
+    return [Tank(first_id + index, 0, 0, 0, 100, "red") for index in range(count)]
+
+
+def think_tick(scheduler, tanks, current_time, clock, cost):
+    # update_ai's loop over the due tanks, each decision taking ``cost``
+    # seconds on ``clock``; returns the ids decided
+    scheduler.cut = None
+    due = scheduler.due(tanks, current_time)
+    decided = []
+    for index, ai_tank in enumerate(due):
+        if index and not scheduler.may_continue(index):
+            scheduler.defer(due, index)
+            break
+        clock.advance(cost)
+        decided.append(ai_tank.id)
+    return decided
+
+
+def test_budget_cuts_a_tick_short():
+    clock = ManualClock(0.0)
+    scheduler = AIScheduler(budget=0.01, clock=clock)
+    # Started while under 10 ms: at 0, 3, 6 and 9 ms
+    assert think_tick(scheduler, squad(10), EPOCH, clock, 0.003) == [2, 3, 4, 5]
+    assert scheduler.cut == 4
+    assert scheduler.deferred == 6
+    assert scheduler.skipped == 0
+
+
+def test_first_due_tank_runs_however_slow():
+    clock = ManualClock(0.0)
+    scheduler = AIScheduler(budget=0.01, clock=clock)
+    assert think_tick(scheduler, squad(3), EPOCH, clock, 1.0) == [2]
+    assert scheduler.deferred == 2
+
+
+def test_deferred_tanks_go_first_next_tick():
+    clock = ManualClock(0.0)
+    scheduler = AIScheduler(budget=0.01, clock=clock)
+    tanks = squad(10)
+    ticks = [think_tick(scheduler, tanks, EPOCH, clock, 0.003) for _ in range(5)]
+    assert ticks == [
+        [2, 3, 4, 5],
+        [6, 7, 8, 9],
+        [10, 11, 2, 3],
+        [4, 5, 6, 7],
+        [8, 9, 10, 11],
+    ]
+    assert scheduler.deferred == 5 * 6
+    # Without a cut the next tick starts over from the first tank
+    scheduler.budget = None
+    assert think_tick(scheduler, tanks, EPOCH, clock, 0.003) == list(range(2, 12))
+    assert scheduler.cut is None
+
+
+def test_tanks_not_due_are_skipped():
+    clock = ManualClock(0.0)
+    scheduler = AIScheduler(clock=clock)
+    tanks = squad(4)
+    tanks[1].next_think = tanks[3].next_think = EPOCH + 0.25
+    assert think_tick(scheduler, tanks, EPOCH, clock, 0.003) == [2, 4]
+    assert think_tick(scheduler, tanks, EPOCH + 0.25, clock, 0.003) == [2, 3, 4, 5]
+    assert scheduler.skipped == 2
+    assert scheduler.deferred == 0
+
+
+def test_limit_replays_a_cut_whatever_the_time():
+    clock = ManualClock(0.0)
+    scheduler = AIScheduler(budget=0.01, clock=clock)
+    scheduler.limit = 3
+    assert think_tick(scheduler, squad(10), EPOCH, clock, 1.0) == [2, 3, 4]
+    assert scheduler.cut == 3
+
+
+def test_update_ai_defers_to_the_next_tick(monkeypatch):
+    room = GameRoom("test", EPOCH)
+    reset_game_state(room, seed=1)
+    clock = ManualClock(0.0)
+    scheduler = room.state["aiScheduler"] = AIScheduler(budget=0.01, clock=clock)
+    for _ in range(6):
+        add_entity(room, "tanks", squad(1, next_entity_id(room))[0])
+    decided = []
+
+    def think_slowly(room, ai_tank, player_tank, current_time):
+        # Every decision takes 4 ms
+        clock.advance(0.004)
+        decided.append(ai_tank.id)
+
+    monkeypatch.setattr(game, "update_ai_tank", think_slowly)
+    ids = [ai_tank.id for ai_tank in room.state["tanks"][1:]]
+    update_ai(room, room.clock.advance(1 / 30))
+    assert decided == ids[:3]
+    assert scheduler.cut == 3
+    # The three deferred, and by then the budget is spent again
+    update_ai(room, room.clock.advance(1 / 30))
+    assert decided == ids
+    assert scheduler.deferred == 6
+    update_ai(room, room.clock.advance(1 / 30))
+    assert decided == ids + ids[:3]
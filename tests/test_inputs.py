@@ -0,0 +1,23 @@
+import pytest
+
+from src.inputs import INPUT_FORWARD, MAX_ROTATE, input_frame
+
+
+@pytest.mark.parametrize("rotate", [float("nan"), float("inf"), float("-inf")])
+def test_non_finite_rotation_is_rejected(rotate):
+    assert input_frame({"id": 1, "rotate": rotate}) is None
+
+
+@pytest.mark.parametrize(
+    "rotate, expected",
+    [
+        (5, 5),
+        (-2.5, -2.5),
+        (1e300, MAX_ROTATE),
+        (-(10**400), -MAX_ROTATE),
+    ],
+)
+def test_rotation_is_clamped(rotate, expected):
+    frame = input_frame({"id": 1, "keys": INPUT_FORWARD, "rotate": rotate})
+    assert frame["rotate"] == expected
+    assert frame["keys"] == INPUT_FORWARD
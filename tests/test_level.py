@@ -0,0 +1,272 @@
+import json
+
+import numpy as np
+import pytest
+
+import os
+import pickle
+
+from src import level
+from src.game import level_settings
+from src.level import (
+    FlowField,
+    LevelPack,
+    campaign,
+    compile_pack,
+    load_level,
+    pack_is_stale,
+    write_pack,
+)
+
+# Six tiles by three, open only at the right end of the middle row
+CORRIDOR = ["......", "#####.", "......"]
+
+
+def write_levels(directory, maps, levels=None):
+    # Map files and a campaign playing the first map, in ``directory``
+    for name, level_data in maps.items():
+        (directory / f"{name}.json").write_text(json.dumps(level_data))
+    if levels is None:
+        levels = [
+            {
+                "map": next(iter(maps)),
+                "enemiesRequired": 1,
+                "maxEnemies": 1,
+                "spawnDelay": 5,
+                "aiSkill": 0.5,
+            }
+        ]
+    (directory / "campaign.json").write_text(json.dumps({"levels": levels}))
+    return str(directory)
+
+
+def tile_map(directory, tiles, spawn=(20, 20)):
+    level_dir = write_levels(directory, {"test": {"spawn": spawn, "tiles": tiles}})
+    return LevelPack(compile_pack(level_dir)).maps["test"]
+
+
+def distance(field, cell):
+    # Steps from ``cell`` to the goal along the field, each to a neighbour
+    steps = 0
+    while cell != field.goal:
+        assert field.next_cell[cell] in field.level.neighbours[cell]
+        cell = field.next_cell[cell]
+        steps += 1
+    return steps
+
+
+def test_pack_holds_the_maps_and_the_campaign(tmp_path):
+    maps = {
+        "corridor": {
+            "tileSize": 20,
+            "spawn": [10, 10],
+            "enemySpawns": [[0, 40, 119, 59]],
+            "tiles": CORRIDOR,
+        },
+        "open": {"tiles": ["...", "...", "..."]},
+    }
+    levels = [
+        {
+            "map": "open",
+            "enemiesRequired": 2,
+            "maxEnemies": 1,
+            "spawnDelay": 5,
+            "aiSkill": 0.5,
+        },
+        {
+            "map": "corridor",
+            "enemiesRequired": 4,
+            "maxEnemies": 3,
+            "spawnDelay": 2.5,
+            "aiSkill": 0.75,
+        },
+    ]
+    pack = LevelPack(compile_pack(write_levels(tmp_path, maps, levels)))
+
+    corridor = pack.maps["corridor"]
+    assert (corridor.width, corridor.height) == (120, 60)
+    assert corridor.record() == {
+        "name": "corridor",
+        "tileSize": 20,
+        "tiles": CORRIDOR,
+    }
+    assert corridor.spawn == (10, 10)
+    assert corridor.spawn_zones == [(0, 40, 119, 59)]
+    assert corridor.has_walls
+    assert corridor.open_cells.tolist() == [
+        0,
+        1,
+        2,
+        3,
+        4,
+        5,
+        11,
+        12,
+        13,
+        14,
+        15,
+        16,
+        17,
+    ]
+    # 40 pixel tiles and a spawn point at (100, 100) by default
+    open_map = pack.maps["open"]
+    assert (open_map.width, open_map.height, open_map.spawn) == (120, 120, (100, 100))
+    assert not open_map.has_walls
+    assert open_map.spawn_zones == []
+    assert pack.levels == {
+        1: {
+            "enemies_required": 2,
+            "max_enemies": 1,
+            "spawn_delay": 5,
+            "ai_skill": 0.5,
+            "map": "open",
+        },
+        2: {
+            "enemies_required": 4,
+            "max_enemies": 3,
+            "spawn_delay": 2.5,
+            "ai_skill": 0.75,
+            "map": "corridor",
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    "name, level_data",
+    [
+        ("Bad Name", {"tiles": ["..."]}),
+        ("ragged", {"tiles": ["...", ".."]}),
+        ("empty", {"tiles": []}),
+        ("water", {"tiles": [".~."]}),
+        ("walled_in", {"spawn": [20, 20], "tiles": ["#.", ".."]}),
+        ("off_map", {"spawn": [100, 10], "tiles": ["..", ".."]}),
+        (
+            "far_zone",
+            {"spawn": [20, 20], "enemySpawns": [[0, 0, 80, 10]], "tiles": [".."]},
+        ),
+    ],
+)
+def test_bad_maps_are_rejected(tmp_path, name, level_data):
+    with pytest.raises(ValueError):
+        compile_pack(write_levels(tmp_path, {name: level_data}))
+
+
+def test_campaign_must_play_known_maps(tmp_path):
+    maps = {"small": {"spawn": [20, 20], "tiles": [".."]}}
+    unknown = [
+        {
+            "map": "large",
+            "enemiesRequired": 1,
+            "maxEnemies": 1,
+            "spawnDelay": 5,
+            "aiSkill": 0.5,
+        }
+    ]
+    with pytest.raises(ValueError):
+        compile_pack(write_levels(tmp_path, maps, unknown))
+    with pytest.raises(ValueError):
+        compile_pack(write_levels(tmp_path, maps, []))
+
+
+def test_other_files_are_not_packs():
+    with pytest.raises(ValueError):
+        LevelPack(b"TK")
+    with pytest.raises(ValueError):
+        LevelPack(b"ZIP!" + bytes(64))
+
+
+def test_pack_is_rebuilt_when_a_source_changes(tmp_path):
+    level_dir = write_levels(tmp_path, {"small": {"spawn": [20, 20], "tiles": [".."]}})
+    path = os.path.join(level_dir, "levels.pack")
+    assert pack_is_stale(level_dir, path)
+    data = write_pack(level_dir, path)
+    with open(path, "rb") as file:
+        assert file.read() == data
+    assert not pack_is_stale(level_dir, path)
+    # Only the pack is left behind
+    assert sorted(os.listdir(level_dir)) == [
+        "campaign.json",
+        "levels.pack",
+        "small.json",
+    ]
+    later = os.path.getmtime(path) + 10
+    os.utime(os.path.join(level_dir, "small.json"), (later, later))
+    assert pack_is_stale(level_dir, path)
+
+
+def test_level_pickles_as_its_name():
+    trenches = load_level("trenches")
+    assert len(pickle.dumps(trenches)) < 100
+    assert pickle.loads(pickle.dumps(trenches)) is trenches
+
+
+def test_levels_past_the_last_play_like_it():
+    last = max(campaign())
+    assert level_settings(last + 1) == level_settings(last) == campaign()[last]
+    assert level_settings(1) == campaign()[1]
+
+
+def test_campaign_played_on_one_map(monkeypatch):
+    monkeypatch.setattr(level, "CAMPAIGN_MAP", "frontier")
+    levels = campaign()
+    assert [settings["map"] for settings in levels.values()] == ["frontier"] * 5
+    # Everything else is the campaign's own
+    own = level.level_pack().levels
+    assert levels[5] == dict(own[5], map="frontier")
+
+
+def test_campaign_map_must_exist(monkeypatch):
+    monkeypatch.setattr(level, "CAMPAIGN_MAP", "nowhere")
+    with pytest.raises(ValueError):
+        campaign()
+
+
+def test_flow_field_routes_around_walls(tmp_path):
+    corridor = tile_map(tmp_path, CORRIDOR)
+    field = FlowField(corridor, 0)
+    columns = corridor.columns
+    # Along the top row, then down the gap at the right and back along the
+    # bottom; no corners are cut past the walls
+    assert [distance(field, cell) for cell in range(columns)] == [0, 1, 2, 3, 4, 5]
+    assert distance(field, columns + 5) == 6
+    bottom = [distance(field, 2 * columns + column) for column in range(columns)]
+    assert bottom == [12, 11, 10, 9, 8, 7]
+
+
+def test_flow_field_marks_unreachable_tiles(tmp_path):
+    walled_off = tile_map(tmp_path, ["...#.", "...#."])
+    field = FlowField(walled_off, 0)
+    assert field.next_cell[4] == field.next_cell[9] == -1
+    assert distance(field, 7) == 2
+    # Tanks that cannot reach the goal head straight for it
+    assert field.waypoint(180, 20) is None
+    waypoint_x, waypoint_y = field.waypoints(np.array([180.0]), np.array([60.0]))
+    assert np.isnan(waypoint_x[0]) and np.isnan(waypoint_y[0])
+
+
+def test_waypoints_on_a_map_wider_than_high(tmp_path):
+    corridor = tile_map(tmp_path, CORRIDOR)
+    assert (corridor.width, corridor.height) == (240, 120)
+    field = FlowField(corridor, 0)
+    x = np.array([20.0, 20.0, 220.0, 220.0, 100.0, 500.0])
+    y = np.array([100.0, 20.0, 100.0, 60.0, 20.0, 100.0])
+    waypoint_x, waypoint_y = field.waypoints(x, y)
+    expected = [
+        # Bottom left: along the bottom row
+        (60.0, 100.0),
+        # On the goal, and on the top row, in plain sight of it
+        None,
+        # Bottom right: up through the gap
+        (220.0, 60.0),
+        # In the gap, with the wall between it and the goal
+        (220.0, 20.0),
+        None,
+        # Off the map, counted as the nearest tile
+        (220.0, 60.0),
+    ]
+    for index, waypoint in enumerate(expected):
+        assert field.waypoint(x[index], y[index]) == waypoint
+        if waypoint is None:
+            assert np.isnan(waypoint_x[index]) and np.isnan(waypoint_y[index])
+        else:
+            assert (waypoint_x[index], waypoint_y[index]) == waypoint
@@ -0,0 +1,104 @@
+import pickle
+
+from src.metrics import Registry
+
+
+def test_counters_and_gauges_render():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests.", "route")
+    rooms = registry.gauge("rooms", "Rooms held.")
+    requests.inc(label_value="/api/update")
+    requests.inc(2, "/api/update")
+    requests.inc(0.5, "/")
+    rooms.set(3)
+    rooms.set(4)
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{route="/"} 0.5\n'
+        'requests_total{route="/api/update"} 3\n'
+        "# HELP rooms Rooms held.\n"
+        "# TYPE rooms gauge\n"
+        "rooms 4\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    registry = Registry()
+    sizes = registry.histogram("size_bytes", "Sizes.", (10, 100))
+    for value in (5, 10, 11, 100, 1000):
+        sizes.observe(value)
+    assert registry.render().splitlines()[2:] == [
+        'size_bytes_bucket{le="10"} 2',
+        'size_bytes_bucket{le="100"} 4',
+        'size_bytes_bucket{le="+Inf"} 5',
+        "size_bytes_sum 1126",
+        "size_bytes_count 5",
+    ]
+
+
+def test_labelled_histogram():
+    registry = Registry()
+    seconds = registry.histogram("phase_seconds", "Phases.", (0.5,), "phase")
+    seconds.observe(0.25, "ai")
+    seconds.observe(1.0, "ai")
+    seconds.observe(0.5, "timers")
+    assert registry.render().splitlines()[2:] == [
+        'phase_seconds_bucket{phase="ai",le="0.5"} 1',
+        'phase_seconds_bucket{phase="ai",le="+Inf"} 2',
+        'phase_seconds_sum{phase="ai"} 1.25',
+        'phase_seconds_count{phase="ai"} 2',
+        'phase_seconds_bucket{phase="timers",le="0.5"} 1',
+        'phase_seconds_bucket{phase="timers",le="+Inf"} 1',
+        'phase_seconds_sum{phase="timers"} 0.5',
+        'phase_seconds_count{phase="timers"} 1',
+    ]
+
+
+def registry_with_values(ticks, rooms, sizes):
+    registry = Registry()
+    registry.counter("ticks_total", "Ticks.").inc(ticks)
+    registry.gauge("rooms", "Rooms.", "state").set(rooms, "running")
+    size = registry.histogram("size_bytes", "Sizes.", (10,))
+    for value in sizes:
+        size.observe(value)
+    return registry
+
+
+def test_worker_snapshots_are_summed_into_the_front():
+    front = registry_with_values(0, 0, [])
+    workers = [registry_with_values(5, 2, [1, 20]), registry_with_values(7, 1, [3])]
+    # As sent over the worker pipes
+    snapshots = [pickle.loads(pickle.dumps(worker.snapshot())) for worker in workers]
+    assert front.render(snapshots).splitlines() == [
+        "# HELP ticks_total Ticks.",
+        "# TYPE ticks_total counter",
+        "ticks_total 12",
+        "# HELP rooms Rooms.",
+        "# TYPE rooms gauge",
+        'rooms{state="running"} 3',
+        "# HELP size_bytes Sizes.",
+        "# TYPE size_bytes histogram",
+        'size_bytes_bucket{le="10"} 2',
+        'size_bytes_bucket{le="+Inf"} 3',
+        "size_bytes_sum 24",
+        "size_bytes_count 3",
+    ]
+    # Rendering leaves every registry's own values alone
+    assert front.metrics["ticks_total"].values == {None: 0}
+    assert workers[0].metrics["size_bytes"].values == {None: [1, 1, 21]}
+
+
+def test_snapshot_is_a_copy():
+    registry = registry_with_values(1, 1, [1])
+    snapshot = registry.snapshot()
+    registry.metrics["size_bytes"].observe(50)
+    assert snapshot["size_bytes"] == {None: [1, 0, 1]}
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("errors_total", "Errors.", "route").inc(1, 'a"b\\c\nd')
+    assert registry.render().splitlines()[-1] == (
+        'errors_total{route="a\\"b\\\\c\\nd"} 1'
+    )
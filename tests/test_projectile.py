@@ -0,0 +1,250 @@
+import math
+import random
+
+import pytest
+
+from src import game
+from src.game import (
+    add_entity,
+    check_game_over,
+    check_level_completion,
+    find_player,
+    next_entity_id,
+    reset_game_state,
+    update_projectiles,
+)
+from src.projectile import HIT_RADIUS, ProjectileBuffer
+from src.room import GameRoom
+from src.tank import PLAYER_ID, Tank
+
+EPOCH = 1000.0
+TICK = 1 / 30
+
+
+def reference_projectiles(room, projectiles, elapsed):
+    """The list-of-dicts loop the projectile arrays replaced.
+
+    Projectiles move one by one and are tested against every tank in turn,
+    along the whole step as the arrays have done since; hits are then
+    applied in the order they happen along the step. Returns the
+    projectiles still flying.
+    """
+    game_state = room.state
+    if not game_state["gameActive"]:
+        return projectiles
+
+    contacts = []
+    for index, projectile in enumerate(projectiles):
+        start_x, start_y = projectile["x"], projectile["y"]
+        projectile["x"] += projectile["velocity_x"] * elapsed * 30
+        projectile["y"] += projectile["velocity_y"] * elapsed * 30
+        for column, tank in enumerate(game_state["tanks"]):
+            if tank.id == projectile["owner"]:
+                continue
+            entry = entry_time(
+                start_x, start_y, projectile["x"], projectile["y"], tank.x, tank.y
+            )
+            if entry is not None:
+                contacts.append((entry, index, column))
+
+    tanks = game_state["tanks"]
+    hit = set()
+    for _, index, column in sorted(contacts):
+        projectile = projectiles[index]
+        tank = tanks[column]
+        if index in hit or tank.health <= 0:
+            continue
+        if game_state["entities"].get(tank.id) is not tank:
+            continue
+        tank.health -= projectile["damage"]
+        if tank.health <= 0:
+            tank.health = 0
+            if tank.id != PLAYER_ID and projectile["owner"] == PLAYER_ID:
+                game_state["enemiesDefeated"] += 1
+                check_level_completion(room)
+            if tank.id == PLAYER_ID:
+                check_game_over(room)
+        hit.add(index)
+
+    map_width = game_state["mapWidth"]
+    map_height = game_state["mapHeight"]
+    return [
+        projectile
+        for index, projectile in enumerate(projectiles)
+        if index not in hit
+        and 0 <= projectile["x"] <= map_width
+        and 0 <= projectile["y"] <= map_height
+    ]
+
+
+def entry_time(start_x, start_y, end_x, end_y, x, y):
+    # Fraction of the step at which the path enters the tank's circle
+    if (start_x - x) ** 2 + (start_y - y) ** 2 < HIT_RADIUS**2:
+        return 0.0
+    dx = end_x - start_x
+    dy = end_y - start_y
+    length = dx * dx + dy * dy
+    if length == 0:
+        return None
+    along = ((x - start_x) * dx + (y - start_y) * dy) / length
+    miss = (start_x + along * dx - x) ** 2 + (start_y + along * dy - y) ** 2
+    if miss >= HIT_RADIUS**2:
+        return None
+    entry = along - math.sqrt((HIT_RADIUS**2 - miss) / length)
+    return entry if 0 <= entry <= 1 else None
+
+
+def play(seed, reference, ticks=120):
+    # A seeded melee: enemies keep arriving, and the player and the enemies
+    # fire at random, some projectiles fast enough to cross a tank in one
+    # tick
+    rng = random.Random(seed)
+    room = GameRoom("test", EPOCH)
+    reset_game_state(room, seed=seed)
+    player = find_player(room)
+    player.x, player.y = 400, 300
+    flying = []
+    for _ in range(ticks):
+        now = room.clock.advance(TICK)
+        state = room.state
+        enemies = [tank for tank in state["tanks"] if tank.id != PLAYER_ID]
+        while len(enemies) < 6:
+            enemy = Tank(
+                next_entity_id(room),
+                rng.uniform(0, 800),
+                rng.uniform(0, 600),
+                0,
+                rng.choice([20, 50, 100]),
+                "red",
+            )
+            add_entity(room, "tanks", enemy)
+            enemies.append(enemy)
+        for _ in range(rng.randint(0, 4)):
+            owner = PLAYER_ID if rng.random() < 0.7 else rng.choice(enemies).id
+            angle = rng.uniform(0, 360)
+            speed = rng.choice([10, 30, 60, 120])
+            projectile = {
+                "id": next_entity_id(room),
+                "x": rng.uniform(0, 800),
+                "y": rng.uniform(0, 600),
+                "velocity_x": speed * math.sin(math.radians(angle)),
+                "velocity_y": -speed * math.cos(math.radians(angle)),
+                "damage": rng.choice([10, 25, 40]),
+                "owner": owner,
+            }
+            if reference:
+                flying.append(projectile)
+            else:
+                state["projectiles"].spawn(
+                    projectile["id"],
+                    projectile["x"],
+                    projectile["y"],
+                    angle,
+                    owner,
+                    projectile["velocity_x"],
+                    projectile["velocity_y"],
+                    projectile["damage"],
+                    "red",
+                    now,
+                )
+        if reference:
+            flying = reference_projectiles(room, flying, TICK)
+        else:
+            update_projectiles(room, TICK)
+
+    state = room.state
+    if not reference:
+        flying = [
+            {"id": projectile.id, "x": projectile.x, "y": projectile.y}
+            for projectile in state["projectiles"]
+        ]
+    return {
+        "tanks": [(tank.id, tank.x, tank.y, tank.health) for tank in state["tanks"]],
+        "projectiles": [(p["id"], p["x"], p["y"]) for p in flying],
+        "enemiesDefeated": state["enemiesDefeated"],
+        "currentLevel": state["currentLevel"],
+        "gameOver": state["gameOver"],
+        "winner": state["winner"],
+    }
+
+
+@pytest.fixture
+def open_campaign(monkeypatch):
+    # Every level on the open map: walls would stop projectiles, which the
+    # reference loop leaves out
+    monkeypatch.setattr(
+        game,
+        "LEVEL_CONFIG",
+        {
+            number: dict(settings, map="open")
+            for number, settings in game.LEVEL_CONFIG.items()
+        },
+    )
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_arrays_play_like_the_dict_loop(open_campaign, seed):
+    result = play(seed, reference=False)
+    expected = play(seed, reference=True)
+    assert result["tanks"] == expected["tanks"]
+    assert result["projectiles"] == expected["projectiles"]
+    for key in ("enemiesDefeated", "currentLevel", "gameOver", "winner"):
+        assert result[key] == expected[key]
+    # The seeds see hits, kills and level changes
+    assert result["currentLevel"] > 1 or result["gameOver"]
+
+
+def sweep(start, velocity, tanks, owner=PLAYER_ID):
+    # Contacts of one projectile over one tick against tanks at (x, y),
+    # numbered from 2
+    projectiles = ProjectileBuffer()
+    projectiles.spawn(1, *start, 0, owner, *velocity, 10, "red", EPOCH)
+    start_x, start_y = projectiles.advance(TICK)
+    return projectiles.contacts(
+        start_x,
+        start_y,
+        list(range(2, len(tanks) + 2)),
+        [x for x, _ in tanks],
+        [y for _, y in tanks],
+    )
+
+
+def test_fast_projectile_hits_a_tank_it_passes_through():
+    # 200 px in one tick, from well before the tank to well past it
+    assert sweep((100, 300), (200, 0), [(200, 300)]) == [(0, 0)]
+
+
+def test_projectile_grazing_a_tank_misses():
+    # The path passes just outside the hit radius, and just inside it
+    assert sweep((100, 300), (200, 0), [(200, 300 + HIT_RADIUS + 0.01)]) == []
+    assert sweep((100, 300), (200, 0), [(200, 300 + HIT_RADIUS - 0.01)]) == [(0, 0)]
+
+
+def test_projectile_stopping_short_of_a_tank_misses():
+    assert sweep((100, 300), (50, 0), [(200, 300)]) == []
+
+
+def test_owner_is_never_hit():
+    assert sweep((100, 300), (200, 0), [(200, 300)], owner=2) == []
+
+
+def test_first_tank_on_the_path_is_hit_first():
+    # Listed farthest first; contacts come in the order they happen
+    tanks = [(280, 300), (160, 300), (220, 310)]
+    assert sweep((100, 300), (200, 0), tanks) == [(0, 1), (0, 2), (0, 0)]
+
+    room = GameRoom("test", EPOCH)
+    reset_game_state(room, seed=1)
+    player = find_player(room)
+    player.x, player.y = 100, 500
+    enemies = []
+    for x, y in tanks:
+        enemy = Tank(next_entity_id(room), x, y, 0, 100, "red")
+        add_entity(room, "tanks", enemy)
+        enemies.append(enemy)
+    room.state["projectiles"].spawn(
+        next_entity_id(room), 100, 300, 90, PLAYER_ID, 200, 0, 25, "red", EPOCH
+    )
+    update_projectiles(room, TICK)
+    assert [enemy.health for enemy in enemies] == [100, 75, 100]
+    assert len(room.state["projectiles"]) == 0
@@ -0,0 +1,156 @@
+import random
+
+import pytest
+
+from src import game
+from src.game import reset_game_state, step_world
+from src.inputs import INPUT_FORWARD, INPUT_LEFT, INPUT_MASK
+from src.replay import (
+    HEADER,
+    RECORDING_MAGIC,
+    MatchRecorder,
+    decode_input,
+    encode_input,
+    read_recording,
+    replay,
+    state_digest,
+)
+from src.room import GameRoom
+from src.tank import PLAYER_ID
+from src.timers import ManualClock
+
+EPOCH = 1000.0
+TICK = 1 / 30
+
+
+def frames(rng, seq):
+    # Whatever a player might send in one tick
+    for _ in range(rng.randint(0, 2)):
+        seq += 1
+        yield {
+            "id": PLAYER_ID,
+            "seq": seq,
+            "keys": rng.randint(0, INPUT_MASK),
+            "rotate": rng.choice([0, 5, -5, 2.5]),
+            "fire": rng.random() < 0.3,
+        }
+
+
+def play(seed, ticks=300, path=None, ai_budget=None):
+    # Play a match on its own clock the way the tick loop does, recording it
+    # to ``path``; returns the room
+    room = GameRoom("test", EPOCH)
+    reset_game_state(room, seed, ai_budget)
+    room.snapshots.capture(room.state)
+    recorder = None
+    if path is not None:
+        recorder = MatchRecorder.start(path, seed, EPOCH, TICK)
+    rng = random.Random(seed)
+    scheduler = room.state["aiScheduler"]
+    seq = 0
+    for _ in range(ticks):
+        for frame in frames(rng, seq):
+            room.state["inputQueue"].append(frame)
+            seq = frame["seq"]
+        # Ticks land a little late now and then, as on a busy server
+        now = room.clock() + TICK + rng.choice([0, 0, 0, 0.004])
+        if recorder is not None:
+            recorder.tick(now, room.state["inputQueue"])
+        room.clock.now = now
+        step_world(room, now, TICK)
+        if recorder is not None and scheduler.cut is not None:
+            recorder.ai_limit(scheduler.cut)
+        room.snapshots.capture(room.state)
+    if recorder is not None:
+        recorder.close(room.state)
+    return room
+
+
+def test_a_seed_and_the_same_inputs_make_the_same_match():
+    first = play(7)
+    assert state_digest(first.state) == state_digest(play(7).state)
+    assert state_digest(first.state) != state_digest(play(8).state)
+    # Enemies came in and moved, so the seed was used
+    assert len(first.state["tanks"]) > 1
+
+
+def test_replay_matches_the_recording(tmp_path):
+    path = str(tmp_path / "match.match")
+    recorded = play(11, path=path)
+    room, result = replay(path)
+    assert result["matched"] is True
+    assert result["ticks"] == 300
+    assert result["seed"] == 11
+    assert state_digest(room.state) == state_digest(recorded.state)
+
+
+def test_replay_reproduces_ai_budget_cuts(monkeypatch, tmp_path):
+    # With next to no budget, ticks are cut after the first AI tank, at
+    # wall-clock whims the replay cannot repeat but reads from the recording
+    monkeypatch.setattr(
+        game,
+        "LEVEL_CONFIG",
+        {
+            number: dict(settings, max_enemies=6, spawn_delay=0.5)
+            for number, settings in game.LEVEL_CONFIG.items()
+        },
+    )
+    path = str(tmp_path / "match.match")
+    play(12, ticks=400, path=path, ai_budget=1e-9)
+    _, result = replay(path)
+    assert result["ai_deferred"] > 0
+    assert result["matched"] is True
+
+
+def test_unfinished_recording_replays_up_to_its_end(tmp_path):
+    path = tmp_path / "match.match"
+    play(13, path=str(path))
+    data = path.read_bytes()
+    # Without the digest, and cut off within a record
+    path.write_bytes(data[: -33 - 4])
+    room, result = replay(str(path))
+    assert result["matched"] is None
+    assert result["ticks"] == 299
+
+
+def test_tampered_recording_does_not_match(tmp_path):
+    path = tmp_path / "match.match"
+    play(14, path=str(path))
+    data = bytearray(path.read_bytes())
+    # Move the last tick, right before the digest, to another time
+    data[-33 - 8 : -33] = bytes(8)
+    path.write_bytes(bytes(data))
+    _, result = replay(str(path))
+    assert result["matched"] is False
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [
+        {"id": 1, "seq": 9, "keys": INPUT_FORWARD, "rotate": 5, "fire": True},
+        {"id": 1, "seq": None, "keys": INPUT_LEFT, "rotate": -2.5, "fire": False},
+        {"id": 1, "seq": 2**63 - 1, "keys": 0, "rotate": -(2**63), "fire": False},
+    ],
+)
+def test_input_frames_round_trip(frame):
+    decoded = decode_input(encode_input(frame), 1)
+    assert decoded == frame
+    assert type(decoded["rotate"]) is type(frame["rotate"])
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "match.match"
+    path.write_bytes(b"not a recording at all, really")
+    with pytest.raises(ValueError):
+        read_recording(str(path))
+    path.write_bytes(HEADER.pack(RECORDING_MAGIC, 1, 0, EPOCH, TICK))
+    with pytest.raises(ValueError):
+        read_recording(str(path))
+
+
+def test_manual_clock_moves_only_when_told():
+    clock = ManualClock(EPOCH)
+    assert clock() == EPOCH
+    assert clock.advance(0.5) == EPOCH + 0.5
+    clock.now = 2000.0
+    assert clock() == 2000.0
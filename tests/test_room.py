@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+
+from src.game import reset_game_state, step_world
+from src.room import GameRoom, RoomLimitError, RoomRegistry
+
+EPOCH = 1000.0
+TICK = 1 / 30
+
+
+def started(registry, room_id):
+    room = registry.join(room_id, EPOCH)
+    reset_game_state(room, seed=1)
+    registry.mark_running(room)
+    return room
+
+
+def test_commands_wait_in_order_for_the_tick_loop():
+    registry = RoomRegistry()
+    idle = registry.join("idle", EPOCH)
+    registry.post(idle, ("input", (1,), None))
+    registry.post(idle, ("input", (2,), None))
+    assert list(idle.commands) == [("input", (1,), None), ("input", (2,), None)]
+    # Visited once for its commands, then left alone
+    assert registry.busy_rooms() == [idle]
+    assert registry.busy_rooms() == []
+
+
+def test_busy_rooms_are_running_ones_then_those_with_commands():
+    registry = RoomRegistry()
+    running = started(registry, "running")
+    waiting = registry.join("waiting", EPOCH)
+    registry.join("quiet", EPOCH)
+    registry.post(waiting, ("start", (), None))
+    # Running rooms are listed once, whether or not they have commands
+    registry.post(running, ("input", (), None))
+    assert registry.busy_rooms() == [running, waiting]
+    assert registry.busy_rooms() == [running]
+
+    # Ended matches leave the tick set; removed rooms are not visited
+    running.state["gameActive"] = False
+    registry.post(waiting, ("start", (), None))
+    registry.remove("waiting")
+    assert registry.busy_rooms() == []
+    assert registry.running == set()
+
+
+def test_reads_never_open_rooms():
+    registry = RoomRegistry(max_rooms=2)
+    assert registry.visit("nowhere", EPOCH) is None
+    first = registry.join("first", EPOCH)
+    assert registry.join("first", EPOCH + 1) is first
+    assert registry.visit("first", EPOCH + 2) is first
+    assert first.last_seen == EPOCH + 2
+    registry.join("second", EPOCH)
+    with pytest.raises(RoomLimitError):
+        registry.join("third", EPOCH)
+    assert len(registry) == 2
+
+
+def test_idle_rooms_expire():
+    registry = RoomRegistry(idle_timeout=10)
+    started(registry, "old")
+    registry.join("recent", EPOCH + 5)
+    assert registry.expire(EPOCH + 12) == ["old"]
+    assert registry.get("old") is None
+    assert registry.running == set()
+    assert registry.get("recent") is not None
+
+
+def new_match():
+    room = GameRoom("test", EPOCH)
+    reset_game_state(room, seed=3)
+    room.snapshots.capture(room.state)
+    return room
+
+
+def play(room, ticks, on_tick=None):
+    # Step and publish the way the tick loop does
+    for _ in range(ticks):
+        now = room.clock.advance(TICK)
+        step_world(room, now, TICK)
+        room.snapshots.capture(room.state)
+        if on_tick is not None:
+            on_tick(room)
+
+
+def frames(snapshot):
+    # Both encodings of the delta from the snapshot before
+    return snapshot.delta(snapshot.seq - 1), snapshot.delta_bytes(snapshot.seq - 1)
+
+
+def test_readers_see_published_snapshots_while_the_writer_ticks():
+    # Frames read from each snapshot as soon as it is published, in a match
+    # played alone
+    expected = {}
+
+    def read(room):
+        expected[room.snapshots.latest.seq] = frames(room.snapshots.latest)
+
+    alone = new_match()
+    read(alone)
+    play(alone, 300, read)
+
+    # The same match, read by other threads while it is played
+    room = new_match()
+    done = threading.Event()
+    seen = []
+
+    def reader():
+        while not done.is_set():
+            snapshot = room.snapshots.latest
+            seen.append((snapshot.seq, frames(snapshot)))
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    play(room, 300)
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert len({seq for seq, _ in seen}) > 1
+    for seq, read_frames in seen:
+        assert read_frames == expected[seq]
@@ -0,0 +1,157 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from src import shard
+from src.shard import ShardPool, WorkerError, WorkerHandle
+
+
+def handle():
+    parent, child = multiprocessing.Pipe()
+    return WorkerHandle(0, None, parent), child
+
+
+def test_call_times_out(monkeypatch):
+    monkeypatch.setattr(shard, "CALL_TIMEOUT", 0.1)
+    worker, _ = handle()
+    with pytest.raises(WorkerError):
+        worker.call("load")
+    assert worker.pending == {}
+
+
+def test_calls_fail_when_the_worker_exits():
+    worker, child = handle()
+    errors = []
+
+    def call():
+        try:
+            worker.call("load")
+        except WorkerError as error:
+            errors.append(error)
+
+    caller = threading.Thread(target=call)
+    caller.start()
+    # Received, never answered
+    assert child.recv()[1] == "load"
+    child.close()
+    caller.join(5)
+    assert len(errors) == 1
+    with pytest.raises(WorkerError):
+        worker.call("load")
+    with pytest.raises(WorkerError):
+        worker.cast("input")
+
+
+class FakeWorker:
+    # Answers calls in process from a set of rooms it holds
+    def __init__(self, index, rooms=(), alive=()):
+        self.index = index
+        self.rooms = set(rooms)
+        # What its last load report said, however stale
+        self.alive = list(alive)
+
+    def call(self, op, *args):
+        if op == "load":
+            return {"busy": 0.0, "rooms": [], "alive": self.alive}
+        if op == "gone":
+            return [room_id for room_id in args[0] if room_id not in self.rooms]
+        if op == "open":
+            self.rooms.add(args[0])
+
+    def request(self, op, *args):
+        return self.call(op, *args)
+
+    def reply(self, request):
+        return request
+
+
+def test_rebalance_forgets_only_rooms_gone_from_their_worker():
+    pool = ShardPool(2, None)
+    pool.workers = [FakeWorker(0, alive=["kept"]), FakeWorker(1, alive=["kept"])]
+    pool.owners = {"kept": 0, "expired": 0, "opened": 1}
+    pool.workers[0].rooms = {"kept"}
+    # Opened since its worker reported its load
+    pool.workers[1].rooms = {"opened"}
+    assert pool.rebalance() == []
+    assert pool.owners == {"kept": 0, "opened": 1}
+    # Routed and sent to the worker with the fewest rooms
+    pool.call("new", "open")
+    assert pool.owners["new"] == 0
+    assert "new" in pool.workers[0].rooms
+
+
+# Operations of the worker started under eventlet below: like the game's, the
+# worker monkey patches itself on boot and runs a green thread of its own
+green_ticks = [0]
+
+
+def green_boot():
+    import eventlet
+
+    eventlet.monkey_patch()
+
+    def tick():
+        while True:
+            green_ticks[0] += 1
+            eventlet.sleep(0.01)
+
+    eventlet.spawn(tick)
+
+
+GREEN_OPS = {
+    "boot": green_boot,
+    "echo": lambda data: data,
+    "ticks": lambda: green_ticks[0],
+    "sleep": lambda seconds: time.sleep(seconds),
+}
+
+
+def test_pool_under_eventlet():
+    pytest.importorskip("eventlet")
+    script = textwrap.dedent("""
+        import eventlet
+
+        eventlet.monkey_patch()
+
+        from src.shard import ShardPool
+
+        ticks = [0]
+
+        def tick():
+            while True:
+                ticks[0] += 1
+                eventlet.sleep(0.01)
+
+        eventlet.spawn(tick)
+        pool = ShardPool(1, "test_shard:GREEN_OPS")
+        pool.start()
+        worker = pool.workers[0]
+        # Larger than the pipe's buffer, so sent and read in several parts
+        data = bytes(range(256)) * 8192
+        assert worker.call("echo", data) == data
+        first = worker.call("ticks")
+        # The front's green threads run while it waits on the worker, and
+        # the worker's while it waits on the front
+        before = ticks[0]
+        worker.call("sleep", 0.3)
+        assert ticks[0] - before >= 10, ticks[0] - before
+        eventlet.sleep(0.3)
+        assert worker.call("ticks") - first >= 10
+        print("ok")
+        """)
+    tests = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(tests),
+        env=dict(os.environ, PYTHONPATH=tests),
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.stdout.strip() == "ok", result.stderr
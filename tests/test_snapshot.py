@@ -0,0 +1,259 @@
+import pickle
+import random
+
+from src.snapshot import (
+    ENTITY_TYPES,
+    MAX_VIEWPORTS,
+    PUBLIC_FIELDS,
+    SnapshotHistory,
+    parse_viewport,
+)
+from src.tank import PLAYER_ID
+
+MAP_WIDTH = 2400
+MAP_HEIGHT = 1800
+VIEWPORT = (800, 600)
+
+
+class Entity:
+    def __init__(self, entity_id, x, y, **fields):
+        self.fields = dict(fields, id=entity_id, x=x, y=y)
+
+    def record(self):
+        return dict(self.fields)
+
+
+class World:
+    """A room's state as SnapshotHistory.capture() reads it."""
+
+    def __init__(self, width=MAP_WIDTH, height=MAP_HEIGHT):
+        self.state = {key: None for key in PUBLIC_FIELDS}
+        self.state.update(mapWidth=width, mapHeight=height, inputSeq={})
+        for entity_type in ENTITY_TYPES:
+            self.state[entity_type] = []
+        self.player = self.add("tanks", PLAYER_ID, width / 2, height / 2)
+        self.history = SnapshotHistory()
+
+    def add(self, entity_type, entity_id, x, y, **fields):
+        entity = Entity(entity_id, x, y, **fields)
+        self.state[entity_type].append(entity)
+        return entity
+
+    def remove(self, entity_type, entity):
+        self.state[entity_type].remove(entity)
+
+    def capture(self):
+        self.history.capture(self.state)
+        return self.history.latest
+
+    def expected(self, snapshot, viewport=None):
+        # What a client with ``viewport`` should hold after ``snapshot``
+        area = None if viewport is None else snapshot.area(viewport)
+        held = {}
+        for entity_type, entities in snapshot.entities.items():
+            for entity_id, (record, _) in entities.items():
+                if area is None or (
+                    area[0] <= record["x"] <= area[2]
+                    and area[1] <= record["y"] <= area[3]
+                ):
+                    held[entity_type, entity_id] = record
+        return held
+
+
+class Client:
+    """Applies messages the way static/js/client.js does."""
+
+    def __init__(self):
+        self.held = {}
+        self.applied = None
+
+    def apply(self, message):
+        if message["keyframe"]:
+            self.held = {}
+        else:
+            # The client drops deltas against a base it has not reached
+            assert self.applied is not None and message["base"] <= self.applied
+            for entity_type, ids in message["removed"].items():
+                for entity_id in ids:
+                    self.held.pop((entity_type, entity_id), None)
+        for entity_type in ENTITY_TYPES:
+            for record in message[entity_type]:
+                self.held[entity_type, record["id"]] = record
+        self.applied = message["seq"]
+
+
+def test_deltas_against_a_lagging_ack():
+    world = World()
+    shell = world.add("projectiles", 100, 10, 10)
+    barrel = world.add("rewards", 101, 20, 20)
+    client = Client()
+    snapshot = world.capture()
+    client.apply(snapshot.delta())
+    ack = snapshot.seq
+
+    # Every delta is against the first sequence; the client applies each
+    steps = (
+        lambda: shell.fields.update(x=30),
+        lambda: world.add("rewards", 102, 40, 40),
+        lambda: world.remove("rewards", barrel),
+        lambda: shell.fields.update(x=50),
+        lambda: None,
+    )
+    for step in steps:
+        step()
+        snapshot = world.capture()
+        message = snapshot.delta(ack)
+        assert message["base"] == ack
+        client.apply(message)
+        assert client.held == world.expected(snapshot)
+    assert ("rewards", 101) not in client.held
+    assert client.held["projectiles", 100]["x"] == 50
+
+
+def test_too_old_an_ack_gets_a_keyframe():
+    world = World()
+    snapshot = world.capture()
+    ack = snapshot.seq
+    for _ in range(world.history.max_gap + 1):
+        snapshot = world.capture()
+    assert snapshot.delta(ack)["keyframe"]
+    assert snapshot.delta(snapshot.seq + 1)["keyframe"]
+
+
+def test_static_entity_reenters_view_while_acks_lag():
+    world = World()
+    barrel = world.add("rewards", 100, MAP_WIDTH / 2 + 50, MAP_HEIGHT / 2)
+    client = Client()
+    snapshot = world.capture()
+    client.apply(snapshot.delta(None, VIEWPORT))
+    ack = snapshot.seq
+    assert ("rewards", 100) in client.held
+
+    # The player drives off and comes back; the barrel never changes and the
+    # client's acks stay at the first frame while messages keep coming
+    for x in (600, 150, 150, MAP_WIDTH / 2, MAP_WIDTH / 2):
+        world.player.fields["x"] = x
+        snapshot = world.capture()
+        client.apply(snapshot.delta(ack, VIEWPORT))
+        assert client.held == world.expected(snapshot, VIEWPORT)
+    assert client.held["rewards", 100] == barrel.record()
+
+
+def test_entity_out_of_view_at_the_ack_only():
+    world = World()
+    world.add("rewards", 100, MAP_WIDTH / 2 + 50, MAP_HEIGHT / 2)
+    client = Client()
+    world.player.fields["x"] = 150
+    snapshot = world.capture()
+    client.apply(snapshot.delta(None, VIEWPORT))
+    ack = snapshot.seq
+    assert ("rewards", 100) not in client.held
+
+    # In view in the next message, out of view in the one after
+    for x in (MAP_WIDTH / 2, 150):
+        world.player.fields["x"] = x
+        snapshot = world.capture()
+        client.apply(snapshot.delta(ack, VIEWPORT))
+        assert client.held == world.expected(snapshot, VIEWPORT)
+
+
+def test_whole_map_in_view_between_acks():
+    # A small map fits the view, until the player is dropped on a large one
+    world = World(width=600, height=400)
+    client = Client()
+    world.add("rewards", 100, 590, 390)
+    snapshot = world.capture()
+    client.apply(snapshot.delta(None, VIEWPORT))
+    ack = snapshot.seq
+
+    for width, height, x in ((2400, 1800, 1800), (600, 400, 300), (2400, 1800, 300)):
+        world.state.update(mapWidth=width, mapHeight=height)
+        world.player.fields["x"] = x
+        snapshot = world.capture()
+        client.apply(snapshot.delta(ack, VIEWPORT))
+        assert client.held == world.expected(snapshot, VIEWPORT)
+
+
+def test_random_play_with_lagging_and_lost_messages():
+    rng = random.Random(7)
+    world = World()
+    entities = []
+    next_id = PLAYER_ID + 1
+    # More viewports than are remembered, so some get forgotten as well
+    viewports = [VIEWPORT, VIEWPORT, VIEWPORT, (400, 300), None, None]
+    viewports += [(1000 + 200 * index, 800) for index in range(MAX_VIEWPORTS)]
+    clients = [Client() for _ in viewports]
+    acks = [None] * len(clients)
+
+    for _ in range(400):
+        # Add, move and remove entities, and move the player around
+        for _ in range(rng.randrange(3)):
+            entity_type = rng.choice(("projectiles", "rewards"))
+            x, y = rng.uniform(0, MAP_WIDTH), rng.uniform(0, MAP_HEIGHT)
+            entities.append((entity_type, world.add(entity_type, next_id, x, y)))
+            next_id += 1
+        for entity_type, entity in rng.sample(entities, min(len(entities), 3)):
+            entity.fields["x"] = rng.uniform(0, MAP_WIDTH)
+        if entities and rng.random() < 0.3:
+            entity_type, entity = entities.pop(rng.randrange(len(entities)))
+            world.remove(entity_type, entity)
+        world.player.fields["x"] = rng.uniform(0, MAP_WIDTH)
+        world.player.fields["y"] = rng.uniform(0, MAP_HEIGHT)
+        snapshot = world.capture()
+
+        for index, client in enumerate(clients):
+            if rng.random() < 0.2:
+                # Lost, or not sent this tick
+                continue
+            message = snapshot.delta(acks[index], viewports[index])
+            client.apply(message)
+            assert client.held == world.expected(snapshot, viewports[index])
+            # Acks arrive late and only now and then
+            if rng.random() < 0.25:
+                acks[index] = client.applied
+
+
+def test_viewports_are_rounded_up():
+    assert parse_viewport("800x600") == (800, 600)
+    assert parse_viewport("801x599") == (1000, 600)
+    assert parse_viewport("1x4096") == (200, 4200)
+    for text in ("0x600", "800x4097", "800", "axb", None):
+        assert parse_viewport(text) is None
+
+
+def test_views_are_bounded_and_forgotten_viewports_get_keyframes():
+    world = World()
+    world.add("rewards", 100, MAP_WIDTH / 2 + 50, MAP_HEIGHT / 2)
+    client = Client()
+    snapshot = world.capture()
+    client.apply(snapshot.delta(None, VIEWPORT))
+    ack = snapshot.seq
+
+    # Many other viewport sizes push the client's out
+    for width in range(MAX_VIEWPORTS * 2):
+        snapshot.delta(None, (1000 + 200 * width, 1000))
+    assert len(world.history.views) == MAX_VIEWPORTS
+    assert VIEWPORT not in world.history.views
+
+    snapshot = world.capture()
+    message = snapshot.delta(ack, VIEWPORT)
+    assert message["keyframe"]
+    client.apply(message)
+    assert client.held == world.expected(snapshot, VIEWPORT)
+
+
+def test_history_survives_pickling():
+    # Rooms move between worker processes as pickles
+    world = World()
+    world.add("rewards", 100, MAP_WIDTH / 2 + 50, MAP_HEIGHT / 2)
+    client = Client()
+    snapshot = world.capture()
+    client.apply(snapshot.delta(None, VIEWPORT))
+    ack = snapshot.seq
+
+    world.history = pickle.loads(pickle.dumps(world.history))
+    assert world.history.views_lock is world.history.latest.views_lock
+    world.player.fields["x"] = 150
+    snapshot = world.capture()
+    client.apply(snapshot.delta(ack, VIEWPORT))
+    assert client.held == world.expected(snapshot, VIEWPORT)
@@ -0,0 +1,103 @@
+import math
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.spatial import CELL_SIZE, SpatialHash, grid_pairs
+
+
+def scatter(count, seed, low=-300, high=900):
+    rng = random.Random(seed)
+    return [
+        SimpleNamespace(
+            id=entity_id, x=rng.uniform(low, high), y=rng.uniform(low, high)
+        )
+        for entity_id in range(1, count + 1)
+    ]
+
+
+def distance(entity, x, y):
+    # As the scans of the state lists measure it
+    dx = entity.x - x
+    dy = entity.y - y
+    return math.sqrt(dx * dx + dy * dy)
+
+
+def within(entities, x, y, radius):
+    return [entity for entity in entities if distance(entity, x, y) <= radius]
+
+
+@pytest.mark.parametrize("radius", [10, 64, 150, 2000])
+def test_nearby_holds_everything_in_range_in_id_order(radius):
+    entities = scatter(300, 1)
+    index = SpatialHash()
+    index.rebuild(entities)
+    for x, y in [(0, 0), (-250, 40), (450, 450), (3000, 3000)]:
+        found = index.nearby(x, y, radius)
+        ids = [entity.id for entity in found]
+        assert ids == sorted(ids)
+        assert set(ids) >= {entity.id for entity in within(entities, x, y, radius)}
+
+
+def test_nearest_matches_a_scan_of_the_list():
+    entities = scatter(200, 2)
+    # A tie with an earlier entity, which wins as in a first-wins scan
+    entities.append(SimpleNamespace(id=201, x=entities[10].x, y=entities[10].y))
+    index = SpatialHash()
+    index.rebuild(entities)
+    rng = random.Random(3)
+    queries = [(rng.uniform(-600, 1200), rng.uniform(-600, 1200)) for _ in range(200)]
+    queries.append((entities[10].x, entities[10].y))
+    for x, y in queries:
+        expected = min(entities, key=lambda entity: (distance(entity, x, y), entity.id))
+        assert index.nearest(x, y) == (expected, distance(expected, x, y))
+
+
+def test_empty_index_has_nothing_near():
+    index = SpatialHash()
+    assert index.nearest(0, 0) == (None, float("inf"))
+    assert index.nearby(0, 0, 100) == []
+
+
+def test_moves_and_removals_keep_the_index_in_step():
+    entities = scatter(50, 4)
+    index = SpatialHash()
+    index.rebuild(entities)
+    rng = random.Random(5)
+    for entity in entities[:25]:
+        entity.x += rng.uniform(-200, 200)
+        entity.y += rng.uniform(-200, 200)
+        index.move(entity)
+    for entity in entities[25:35]:
+        index.remove(entity)
+    # Removing twice is harmless
+    index.remove(entities[25])
+    kept = entities[:25] + entities[35:]
+    assert len(index) == len(kept)
+    rebuilt = SpatialHash()
+    rebuilt.rebuild(kept)
+    assert {cell: sorted(bucket) for cell, bucket in index.cells.items()} == {
+        cell: sorted(bucket) for cell, bucket in rebuilt.cells.items()
+    }
+
+
+@pytest.mark.parametrize("radius", [5, 30, CELL_SIZE])
+def test_grid_pairs_finds_every_close_pair(radius):
+    rng = np.random.default_rng(6)
+    ax, ay = rng.uniform(-500, 500, (2, 400))
+    bx, by = rng.uniform(-500, 500, (2, 300))
+    rows, columns = grid_pairs(ax, ay, bx, by, radius)
+    found = set(zip(rows.tolist(), columns.tolist()))
+    assert len(found) == len(rows)
+    close = np.hypot(ax[:, None] - bx[None, :], ay[:, None] - by[None, :]) <= radius
+    assert set(zip(*np.nonzero(close))) <= found
+
+
+def test_grid_pairs_limits():
+    empty = np.empty(0)
+    rows, columns = grid_pairs(empty, empty, np.ones(3), np.ones(3), 10)
+    assert len(rows) == len(columns) == 0
+    with pytest.raises(ValueError):
+        grid_pairs(np.ones(1), np.ones(1), np.ones(1), np.ones(1), CELL_SIZE + 1)
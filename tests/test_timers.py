@@ -0,0 +1,59 @@
+from src.timers import TimerQueue
+
+
+def test_equal_deadlines_fire_in_scheduling_order():
+    timers = TimerQueue()
+    for key in ("c", "a", "b"):
+        timers.schedule(key, 5.0)
+    timers.schedule("early", 4.0)
+    assert timers.pop_due(4.5) == ["early"]
+    assert timers.pop_due(5.0) == ["c", "a", "b"]
+    assert len(timers) == 0
+
+
+def test_cancelled_timer_never_fires():
+    timers = TimerQueue()
+    timers.schedule("expiry", 1.0)
+    timers.schedule("spawn", 2.0)
+    timers.cancel("expiry")
+    # Cancelling twice, or a key never scheduled, is fine
+    timers.cancel("expiry")
+    timers.cancel("unknown")
+    assert not timers.scheduled("expiry")
+    assert len(timers) == 1
+    assert timers.pop_due(10.0) == ["spawn"]
+
+
+def test_rearming_replaces_the_pending_timer():
+    timers = TimerQueue()
+    timers.schedule("spawn", 1.0)
+    timers.schedule("spawn", 3.0)
+    assert len(timers) == 1
+    assert timers.pop_due(2.0) == []
+    assert timers.pop_due(3.0) == ["spawn"]
+    # Armed again after firing, and earlier than before
+    timers.schedule("spawn", 5.0)
+    timers.schedule("spawn", 4.0)
+    assert timers.pop_due(4.0) == ["spawn"]
+    assert timers.pop_due(10.0) == []
+
+
+def test_superseded_entries_are_dropped():
+    timers = TimerQueue()
+    for due in range(1000):
+        timers.schedule("spawn", float(due))
+    assert len(timers) == 1
+    assert len(timers.heap) <= 2 * len(timers) + 64
+    assert timers.pop_due(998.0) == []
+    assert timers.pop_due(999.0) == ["spawn"]
+
+
+def test_timers_scheduled_while_firing_wait_for_the_next_call():
+    timers = TimerQueue()
+    timers.schedule("first", 1.0)
+    fired = []
+    for key in timers.pop_due(1.0):
+        fired.append(key)
+        timers.schedule("second", 0.5)
+    assert fired == ["first"]
+    assert timers.pop_due(1.0) == ["second"]
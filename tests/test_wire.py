@@ -0,0 +1,242 @@
+import pytest
+
+from src.wire import (
+    COORD_SCALE,
+    decode_snapshot,
+    encode_snapshot,
+)
+
+U16 = 0xFFFF
+U32 = 0xFFFFFFFF
+# Largest and smallest coordinates that fit an int32 in fixed point
+COORD_MAX = (2**31 - 1) // COORD_SCALE
+COORD_MIN = -(2**31) // COORD_SCALE
+
+
+def tank(**fields):
+    record = {
+        "id": 1,
+        "x": 100.0,
+        "y": 200.0,
+        "angle": 90.0,
+        "health": 100.0,
+        "maxHealth": 100.0,
+        "color": "green",
+        "barrels": 1,
+    }
+    record.update(fields)
+    return record
+
+
+def projectile(**fields):
+    record = {
+        "id": 2,
+        "x": 10.0,
+        "y": 20.0,
+        "angle": 45.0,
+        "owner": 1,
+        "damage": 12.5,
+        "color": "red",
+    }
+    record.update(fields)
+    return record
+
+
+def reward(**fields):
+    record = {
+        "id": 3,
+        "x": 5.0,
+        "y": 6.0,
+        "type": "health",
+        "color": "red",
+        "radius": 15,
+    }
+    record.update(fields)
+    return record
+
+
+def message(**fields):
+    record = {
+        "seq": 7,
+        "keyframe": True,
+        "gameActive": True,
+        "gameOver": False,
+        "completed": False,
+        "winner": None,
+        "map": "arena",
+        "mapWidth": 800,
+        "mapHeight": 600,
+        "currentLevel": 1,
+        "enemiesDefeated": 0,
+        "enemiesRequired": 5,
+        "maxEnemies": 2,
+        "lastInputSeq": 0,
+        "tanks": [],
+        "projectiles": [],
+        "rewards": [],
+    }
+    record.update(fields)
+    return record
+
+
+def round_trip(record):
+    return decode_snapshot(encode_snapshot(record))
+
+
+def test_keyframe_round_trip():
+    sent = message(
+        tanks=[tank(), tank(id=9, color="blue", barrels=3)],
+        projectiles=[projectile()],
+        rewards=[reward()],
+    )
+    received = round_trip(sent)
+    assert "base" not in received and "removed" not in received
+    for key in ("seq", "gameActive", "map", "mapWidth", "enemiesRequired"):
+        assert received[key] == sent[key]
+    assert received["tanks"] == sent["tanks"]
+    assert received["projectiles"] == sent["projectiles"]
+    assert received["rewards"] == sent["rewards"]
+
+
+def test_delta_round_trip():
+    sent = message(
+        keyframe=False,
+        base=3,
+        tanks=[tank(health=42.5)],
+        removed={"tanks": [4, 5], "projectiles": [], "rewards": [U32]},
+    )
+    received = round_trip(sent)
+    assert received["base"] == 3
+    assert received["tanks"] == sent["tanks"]
+    assert received["removed"] == sent["removed"]
+
+
+def test_header_at_field_limits():
+    sent = message(
+        keyframe=False,
+        seq=U32,
+        base=U32,
+        winner=127,
+        currentLevel=255,
+        enemiesDefeated=U16,
+        enemiesRequired=U16,
+        maxEnemies=U16,
+        mapWidth=U16,
+        mapHeight=U16,
+        lastInputSeq=U32,
+        gameOver=True,
+        completed=True,
+        map="m" * 255,
+        removed={"tanks": [], "projectiles": [], "rewards": []},
+    )
+    received = round_trip(sent)
+    for key in (
+        "seq",
+        "base",
+        "winner",
+        "currentLevel",
+        "enemiesDefeated",
+        "mapWidth",
+        "mapHeight",
+        "lastInputSeq",
+        "gameOver",
+        "completed",
+        "map",
+    ):
+        assert received[key] == sent[key]
+
+
+def test_long_names_and_input_sequences_are_clipped():
+    received = round_trip(
+        message(
+            map="m" * 300,
+            lastInputSeq=2**40 + 5,
+            tanks=[tank(powerupMessage="x" * 300)],
+        )
+    )
+    assert received["map"] == "m" * 255
+    assert received["lastInputSeq"] == 5
+    assert received["tanks"][0]["powerupMessage"] == "x" * 255
+
+
+def test_entities_at_field_limits():
+    sent = message(
+        tanks=[
+            tank(
+                id=U32,
+                x=COORD_MAX,
+                y=COORD_MIN,
+                health=U16 / 10,
+                maxHealth=U16 / 10,
+                barrels=255,
+                powerupTime=1e12,
+                powerupDuration=5.0,
+                powerupType="damage",
+                powerupColor="purple",
+                damageBoost=2.5,
+                damageBoostTime=1e12,
+                damageBoostDuration=8.0,
+                damageBoostColor="orange",
+                powerupMessage="Damage up!",
+            )
+        ],
+        projectiles=[projectile(id=U32, damage=U16 / 10)],
+        rewards=[reward(id=U32, radius=255)],
+    )
+    received = round_trip(sent)
+    assert received["tanks"] == sent["tanks"]
+    assert received["projectiles"] == sent["projectiles"]
+    assert received["rewards"] == sent["rewards"]
+
+
+def test_projectile_owner_beyond_uint16():
+    # Tank ids come from the same counter as every other entity
+    sent = message(projectiles=[projectile(owner=70000), projectile(id=3, owner=U32)])
+    assert round_trip(sent)["projectiles"] == sent["projectiles"]
+
+
+@pytest.mark.parametrize("value", [-1, U32 + 1])
+@pytest.mark.parametrize(
+    "record",
+    [
+        lambda value: message(tanks=[tank(id=value)]),
+        lambda value: message(projectiles=[projectile(id=value)]),
+        lambda value: message(projectiles=[projectile(owner=value)]),
+        lambda value: message(rewards=[reward(id=value)]),
+        lambda value: message(
+            keyframe=False,
+            base=1,
+            removed={"tanks": [value], "projectiles": [], "rewards": []},
+        ),
+    ],
+    ids=["tank", "projectile", "owner", "reward", "removed"],
+)
+def test_ids_out_of_range_are_rejected(record, value):
+    with pytest.raises(ValueError):
+        encode_snapshot(record(value))
+
+
+def test_health_is_clamped():
+    received = round_trip(message(tanks=[tank(health=-5, maxHealth=1e6)]))
+    assert received["tanks"][0]["health"] == 0
+    assert received["tanks"][0]["maxHealth"] == U16 / 10
+
+
+def test_coordinates_are_quantized():
+    received = round_trip(message(tanks=[tank(x=1 / 3, y=-2.07, angle=-90)]))
+    record = received["tanks"][0]
+    assert record["x"] == pytest.approx(1 / 3, abs=0.5 / COORD_SCALE)
+    assert record["y"] == pytest.approx(-2.07, abs=0.5 / COORD_SCALE)
+    assert record["angle"] == pytest.approx(270, abs=0.01)
+
+
+def test_unknown_version_is_rejected():
+    data = bytearray(encode_snapshot(message()))
+    data[0] += 1
+    with pytest.raises(ValueError):
+        decode_snapshot(bytes(data))
+
+
+def test_entity_counts_fit_a_uint16():
+    sent = message(rewards=[reward(id=i) for i in range(U16)])
+    assert len(round_trip(sent)["rewards"]) == U16